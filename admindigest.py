@@ -0,0 +1,109 @@
+import threading
+from datetime import datetime
+from time import time
+
+from constants import *
+from spillfile import SpillFile
+
+
+class AdminDigest:
+    """Résumé périodique des commandes livrées, pour les administrateurs.
+
+    Au lieu d'un email par commande, les commandes livrées sont accumulées
+    et envoyées toutes les ADMIN_DIGEST_INTERVAL secondes dans un seul
+    email transactionnel (modèle ADMIN_DIGEST_TEMPLATE_ID), adressé en une
+    requête à tous les administrateurs. Les commandes non envoyées sont
+    sauvegardées dans un fichier local, avec le début de leur période, et
+    rechargées au démarrage suivant : lancé à intervalles (--once), le
+    worker n'envoie un résumé qu'une fois la période écoulée.
+    """
+
+    def __init__(self, env_vars: dict, sender):
+        self.env_vars = env_vars
+        self.sender = sender
+        self.interval = env_vars.get(
+            "ADMIN_DIGEST_INTERVAL", DEFAULTS.get("ADMIN_DIGEST_INTERVAL"))
+        self.template_id = env_vars.get(
+            "ADMIN_DIGEST_TEMPLATE_ID", DEFAULTS.get("ADMIN_DIGEST_TEMPLATE_ID"))
+        self.recipients = [
+            email for email in (env_vars.get("ADMIN_EMAILS") or "").split('|') if email]
+        self.spill_file = SpillFile(ADMIN_DIGEST_SPILL_FILE)
+
+        self.lock = threading.Lock()
+        self.orders = self.spill_file.load()
+        self.started_at = self.spill_file.state.get('started_at') or time()
+
+    def add(self, order: dict):
+        """Add a delivered order to the next digest."""
+        with self.lock:
+            self.orders.append(order)
+
+    def is_due(self):
+        with self.lock:
+            return bool(self.orders) and time() - self.started_at >= self.interval
+
+    def payload(self, orders: list, started_at: float):
+        """Transactional email of a digest, for all the recipients at once."""
+        return {
+            "subscriber_emails": self.recipients,
+            "template_id": self.template_id,
+            "data": {
+                "period_start": datetime.fromtimestamp(started_at).strftime("%Y-%m-%d %H:%M:%S"),
+                "period_end": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "order_count": len(orders),
+                "total_amount": sum(order.get('total_amount') or 0 for order in orders),
+                "currency": "FCFA",
+                "orders": orders,
+                "dashboard_link": self.env_vars.get("DASHBOARD_URL"),
+            },
+            "content_type": "html"
+        }
+
+    def flush(self, force: bool = False):
+        """Send the digest if its window is over (or if forced)."""
+        if not (force or self.is_due()):
+            return True
+        with self.lock:
+            orders = self.orders
+            self.orders = []
+            started_at = self.started_at
+            self.started_at = time()
+        if not orders:
+            return True
+
+        result = self.sender(env_vars=self.env_vars, data=self.payload(orders, started_at))
+        if result and result.get('success'):
+            self.env_vars.get('logger').info(
+                "Admin digest of {} order(s) sent.".format(len(orders)))
+            self.spill_file.remove()
+            return True
+
+        # Remettre les commandes dans le résumé en cours et les sauvegarder localement
+        with self.lock:
+            self.orders = orders + self.orders
+            self.started_at = started_at
+            self.spill()
+        return False
+
+    def spill(self):
+        """Save the orders of the current digest, and when it started (lock held)."""
+        self.spill_file.save(self.orders, {'started_at': self.started_at})
+
+    def close(self, force: bool = True):
+        """Send the pending digest, or keep it on disk for the next run.
+
+        With force (a long-running worker stopping), the digest is sent even
+        if its window is not over. Otherwise (one-shot runs), it is only
+        sent once due, and saved with the start of its window meanwhile.
+        """
+        logger = self.env_vars.get('logger')
+        if force or self.is_due():
+            if not self.flush(force=True):
+                logger.error("{} admin digest order(s) spilled to {}".format(
+                    len(self.orders), self.spill_file.path))
+            return
+        with self.lock:
+            if self.orders:
+                self.spill()
+                logger.info("{} admin digest order(s) kept for the next run in {}".format(
+                    len(self.orders), self.spill_file.path))
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """Cache en mémoire avec durée de vie (TTL) et taille maximale (LRU).
+
+    Utilisable depuis plusieurs threads.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get a value, or the default if it is missing or expired."""
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= monotonic():
+                del self.items[key]
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """Set a value, evicting the least recently used one if full."""
+        with self.lock:
+            self.items[key] = (value, monotonic() + (ttl or self.ttl))
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        """Delete a value."""
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        """Delete all the values."""
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
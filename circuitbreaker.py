@@ -0,0 +1,72 @@
+import logging
+import threading
+from time import monotonic
+
+from constants import *
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Disjoncteur d'un service amont.
+
+    Après un nombre d'échecs consécutifs (erreurs de connexion, 429 ou 5xx),
+    le circuit s'ouvre : les appels échouent immédiatement, sans solliciter
+    le service, pendant reset_timeout secondes. Un seul appel d'essai est
+    ensuite autorisé ; son succès referme le circuit, son échec le rouvre.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(APP_NAME)
+
+    def is_open(self):
+        """Whether calls to the upstream are currently rejected."""
+        with self.lock:
+            if self.state == self.OPEN:
+                return monotonic() - self.opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN
+
+    def allow(self):
+        """Whether a call may be made now (lets one trial call through)."""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.logger.info("Circuit of {} closed.".format(self.name))
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.logger.warning("Circuit of {} opened for {}s after {} failure(s).".format(
+                    self.name, self.reset_timeout, self.failures))
+                self.state = self.OPEN
+                self.opened_at = monotonic()
+
+    def check(self):
+        """Raise CircuitOpenError if no call may be made now."""
+        if not self.allow():
+            raise CircuitOpenError("Circuit of {} is open".format(self.name))
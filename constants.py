@@ -42,7 +42,164 @@ LOG_DIRECTORY = "logs"
 LOG_CONST = "{}, {}"
 DATA_DIRECTORY = "data"
 TEMP_DIRECTORY = "temp"
+TRANSACTION_LOG_SPILL_FILE = "transaction_logs.jsonl"
+SUBSCRIBER_CACHE_FILE = "listmonk_subscribers.json"
+ADMIN_DIGEST_SPILL_FILE = "admin_digest.jsonl"
+TRACE_DIRECTORY = "traces"
+PROFILE_DIRECTORY = "profiles"
+STATE_STORE_FILE = "orders.sqlite3"
 NLIMIT = 3000
 MAX_RETRIES = 3
 
-MINIO_DEFAULT_DURATION = 30
+# Liste Listmonk des clients, et nombre d'emails par recherche d'abonnés
+LISTMONK_CUSTOMER_LIST_ID = 3
+LISTMONK_SEARCH_CHUNK = 100
+
+# Nombre de jours pour la durée des liens signés (7 jours au maximum pour S3)
+MINIO_DEFAULT_DURATION = 7
+
+UPSTREAM_DIRECTUS = "directus"
+UPSTREAM_CINETPAY = "cinetpay"
+UPSTREAM_LISTMONK = "listmonk"
+UPSTREAM_MINIO = "minio"
+UPSTREAM_DEFAULT = "http"
+
+# Paramètres optionnels (valeur par défaut si la variable n'est pas définie)
+DEFAULTS = {
+    "CINETPAY_CHECK_WORKERS": N_PROCESSOR,
+    # Nombre de commandes récupérées par page depuis Directus
+    "DIRECTUS_PAGE_SIZE": NLIMIT,
+    # Nombre de commandes mises à jour par requête PATCH groupée
+    "DIRECTUS_BATCH_SIZE": 500,
+    # Tampon des journaux de transaction : taille et âge (en secondes) maximum
+    "TRANSACTION_LOG_BUFFER_SIZE": 100,
+    "TRANSACTION_LOG_BUFFER_AGE": 10.0,
+    # Cache des produits : durée de vie (en secondes) et nombre maximum
+    "PRODUCT_CACHE_TTL": 600.0,
+    "PRODUCT_CACHE_SIZE": 256,
+    # MinIO : région (évite la requête de localisation du bucket), marge de
+    # sécurité (en secondes) avant expiration des liens signés en cache
+    "MINIO_REGION": "us-east-1",
+    "MINIO_URL_SAFETY_MARGIN": 86400.0,
+    "MINIO_URL_CACHE_SIZE": 1024,
+    # Listmonk : nombre d'abonnés par page, préchargement du cache au démarrage
+    # s'il n'existe pas ou s'il est plus ancien que son âge maximal (en secondes)
+    "LISTMONK_PAGE_SIZE": 1000,
+    "SUBSCRIBER_CACHE_WARM": True,
+    "SUBSCRIBER_CACHE_MAX_AGE": 86400.0,
+    # Ordonnancement des tâches : intervalle, gigue et durée maximale (en secondes).
+    # Avec l'index local, la liste des commandes en attente ne coûte plus
+    # d'appel Directus : la tâche tourne alors toutes les
+    # PENDING_ORDERS_STORE_INTERVAL secondes
+    "PENDING_ORDERS_INTERVAL": 30.0,
+    "PENDING_ORDERS_STORE_INTERVAL": 5.0,
+    "PENDING_ORDERS_JITTER": 1.0,
+    "PENDING_ORDERS_MAX_RUNTIME": 120.0,
+    "ABANDONED_ORDERS_INTERVAL": 3600.0,
+    "ABANDONED_ORDERS_JITTER": 60.0,
+    "ABANDONED_ORDERS_MAX_RUNTIME": 600.0,
+    "NOT_DELIVERED_ORDERS_INTERVAL": 30.0,
+    "NOT_DELIVERED_ORDERS_JITTER": 5.0,
+    "NOT_DELIVERED_ORDERS_MAX_RUNTIME": 600.0,
+    # Délai entre deux vérifications CinetPay selon l'âge de la commande
+    # ("âge:délai|...|délai par défaut", en secondes)
+    "PENDING_POLL_STEPS": "600:5|3600:60|21600:300|86400:900|3600",
+    # Réception des notifications de paiement CinetPay ; la vérification
+    # périodique ne sert alors plus que de rattrapage
+    "CINETPAY_NOTIFY_ENABLED": False,
+    "CINETPAY_NOTIFY_HOST": "0.0.0.0",
+    "CINETPAY_NOTIFY_PORT": 8080,
+    "CINETPAY_NOTIFY_PATH": "/cinetpay/notify",
+    "PENDING_ORDERS_RECONCILE_INTERVAL": 300.0,
+    # Notification des administrateurs : un email par commande livrée (0),
+    # ou un résumé des commandes livrées toutes les ADMIN_DIGEST_INTERVAL
+    # secondes, avec son propre modèle Listmonk
+    "ADMIN_DIGEST_INTERVAL": 0.0,
+    "ADMIN_DIGEST_TEMPLATE_ID": 6,
+    # Inscription groupée des clients d'une page de livraisons : créations en
+    # parallèle, ou import CSV de Listmonk à partir de SUBSCRIBER_IMPORT_THRESHOLD
+    # nouveaux abonnés (0 : jamais), avec l'attente maximale de l'import
+    "SUBSCRIBER_BATCH_WORKERS": 4,
+    "SUBSCRIBER_IMPORT_THRESHOLD": 500,
+    "SUBSCRIBER_IMPORT_TIMEOUT": 300.0,
+    "SUBSCRIBER_IMPORT_POLL_INTERVAL": 1.0,
+    # Pipeline de livraison : taille des files et nombre de threads par étape
+    "DELIVERY_QUEUE_SIZE": 100,
+    "DELIVERY_PRODUCT_WORKERS": 1,
+    "DELIVERY_SUBSCRIBER_WORKERS": 4,
+    "DELIVERY_SIGN_WORKERS": 1,
+    "DELIVERY_EMAIL_WORKERS": 4,
+    "DELIVERY_UPDATE_WORKERS": 2,
+    "DELIVERY_ADMIN_WORKERS": 4,
+    # Répartition entre plusieurs instances : partitionnement des commandes
+    # par hachage de leur id, et/ou réservation (collection des réservations,
+    # de clé "<id de la commande>:<génération>")
+    "WORKER_ID": "",
+    "WORKER_SHARD_COUNT": 1,
+    "WORKER_SHARD_INDEX": 0,
+    "ORDER_LEASE_ENABLED": False,
+    "ORDER_LEASE_DURATION": 300.0,
+    "ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER_CLAIM": "/items/dgeass_order_claim",
+    # Index local (SQLite) des commandes : synchronisation incrémentale sur
+    # date_updated, avec un recouvrement (en secondes) pour les écritures
+    # tardives, et réconciliation complète périodique
+    "STATE_STORE_ENABLED": False,
+    "STATE_SYNC_OVERLAP": 60.0,
+    "STATE_RECONCILE_INTERVAL": 3600.0,
+    # Métriques (format Prometheus) et état de santé : /metrics et /health
+    "METRICS_ENABLED": False,
+    "METRICS_HOST": "0.0.0.0",
+    "METRICS_PORT": 9100,
+    # Traces par cycle (logs/traces) et profilage des premiers cycles, puis
+    # des cycles suivant un signal SIGUSR1 (logs/profiles)
+    "TRACE_ENABLED": False,
+    "PROFILE_CYCLES": 0,
+    "PROFILE_SIGNAL_CYCLES": 3,
+    # Journaux : niveau global et par module ("functions=DEBUG,httpclient=WARNING"),
+    # format (json ou text), console, taille de la file d'écriture, et
+    # échantillonnage des lignes répétitives : au-delà de LOG_SAMPLE_BURST
+    # lignes d'un même message par intervalle, une sur LOG_SAMPLE_EVERY
+    "LOG_LEVEL": "INFO",
+    "LOG_LEVELS": "",
+    "LOG_FORMAT": "json",
+    "LOG_CONSOLE": True,
+    "LOG_QUEUE_SIZE": 10000,
+    "LOG_SAMPLE_BURST": 20,
+    "LOG_SAMPLE_INTERVAL": 60.0,
+    "LOG_SAMPLE_EVERY": 100,
+    # Nouvelles tentatives des appels idempotents (délai exponentiel avec
+    # gigue, en secondes) et disjoncteur par service amont
+    "RETRY_COUNT": MAX_RETRIES,
+    "RETRY_BACKOFF": 0.5,
+    "RETRY_BACKOFF_MAX": 8.0,
+    "CIRCUIT_FAILURE_THRESHOLD": 5,
+    "CIRCUIT_RESET_TIMEOUT": 30.0,
+    # Pool de connexions et délais (en secondes) par service amont. Le
+    # débit (requêtes par seconde, 0 pour aucune limite) et les rafales sont
+    # limités par service ; le nombre de requêtes en vol s'adapte entre le
+    # minimum et la taille du pool (AIMD)
+    "ADAPTIVE_MIN_CONCURRENCY": 1,
+    "ADAPTIVE_INITIAL_CONCURRENCY": 4,
+    "ADAPTIVE_BACKOFF_RATIO": 0.5,
+    "ADAPTIVE_LATENCY_SPIKE": 3.0,
+    "DIRECTUS_POOL_SIZE": 10,
+    "DIRECTUS_CONNECT_TIMEOUT": 5.0,
+    "DIRECTUS_READ_TIMEOUT": 30.0,
+    "DIRECTUS_RATE_LIMIT": 0.0,
+    "DIRECTUS_RATE_BURST": 20,
+    "CINETPAY_POOL_SIZE": 10,
+    "CINETPAY_CONNECT_TIMEOUT": 5.0,
+    "CINETPAY_READ_TIMEOUT": 15.0,
+    "CINETPAY_RATE_LIMIT": 0.0,
+    "CINETPAY_RATE_BURST": 10,
+    "LISTMONK_POOL_SIZE": 10,
+    "LISTMONK_CONNECT_TIMEOUT": 5.0,
+    "LISTMONK_READ_TIMEOUT": 15.0,
+    "LISTMONK_RATE_LIMIT": 0.0,
+    "LISTMONK_RATE_BURST": 10,
+    "HTTP_POOL_SIZE": 10,
+    "HTTP_CONNECT_TIMEOUT": 5.0,
+    "HTTP_READ_TIMEOUT": 30.0,
+    "HTTP_RATE_LIMIT": 0.0,
+    "HTTP_RATE_BURST": 10,
+}
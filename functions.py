@@ -1,234 +1,802 @@
+import threading
+import zlib
 from time import sleep, time
-from joblib import Parallel, delayed
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from constants import *
-from minioservice import MinioService
-from utilities import cinetpay_check_transaction, directus_create_transaction_log, directus_list_abandoned_orders, directus_list_orders, directus_list_orders_with_product_not_delivered, directus_retrieve_product, directus_update_order, listmonk_create_subscriber, listmonk_send_email
+from pipeline import Pipeline, Stage
+from tracing import bind
+from utilities import cinetpay_check_transaction, directus_claim_orders, directus_delete_order_claims, directus_list_abandoned_orders, directus_list_active_order_keys, directus_list_expired_order_claims, directus_list_orders, directus_list_orders_with_product_not_delivered, directus_retrieve_pending_order, directus_retrieve_product, directus_update_order, directus_update_orders, listmonk_create_subscriber, listmonk_get_import_status, listmonk_import_subscribers, listmonk_search_subscribers, listmonk_send_email
+
+
+settle_lock = threading.Lock()
+pipeline_lock = threading.Lock()
+delivery_pipeline = None
+
+
+def check_transactions(env_vars: dict, orders: list):
+    """Vérifier les transactions CinetPay de plusieurs commandes en parallèle.
+
+    Les résultats sont retournés dans le même ordre que les commandes.
+    """
+    n_jobs = min(env_vars.get("CINETPAY_CHECK_WORKERS", N_PROCESSOR), len(orders))
+    if n_jobs <= 1:
+        return [
+            cinetpay_check_transaction(
+                env_vars=env_vars,
+                transaction_code=order.get("code")
+            )
+            for order in orders
+        ]
+
+    # joblib n'est importé que si des vérifications sont parallélisées
+    from joblib import Parallel, delayed
+
+    # Liste construite ici : joblib consomme un générateur depuis ses propres
+    # threads, hors du contexte (trace) du cycle
+    return Parallel(n_jobs=n_jobs, prefer="threads")([
+        delayed(bind(cinetpay_check_transaction))(
+            env_vars=env_vars,
+            transaction_code=order.get("code")
+        )
+        for order in orders
+    ])
+
+
+def in_shard(env_vars: dict, order: dict):
+    """Indiquer si la commande appartient à la partition de cette instance"""
+    shard_count = env_vars.get("WORKER_SHARD_COUNT")
+    if shard_count <= 1:
+        return True
+    return zlib.crc32(str(order.get("id")).encode()) % shard_count == env_vars.get("WORKER_SHARD_INDEX")
+
+
+def claim_orders(env_vars: dict, orders: list):
+    """Garder les commandes que cette instance doit traiter.
+
+    Les commandes hors de la partition de l'instance sont écartées puis, si
+    la réservation est activée, seules les commandes réservées avec succès
+    sont gardées.
+    """
+    orders = [order for order in orders if in_shard(env_vars, order)]
+    if not env_vars.get("ORDER_LEASE_ENABLED") or len(orders) == 0:
+        return orders
+
+    claimed_keys = set(directus_claim_orders(
+        env_vars=env_vars,
+        keys=[order.get("id") for order in orders],
+        owner=env_vars.get("WORKER_ID"),
+        duration=env_vars.get("ORDER_LEASE_DURATION")
+    ))
+    return [order for order in orders if order.get("id") in claimed_keys]
+
+
+def upstream_available(env_vars: dict, upstream: str):
+    """Indiquer si le disjoncteur d'un service amont laisse passer les appels"""
+    if env_vars.get("http").breakers[upstream].is_open():
+        env_vars.get("logger").warning(
+            "Circuit of {} is open, skipping the work depending on it.".format(upstream))
+        return False
+    return True
+
+
+def list_pending_orders(env_vars: dict):
+    """Lister les commandes en attente, depuis l'index local s'il est activé"""
+    store = env_vars.get("orders")
+    if store is not None:
+        return store.list_pending()
+    return directus_list_orders(
+        env_vars=env_vars,
+        transaction_status=TRANSACTION_STATUS_PENDING
+    )
+
+
+def list_abandoned_orders(env_vars: dict):
+    """Lister les commandes abandonnées, depuis l'index local s'il est activé"""
+    store = env_vars.get("orders")
+    if store is not None:
+        return store.list_abandoned()
+    return directus_list_abandoned_orders(env_vars=env_vars)
+
+
+def list_not_delivered_orders(env_vars: dict):
+    """Lister les commandes non livrées, depuis l'index local s'il est activé"""
+    store = env_vars.get("orders")
+    if store is not None:
+        return store.list_not_delivered()
+    return directus_list_orders_with_product_not_delivered(env_vars=env_vars)
+
+
+def record_order_updates(env_vars: dict, keys: list, data: dict):
+    """Reporter dans l'index local les mises à jour faites par le worker"""
+    store = env_vars.get("orders")
+    if store is not None and len(keys) > 0:
+        store.apply(keys, data)
+
+
+def updated_keys(r_dts_upd_orders: dict):
+    """Clés des commandes effectivement mises à jour par directus_update_orders"""
+    return set(
+        key
+        for chunk in r_dts_upd_orders.get('data').get('chunks')
+        if chunk.get('success')
+        for key in chunk.get('keys')
+    )
+
+
+def claim_settlement(env_vars: dict, order: dict):
+    """Réserver le règlement d'une commande.
+
+    Évite qu'une commande soit réglée deux fois lorsque la notification
+    CinetPay et la vérification périodique arrivent en même temps.
+    """
+    settled = env_vars.get("settled")
+    with settle_lock:
+        if settled.get(order.get("id")) is not None:
+            return False
+        settled.set(order.get("id"), True)
+        return True
+
+
+def settle_orders(env_vars: dict, orders: list, rchecks: list):
+    """Mettre à jour les commandes dont la transaction est terminée"""
+    logger = env_vars.get("logger")
+
+    # Commandes à mettre à jour, regroupées par statut cible
+    transitions = {}
+    for order, rcheck in zip(orders, rchecks):
+        if not rcheck or not rcheck.get('success'):
+            logger.error(
+                "Error while checking transaction {}".format(order.get("code")))
+            continue
+        dcheck = rcheck.get("data").get("data")
+        # print(dcheck)
+        current_status = dcheck.get("status")
+
+        o_status = None
+        t_status = None
+
+        logger.debug("Current status of %s is: %s", order.get("code"), current_status)
+
+        if current_status == "ACCEPTED":
+            o_status = ORDER_STATUS_COMPLETED
+            t_status = TRANSACTION_STATUS_ACCEPTED
+        elif current_status == "REFUSED":
+            o_status = ORDER_STATUS_FAILED
+            t_status = TRANSACTION_STATUS_REFUSED
+
+        if t_status in [TRANSACTION_STATUS_ACCEPTED, TRANSACTION_STATUS_REFUSED] \
+                and claim_settlement(env_vars=env_vars, order=order):
+            transitions.setdefault((o_status, t_status), []).append(order)
+
+    for (o_status, t_status), t_orders in transitions.items():
+        # Update the orders status, grouped by target status
+        data = {
+            "status": o_status,
+            "transaction_status": t_status
+        }
+        r_dts_upd_orders = directus_update_orders(
+            env_vars=env_vars,
+            keys=[order.get("id") for order in t_orders],
+            data=data
+        )
+
+        keys = updated_keys(r_dts_upd_orders)
+        record_order_updates(env_vars=env_vars, keys=list(keys), data=data)
+        env_vars.get("metrics").inc(
+            "worker_orders_settled_total", len(keys), status=o_status)
+        for order in t_orders:
+            if order.get("id") in keys:
+                logger.info("Order %s updated with success.", order.get("code"))
+                env_vars.get("transaction_logs").add({
+                    'order': str(order.get("id")),
+                    'status': t_status
+                })
+            else:
+                # Libérer la commande pour qu'elle soit retentée
+                env_vars.get("settled").delete(order.get("id"))
+
+
+def treat_pending_orders_page(env_vars: dict, orders: list):
+    """Traiter une page de commandes en attente"""
+    # Inutile de réserver des commandes que CinetPay ne pourra pas vérifier
+    if not upstream_available(env_vars, UPSTREAM_CINETPAY):
+        return
+    # Ne vérifier que les commandes dont la prochaine vérification est due
+    polling = env_vars.get("polling")
+    tracer = env_vars.get("tracer")
+    orders = [order for order in orders if polling.is_due(order)]
+    with tracer.span("pending.claim", orders=len(orders)):
+        orders = claim_orders(env_vars=env_vars, orders=orders)
+    with tracer.span("pending.check", orders=len(orders)):
+        rchecks = check_transactions(env_vars=env_vars, orders=orders)
+    # Une vérification échouée est retentée au cycle suivant
+    polling.mark_checked([
+        order for order, rcheck in zip(orders, rchecks) if rcheck and rcheck.get('success')])
+    env_vars.get("metrics").inc("worker_orders_checked_total", len(orders))
+
+    with tracer.span("pending.settle", orders=len(orders)):
+        settle_orders(env_vars=env_vars, orders=orders, rchecks=rchecks)
+
+
+def settle_transaction(env_vars: dict, transaction_code: str):
+    """Régler immédiatement la commande d'une transaction (notification CinetPay)"""
+    logger = env_vars.get("logger")
+    r_dts_order = directus_retrieve_pending_order(
+        env_vars=env_vars,
+        code=transaction_code
+    )
+    if not r_dts_order.get('success'):
+        return False
+
+    order = r_dts_order.get('data')
+    if order is None:
+        logger.info("No pending order for transaction %s", transaction_code)
+        return True
+
+    # Régler sous la même réservation que la vérification périodique : une
+    # commande tenue par une autre instance lui est laissée, et CinetPay
+    # renverra la notification si elle est encore en attente
+    if len(claim_orders(env_vars=env_vars, orders=[order])) == 0:
+        logger.info("Order %s is handled by another worker", order.get("code"))
+        return False
+
+    rcheck = cinetpay_check_transaction(
+        env_vars=env_vars,
+        transaction_code=transaction_code
+    )
+    if rcheck.get('success'):
+        env_vars.get("polling").mark_checked([order])
+    env_vars.get("metrics").inc("worker_orders_checked_total")
+    settle_orders(env_vars=env_vars, orders=[order], rchecks=[rcheck])
+    return env_vars.get("transaction_logs").flush()
 
 
 def treat_pending_orders(env_vars: dict):
     """Traiter les commandes en attente"""
     logger = env_vars.get("logger")
     try:
-        r_dts_orders = directus_list_orders(
-            env_vars=env_vars,
-            transaction_status=TRANSACTION_STATUS_PENDING
-        )
+        order_ids = set()
+        for r_dts_orders in list_pending_orders(env_vars=env_vars):
+            if not r_dts_orders.get('success'):
+                return False
 
-        if r_dts_orders.get('success'):
             orders = r_dts_orders.get('data')
-            print('orders', len(orders))
-
-            if len(orders) == 0:
-                logger.info("No transaction to monitor")
-            else:
-                for order in orders:
-                    rcheck = cinetpay_check_transaction(
-                        env_vars=env_vars,
-                        transaction_code=order.get("code")
-                    )
-                    if not rcheck.get('success'):
-                        logger.error(
-                            "Error while checking transaction {}".format(order.get("code")))
-                        continue
-                    dcheck = rcheck.get("data").get("data")
-                    # print(dcheck)
-                    current_status = dcheck.get("status")
-
-                    o_status = None
-                    t_status = None
-
-                    print('Current status of {} is: {}'.format(
-                        order.get("code"), current_status))
-
-                    if current_status == "ACCEPTED":
-                        o_status = ORDER_STATUS_COMPLETED
-                        t_status = TRANSACTION_STATUS_ACCEPTED
-                    elif current_status == "REFUSED":
-                        o_status = ORDER_STATUS_FAILED
-                        t_status = TRANSACTION_STATUS_REFUSED
-
-                    if t_status in [TRANSACTION_STATUS_ACCEPTED, TRANSACTION_STATUS_REFUSED]:
-                        # Update the order status
-                        r_dts_upd_order = directus_update_order(
-                            env_vars=env_vars,
-                            order_id=str(order.get("id")),
-                            data={
-                                "status": o_status,
-                                "transaction_status": t_status
-                            }
-                        )
-
-                        if r_dts_upd_order.get('success'):
-                            logger.info("Order {} updated with success.".format(
-                                order.get("code")))
-                            directus_create_transaction_log(
-                                env_vars=env_vars,
-                                data={
-                                    'order': str(order.get("id")),
-                                    'status': t_status
-                                })
+            logger.debug("%s pending order(s) in page", len(orders))
+            order_ids.update(order.get('id') for order in orders)
+            if len(orders) > 0:
+                treat_pending_orders_page(env_vars=env_vars, orders=orders)
+
+        # Oublier les commandes qui ne sont plus en attente
+        env_vars.get("polling").retain(order_ids)
+        env_vars.get("metrics").set(
+            "worker_orders_backlog", len(order_ids), task="pending")
+        if len(order_ids) == 0:
+            logger.info("No transaction to monitor")
+        return True
 
     except Exception as e:
-        print('Error in treat_pending_orders:', e)
+        logger.exception(LOG_CONST.format("Error in treat_pending_orders: ", str(e)))
+        return False
+    finally:
+        env_vars.get("transaction_logs").flush()
+
+
+def treat_abandoned_orders_page(env_vars: dict, abandoned_orders: list):
+    """Traiter une page de commandes abandonnées"""
+    abandoned_orders = [
+        order for order in abandoned_orders if in_shard(env_vars, order)]
+    if len(abandoned_orders) == 0:
+        return
+    data = {
+        "status": ORDER_STATUS_ABANDONED
+    }
+    order_keys = [order.get("id") for order in abandoned_orders]
+    chunk_size = env_vars.get("DIRECTUS_BATCH_SIZE")
+    keys = set()
+    with env_vars.get("tracer").span("abandoned.update", orders=len(abandoned_orders)):
+        for i in range(0, len(order_keys), chunk_size):
+            # Seules les commandes encore en cours sont abandonnées : une
+            # commande réglée depuis la liste (notification CinetPay, tâche
+            # des commandes en attente) garde son statut
+            r_dts_upd_orders = directus_update_orders(
+                env_vars=env_vars,
+                query={
+                    'filter': {
+                        '_and': [
+                            {'id': {'_in': order_keys[i:i + chunk_size]}},
+                            {'status': {'_eq': ORDER_STATUS_STARTED}},
+                        ]
+                    },
+                    'limit': -1
+                },
+                data=data
+            )
+            keys |= updated_keys(r_dts_upd_orders)
+    record_order_updates(env_vars=env_vars, keys=list(keys), data=data)
+    env_vars.get("metrics").inc("worker_orders_abandoned_total", len(keys))
+
+
+def prune_order_claims(env_vars: dict):
+    """Supprimer les réservations expirées des commandes terminées.
+
+    Une réservation n'est supprimée qu'expirée depuis une durée de
+    réservation entière, et si sa commande n'est plus à traiter : aucune
+    instance ne peut alors être en train de la lire pour la reprendre.
+    """
+    if not env_vars.get("ORDER_LEASE_ENABLED"):
+        return True
+    logger = env_vars.get("logger")
+    before = (datetime.utcnow() - timedelta(seconds=env_vars.get("ORDER_LEASE_DURATION"))
+              ).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    npruned = 0
+    for r_dts_claims in directus_list_expired_order_claims(
+            env_vars=env_vars, before=before, page_size=env_vars.get("DIRECTUS_BATCH_SIZE")):
+        if not r_dts_claims.get('success'):
+            return False
+        claims = r_dts_claims.get('data')
+        if len(claims) == 0:
+            continue
+        r_dts_active = directus_list_active_order_keys(
+            env_vars=env_vars,
+            keys=sorted(set(claim.get('order_id') for claim in claims))
+        )
+        if not r_dts_active.get('success'):
+            return False
+        active = set(str(key) for key in r_dts_active.get('data'))
+        stale = [claim.get('id') for claim in claims if str(claim.get('order_id')) not in active]
+        if len(stale) > 0:
+            if not directus_delete_order_claims(env_vars=env_vars, keys=stale).get('success'):
+                return False
+            npruned += len(stale)
+    if npruned > 0:
+        logger.info("%s order claim(s) pruned", npruned)
+    return True
 
 
 def treat_abandoned_orders(env_vars: dict):
     """Traiter les commandes abandonnées"""
     logger = env_vars.get("logger")
     try:
-        r_dts_abandoned_orders = directus_list_abandoned_orders(
-            env_vars=env_vars,
-        )
+        norders = 0
+        for r_dts_abandoned_orders in list_abandoned_orders(env_vars=env_vars):
+            if not r_dts_abandoned_orders.get('success'):
+                return False
 
-        if r_dts_abandoned_orders.get('success'):
             abandoned_orders = r_dts_abandoned_orders.get('data')
-            print('abandoned_orders', len(abandoned_orders))
-
-            if len(abandoned_orders) == 0:
-                logger.info("No abandoned order to monitor")
-            else:
-                for order in abandoned_orders:
-                    r_dts_upd_order = directus_update_order(
-                        env_vars=env_vars,
-                        order_id=str(order.get("id")),
-                        data={
-                            "status": ORDER_STATUS_ABANDONED
-                        }
-                    )
+            logger.debug("%s abandoned order(s) in page", len(abandoned_orders))
+            norders += len(abandoned_orders)
+            if len(abandoned_orders) > 0:
+                treat_abandoned_orders_page(
+                    env_vars=env_vars, abandoned_orders=abandoned_orders)
+
+        env_vars.get("metrics").set(
+            "worker_orders_backlog", norders, task="abandoned")
+        if norders == 0:
+            logger.info("No abandoned order to monitor")
+        with env_vars.get("tracer").span("abandoned.prune"):
+            return prune_order_claims(env_vars=env_vars)
     except Exception as e:
-        print('Error in treat_abandoned_orders:', e)
+        logger.exception(LOG_CONST.format("Error in treat_abandoned_orders: ", str(e)))
+        return False
+
+
+def get_order_product(env_vars: dict, order: dict):
+    """Récupérer le produit d'une commande
+
+    Le produit est normalement déplié par la requête de listing ; sinon il
+    est lu depuis le cache, puis depuis Directus.
+    """
+    products = env_vars.get("products")
+    product = order.get('tunnel').get('product')
+
+    if isinstance(product, dict):
+        # Remplacer la version en cache si le produit a été modifié
+        cached = products.get(str(product.get('id')))
+        if cached is None or cached.get('date_updated') != product.get('date_updated'):
+            products.set(str(product.get('id')), product)
+        return product
+
+    cached = products.get(str(product))
+    if cached is not None:
+        return cached
+
+    r_dts_product = directus_retrieve_product(
+        env_vars=env_vars,
+        product_id=str(product)
+    )
+    if r_dts_product.get('success'):
+        products.set(str(product), r_dts_product.get('data'))
+        return r_dts_product.get('data')
+    return None
+
+
+def upsert_subscriber(env_vars: dict, data: dict):
+    """Créer l'abonné Listmonk, sauf s'il est déjà connu"""
+    logger = env_vars.get("logger")
+    subscribers = env_vars.get("subscribers")
+    email = data.get("email")
+    if email in subscribers:
+        return
+
+    r_lmk_subscriber = listmonk_create_subscriber(
+        env_vars=env_vars,
+        data=data
+    )
+    if r_lmk_subscriber.get('success'):
+        logger.info("Email subscriber created: %s", email)
+        subscribers.add(email)
+    elif not r_lmk_subscriber.get('success') and r_lmk_subscriber.get('status_code') == 409:
+        logger.info("Email subscriber already exists: %s", email)
+        subscribers.add(email)
+
+
+def create_subscriber(env_vars: dict, data: dict):
+    """Créer un abonné : retourne created, existing ou failed."""
+    r_lmk_subscriber = listmonk_create_subscriber(
+        env_vars=env_vars,
+        data=data
+    )
+    if r_lmk_subscriber.get('success'):
+        env_vars.get("subscribers").add(data.get("email"))
+        return "created"
+    if r_lmk_subscriber.get('status_code') == 409:
+        env_vars.get("subscribers").add(data.get("email"))
+        return "existing"
+    return "failed"
+
+
+def import_subscribers(env_vars: dict, subscribers_data: list):
+    """Importer des abonnés (import CSV de Listmonk) et attendre la fin.
+
+    Retourne le nombre d'abonnés importés, ou None si l'import n'a pas pu
+    être lancé ou suivi jusqu'au bout.
+    """
+    logger = env_vars.get("logger")
+    r_lmk_import = listmonk_import_subscribers(
+        env_vars=env_vars,
+        subscribers=subscribers_data,
+        lists=[LISTMONK_CUSTOMER_LIST_ID]
+    )
+    if not r_lmk_import.get('success'):
+        return None
+
+    deadline = time() + env_vars.get("SUBSCRIBER_IMPORT_TIMEOUT")
+    while time() < deadline:
+        r_lmk_status = listmonk_get_import_status(env_vars=env_vars)
+        status = (r_lmk_status.get('data') or {}).get('status') if r_lmk_status.get('success') else None
+        if status == "finished":
+            return r_lmk_status.get('data').get('imported') or 0
+        if status in ("failed", "stopped"):
+            logger.error("Subscriber import {}".format(status))
+            return None
+        sleep(env_vars.get("SUBSCRIBER_IMPORT_POLL_INTERVAL"))
+    logger.error("Subscriber import still running after {}s".format(
+        env_vars.get("SUBSCRIBER_IMPORT_TIMEOUT")))
+    return None
+
+
+def register_customers(env_vars: dict, orders: list):
+    """Inscrire en une fois les clients d'une page de livraisons.
+
+    Les adresses déjà connues (cache) sont ignorées. Au-delà de
+    SUBSCRIBER_IMPORT_THRESHOLD nouvelles adresses, celles qui existent déjà
+    dans Listmonk sont recherchées, puis les autres importées en CSV ; sinon
+    (ou si l'import échoue), elles sont créées en parallèle. Les étapes du
+    pipeline trouvent ensuite les clients dans le cache. Retourne le nombre
+    d'abonnés créés, existants et en échec.
+    """
+    logger = env_vars.get("logger")
+    subscribers = env_vars.get("subscribers")
+    counts = {"created": 0, "existing": 0, "failed": 0}
+
+    subscribers_data = {}
+    for order in orders:
+        email = order.get('email')
+        if email and email not in subscribers:
+            subscribers_data.setdefault(subscribers.normalize(email), {
+                "email": email,
+                "name": f"{order.get('lastname')} {order.get('firstname')}",
+                "status": "enabled",
+                "lists": [
+                    LISTMONK_CUSTOMER_LIST_ID
+                ]
+            })
+    if not subscribers_data:
+        return counts
+
+    threshold = env_vars.get("SUBSCRIBER_IMPORT_THRESHOLD")
+    if 0 < threshold <= len(subscribers_data):
+        emails = list(subscribers_data)
+        for start in range(0, len(emails), LISTMONK_SEARCH_CHUNK):
+            r_lmk_search = listmonk_search_subscribers(
+                env_vars=env_vars, emails=emails[start:start + LISTMONK_SEARCH_CHUNK])
+            if not r_lmk_search.get('success'):
+                break
+            for email in r_lmk_search.get('data'):
+                if subscribers_data.pop(subscribers.normalize(email), None) is not None:
+                    subscribers.add(email)
+                    counts["existing"] += 1
+        else:
+            imported = import_subscribers(
+                env_vars=env_vars, subscribers_data=list(subscribers_data.values())) \
+                if subscribers_data else 0
+            if imported is not None:
+                counts["created"] += imported
+                counts["failed"] += len(subscribers_data) - imported
+                # Les adresses en échec seront créées une à une à la livraison
+                if imported == len(subscribers_data):
+                    for email in subscribers_data:
+                        subscribers.add(email)
+                subscribers_data = {}
+
+    if subscribers_data:
+        n_jobs = min(env_vars.get("SUBSCRIBER_BATCH_WORKERS"), len(subscribers_data))
+        if n_jobs <= 1:
+            outcomes = [create_subscriber(env_vars=env_vars, data=data)
+                        for data in subscribers_data.values()]
+        else:
+            from joblib import Parallel, delayed
+            outcomes = Parallel(n_jobs=n_jobs, prefer="threads")([
+                delayed(bind(create_subscriber))(env_vars=env_vars, data=data)
+                for data in subscribers_data.values()
+            ])
+        for outcome in outcomes:
+            counts[outcome] += 1
+
+    logger.info("Customers registered: {created} created, {existing} existing, "
+                "{failed} failed".format(**counts))
+    metrics = env_vars.get("metrics")
+    for outcome, count in counts.items():
+        metrics.inc("worker_subscribers_registered_total", count, result=outcome)
+    return counts
+
+
+def prepare_delivery(env_vars: dict, delivery: dict):
+    """Étape 1 : récupérer le produit et les informations du client"""
+    logger = env_vars.get("logger")
+    order = delivery.get('order')
+    # save_json(order, '{}.json'.format(order.get('code')))
+    product = get_order_product(env_vars=env_vars, order=order)
+    if product is None:
+        return None
+    logger.debug("Product %s found for order %s", product.get('code'), order.get('code'))
+    # save_json(product, '{}.json'.format(product.get('code')))
+
+    delivery['product'] = product
+    delivery['customer_email'] = order.get('email')
+    delivery['customer_name'] = f"{order.get('lastname')} {order.get('firstname')}"
+    delivery['order_date'] = str(datetime.strptime(
+        order.get('date_created'), "%Y-%m-%dT%H:%M:%S.%fZ"))
+    return delivery
+
+
+def register_customer(env_vars: dict, delivery: dict):
+    """Étape 2 : inscrire le client dans Listmonk"""
+    subscriber_data = {
+        "email": delivery.get('customer_email'),
+        "name": delivery.get('customer_name'),
+        "status": "enabled",
+        "lists": [
+            LISTMONK_CUSTOMER_LIST_ID
+        ]
+    }
+    upsert_subscriber(env_vars=env_vars, data=subscriber_data)
+    return delivery
+
+
+def sign_product_link(env_vars: dict, delivery: dict):
+    """Étape 3 : générer le lien de téléchargement du produit"""
+    minioservice = env_vars.get("minio")
+    delivery['file_url'] = minioservice.get_file_url(
+        delivery.get('product').get('minio_object_name'))
+    # print('file_url', file_url)
+    return delivery
+
+
+def send_customer_email(env_vars: dict, delivery: dict):
+    """Étape 4 : envoyer le produit au client"""
+    logger = env_vars.get("logger")
+    order = delivery.get('order')
+    customer_email = delivery.get('customer_email')
+    email1_data = {
+        "subscriber_email": customer_email,
+        "template_id": 4,
+        "data": {
+            "order_code": "#{}".format(order.get('code')),
+            "order_date": delivery.get('order_date'),
+            "product_name": delivery.get('product').get('name'),
+            "file_link": delivery.get('file_url')
+        },
+        "content_type": "html"
+    }
+
+    r_lmk_email1 = listmonk_send_email(
+        env_vars=env_vars,
+        data=email1_data
+    )
+    if not r_lmk_email1.get('success'):
+        # L'abonné a pu être supprimé dans Listmonk : le recréer au prochain essai
+        env_vars.get("subscribers").discard(customer_email)
+        return None
+    logger.info("Email sent to customer: %s", customer_email)
+    return delivery
+
+
+def mark_order_delivered(env_vars: dict, delivery: dict):
+    """Étape 5 : marquer la commande comme livrée"""
+    data = {
+        "product_is_delivered": True,
+        "date_delivered": datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # "%Y-%m-%dT%H:%M:%S"
+    }
+    r_dts_upd_order = directus_update_order(
+        env_vars=env_vars,
+        order_id=str(delivery.get('order').get("id")),
+        data=data
+    )
+    if r_dts_upd_order and r_dts_upd_order.get('success'):
+        record_order_updates(
+            env_vars=env_vars, keys=[delivery.get('order').get("id")], data=data)
+        env_vars.get("metrics").inc("worker_orders_delivered_total")
+    return delivery
+
+
+def register_admins(env_vars: dict):
+    """Inscrire les administrateurs dans Listmonk, retourner leurs emails"""
+    emails = [email for email in env_vars.get("ADMIN_EMAILS").split('|') if email]
+    for email in emails:
+        subscriber_data = {
+            "email": email,
+            "name": str(email.split('@')[0]).upper(),
+            "status": "enabled",
+            "lists": [
+                LISTMONK_CUSTOMER_LIST_ID
+            ]
+        }
+        upsert_subscriber(env_vars=env_vars, data=subscriber_data)
+    return emails
+
+
+def notify_admins(env_vars: dict, delivery: dict):
+    """Étape 6 : prévenir les administrateurs
+
+    Un seul email transactionnel est envoyé à tous les administrateurs ; en
+    mode résumé, la commande est seulement ajoutée au prochain résumé.
+    """
+    logger = env_vars.get("logger")
+    order = delivery.get('order')
+    order_data = {
+        "tunnel_code": order.get('tunnel').get('code'),
+        "order_code": "{}".format(order.get('code')),
+        "order_date": delivery.get('order_date'),
+        "total_amount": order.get('tunnel').get('price'),
+        "currency": "FCFA",
+        "customer_name": delivery.get('customer_name'),
+    }
+    emails = register_admins(env_vars=env_vars)
+
+    digest = env_vars.get("admin_digest")
+    if digest is not None:
+        digest.add(order_data)
+        return delivery
+
+    email2_data = {
+        "subscriber_emails": emails,
+        "template_id": 5,
+        "data": {
+            **order_data,
+            "dashboard_link": env_vars.get("DASHBOARD_URL"),
+        },
+        "content_type": "html"
+    }
+    r_lmk_email2 = listmonk_send_email(
+        env_vars=env_vars,
+        data=email2_data
+    )
+    if not r_lmk_email2.get('success'):
+        logger.error("Error while notifying the admins of order {}".format(order.get('code')))
+        for email in emails:
+            env_vars.get("subscribers").discard(email)
+    return delivery
+
+
+# Étapes de la livraison, avec le paramètre donnant leur nombre de threads
+DELIVERY_STAGES = [
+    ("product", prepare_delivery, "DELIVERY_PRODUCT_WORKERS"),
+    ("subscriber", register_customer, "DELIVERY_SUBSCRIBER_WORKERS"),
+    ("sign", sign_product_link, "DELIVERY_SIGN_WORKERS"),
+    ("email", send_customer_email, "DELIVERY_EMAIL_WORKERS"),
+    ("update", mark_order_delivered, "DELIVERY_UPDATE_WORKERS"),
+    ("admin", notify_admins, "DELIVERY_ADMIN_WORKERS"),
+]
+
+
+def get_delivery_pipeline(env_vars: dict):
+    """Récupérer le pipeline de livraison (créé une seule fois)"""
+    global delivery_pipeline
+    with pipeline_lock:
+        if delivery_pipeline is None:
+            delivery_pipeline = Pipeline(
+                env_vars=env_vars,
+                stages=[
+                    Stage(name, func, workers=env_vars.get(workers_key))
+                    for name, func, workers_key in DELIVERY_STAGES
+                ],
+                queue_size=env_vars.get("DELIVERY_QUEUE_SIZE")
+            )
+            env_vars.get("metrics").collect(lambda: [
+                (name, {'stage': stats.get('stage')}, stats.get(key))
+                for stats in delivery_pipeline.stats()
+                for name, key in (("worker_delivery_queue_depth", 'queue_depth'),
+                                  ("worker_delivery_processed_total", 'processed'),
+                                  ("worker_delivery_dropped_total", 'dropped'),
+                                  ("worker_delivery_failed_total", 'failed'))
+            ])
+        return delivery_pipeline
+
+
+def treat_not_delivered_orders_page(env_vars: dict, orders: list):
+    """Traiter une page de commandes non livrées"""
+    # Sans Listmonk, la livraison échouerait à l'envoi de l'email
+    if not upstream_available(env_vars, UPSTREAM_LISTMONK):
+        return
+    pipeline = get_delivery_pipeline(env_vars)
+    tracer = env_vars.get("tracer")
+    with tracer.span("deliver.claim", orders=len(orders)):
+        orders = claim_orders(env_vars=env_vars, orders=orders)
+    # Inscrire tous les clients de la page avant l'envoi des emails
+    with tracer.span("deliver.register", orders=len(orders)):
+        register_customers(env_vars=env_vars, orders=orders)
+    # L'attente de place dans le pipeline est comprise dans ce span ; une
+    # commande encore en cours de livraison n'est pas soumise à nouveau
+    with tracer.span("deliver.submit", orders=len(orders)):
+        for order in orders:
+            if not pipeline.submit({'order': order}, key=order.get("id")):
+                env_vars.get("logger").debug(
+                    "Order %s is still being delivered", order.get("code"))
 
 
 def treat_not_delivered_orders(env_vars: dict):
     """Traiter les commandes non livrées"""
     logger = env_vars.get("logger")
+    pipeline = get_delivery_pipeline(env_vars)
+    norders = 0
     try:
-        r_dts_orders = directus_list_orders_with_product_not_delivered(
-            env_vars=env_vars,
-        )
+        pipeline.begin_cycle()
+        for r_dts_orders in list_not_delivered_orders(env_vars=env_vars):
+            if not r_dts_orders.get('success'):
+                return False
 
-        if r_dts_orders.get('success'):
             orders = r_dts_orders.get('data')
-            print('orders', len(orders))
-
-            if len(orders) == 0:
-                logger.info("No order to deliver")
-            else:
-                for order in orders:
-                    # save_json(order, '{}.json'.format(order.get('code')))
-                    product = None
-
-                    r_dts_product = directus_retrieve_product(
-                        env_vars=env_vars,
-                        product_id=str(order.get('tunnel').get('product'))
-                    )
-                    if r_dts_product.get('success'):
-                        product = r_dts_product.get('data')
-                        print('product', product)
-                        # save_json(product, '{}.json'.format(product.get('code')))
-
-                        customer_email = order.get('email')
-                        customer_name = f"{order.get('lastname')} {order.get('firstname')}"
-
-                        subscriber_data = {
-                            "email": customer_email,
-                            "name": customer_name,
-                            "status": "enabled",
-                            "lists": [
-                                3
-                            ]
-                        }
-
-                        r_lmk_subscriber = listmonk_create_subscriber(
-                            env_vars=env_vars,
-                            data=subscriber_data
-                        )
-                        if r_lmk_subscriber.get('success'):
-                            print('Email subscriber created :', customer_email)
-                        elif not r_lmk_subscriber.get('success') and r_lmk_subscriber.get('status_code') == 409:
-                            print('Email subscriber already exists :',
-                                  customer_email)
-
-                        minioservice = MinioService()
-                        file_url = minioservice.get_file_url(
-                            product.get('minio_object_name'))
-                        order_date = str(datetime.strptime(
-                            order.get('date_created'), "%Y-%m-%dT%H:%M:%S.%fZ"))
-
-                        # print('file_url', file_url)
-                        email1_data = {
-                            "subscriber_email": customer_email,
-                            "template_id": 4,
-                            "data": {
-                                "order_code": "#{}".format(order.get('code')),
-                                "order_date": order_date,
-                                "product_name": product.get('name'),
-                                "file_link": file_url
-                            },
-                            "content_type": "html"
-                        }
-
-                        r_lmk_email1 = listmonk_send_email(
-                            env_vars=env_vars,
-                            data=email1_data
-                        )
-
-                        if r_lmk_email1.get('success'):
-                            print('Email sent to customer :', customer_email)
-
-                            r_dts_upd_order = directus_update_order(
-                                env_vars=env_vars,
-                                order_id=str(order.get("id")),
-                                data={
-                                    "product_is_delivered": True,
-                                    "date_delivered": datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # "%Y-%m-%dT%H:%M:%S"
-                                }
-                            )
-
-                            email2_data = {
-                                "subscriber_email": "",
-                                "template_id": 5,
-                                "data": {
-                                    "tunnel_code": order.get('tunnel').get('code'),
-                                    "order_code": "{}".format(order.get('code')),
-                                    "order_date": order_date,
-                                    "total_amount": order.get('tunnel').get('price'),
-                                    "currency": "FCFA",
-                                    "customer_name": customer_name,
-                                    "dashboard_link": env_vars.get("DASHBOARD_URL"),
-                                },
-                                "content_type": "html"
-                            }
-
-                            admin_emails = env_vars.get("ADMIN_EMAILS")
-                            emails = admin_emails.split('|')
-
-                            for email in emails:
-                                subscriber_data = {
-                                    "email": email,
-                                    "name": str(email.split('@')[0]).upper(),
-                                    "status": "enabled",
-                                    "lists": [
-                                        3
-                                    ]
-                                }
-                                r_lmk_subscriber = listmonk_create_subscriber(
-                                    env_vars=env_vars,
-                                    data=subscriber_data
-                                )
-                                if r_lmk_subscriber.get('success'):
-                                    print('Email subscriber created :', email)
-                                elif not r_lmk_subscriber.get('success') and r_lmk_subscriber.get('status_code') == 409:
-                                    print(
-                                        'Email subscriber already exists :', email)
-
-                                email2_data["subscriber_email"] = email
-                                listmonk_send_email(
-                                    env_vars=env_vars,
-                                    data=email2_data
-                                )
+            logger.debug("%s order(s) to deliver in page", len(orders))
+            norders += len(orders)
+            if len(orders) > 0:
+                treat_not_delivered_orders_page(
+                    env_vars=env_vars, orders=orders)
+
+        env_vars.get("metrics").set(
+            "worker_orders_backlog", norders, task="deliver")
+        if norders == 0:
+            logger.info("No order to deliver")
+        return True
 
     except Exception as e:
-        print('Error in treat_not_delivered:', e)
+        logger.exception(LOG_CONST.format("Error in treat_not_delivered: ", str(e)))
+        return False
+    finally:
+        # Attendre la fin des livraisons de ce cycle, même si la liste a
+        # échoué en cours de route : sinon le cycle suivant trouverait les
+        # commandes déjà soumises encore à livrer
+        if norders > 0:
+            with env_vars.get("tracer").span("deliver.wait"):
+                pipeline.join()
+            for stats in pipeline.stats():
+                logger.info("Delivery stage {stage}: {cycle_processed} processed this cycle "
+                            "({throughput:.2f}/s, capacity {capacity:.2f}/s), {dropped} dropped, "
+                            "{failed} failed, queue depth {queue_depth}, "
+                            "{avg_duration:.3f}s/item".format(**stats))
+        # Envoyer le résumé des administrateurs si sa période est écoulée
+        if env_vars.get("admin_digest") is not None:
+            register_admins(env_vars=env_vars)
+            env_vars.get("admin_digest").flush()
+        env_vars.get("subscribers").save()
@@ -0,0 +1,210 @@
+import base64
+import random
+from time import perf_counter, sleep
+from urllib.parse import urlparse
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+
+from circuitbreaker import CircuitBreaker, CircuitOpenError
+from constants import *
+from metrics import Metrics
+from ratelimit import AdaptiveLimiter, TokenBucket
+from tracing import Tracer
+
+
+# Méthodes pouvant être rejouées sans effet de bord supplémentaire
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Réponses signalant un service amont indisponible ou surchargé
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """Client HTTP partagé par tous les appels vers les services amont.
+
+    Chaque service amont (Directus, CinetPay, Listmonk, ...) dispose de sa
+    propre session : les connexions keep-alive sont réutilisées par hôte, la
+    taille du pool et les délais (connexion, lecture) sont configurables, et
+    les en-têtes communs sont calculés une seule fois.
+
+    Les appels idempotents sont rejoués après une erreur de connexion ou une
+    réponse 429/5xx, avec un délai exponentiel et une gigue. Chaque service
+    amont a son disjoncteur : tant qu'il est ouvert, les appels échouent
+    immédiatement avec CircuitOpenError.
+
+    Chaque envoi passe enfin par le limiteur de débit du service amont, puis
+    par sa limite adaptative de requêtes en vol, bornée par la taille du
+    pool de connexions.
+    """
+
+    def __init__(self, env_vars: dict):
+        self.sessions = {}
+        self.timeouts = {}
+        self.breakers = {}
+        self.buckets = {}
+        self.limiters = {}
+        self.metrics = env_vars.get("metrics") or Metrics()
+        self.metrics.collect(self.collect)
+        self.tracer = env_vars.get("tracer") or Tracer(env_vars)
+        self.retry_count = env_vars.get("RETRY_COUNT", DEFAULTS.get("RETRY_COUNT"))
+        self.retry_backoff = env_vars.get("RETRY_BACKOFF", DEFAULTS.get("RETRY_BACKOFF"))
+        self.retry_backoff_max = env_vars.get(
+            "RETRY_BACKOFF_MAX", DEFAULTS.get("RETRY_BACKOFF_MAX"))
+        failure_threshold = env_vars.get(
+            "CIRCUIT_FAILURE_THRESHOLD", DEFAULTS.get("CIRCUIT_FAILURE_THRESHOLD"))
+        reset_timeout = env_vars.get(
+            "CIRCUIT_RESET_TIMEOUT", DEFAULTS.get("CIRCUIT_RESET_TIMEOUT"))
+
+        common_headers = {
+            'Accept-Encoding': 'gzip',
+        }
+        json_headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        }
+
+        basic_token = base64.b64encode(
+            f"{env_vars.get('LISTMONK_API_USERNAME')}:{env_vars.get('LISTMONK_API_PASSWORD')}"
+            .encode()
+        ).decode('utf-8')
+
+        upstream_headers = {
+            UPSTREAM_DIRECTUS: json_headers,
+            UPSTREAM_CINETPAY: {'Content-Type': 'application/json'},
+            UPSTREAM_LISTMONK: {
+                **json_headers,
+                'Authorization': f'Basic {basic_token}'
+            },
+            UPSTREAM_DEFAULT: {},
+        }
+
+        for upstream, headers in upstream_headers.items():
+            prefix = upstream.upper()
+            pool_size = env_vars.get(f"{prefix}_POOL_SIZE", DEFAULTS.get(f"{prefix}_POOL_SIZE"))
+
+            session = rq.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(common_headers)
+            session.headers.update(headers)
+
+            self.sessions[upstream] = session
+            self.timeouts[upstream] = (
+                env_vars.get(f"{prefix}_CONNECT_TIMEOUT", DEFAULTS.get(f"{prefix}_CONNECT_TIMEOUT")),
+                env_vars.get(f"{prefix}_READ_TIMEOUT", DEFAULTS.get(f"{prefix}_READ_TIMEOUT")),
+            )
+            self.buckets[upstream] = TokenBucket(
+                env_vars.get(f"{prefix}_RATE_LIMIT", DEFAULTS.get(f"{prefix}_RATE_LIMIT")),
+                env_vars.get(f"{prefix}_RATE_BURST", DEFAULTS.get(f"{prefix}_RATE_BURST")),
+            )
+            self.limiters[upstream] = AdaptiveLimiter(
+                upstream,
+                max_limit=pool_size,
+                min_limit=env_vars.get("ADAPTIVE_MIN_CONCURRENCY", DEFAULTS.get("ADAPTIVE_MIN_CONCURRENCY")),
+                initial=env_vars.get("ADAPTIVE_INITIAL_CONCURRENCY", DEFAULTS.get("ADAPTIVE_INITIAL_CONCURRENCY")),
+                backoff_ratio=env_vars.get("ADAPTIVE_BACKOFF_RATIO", DEFAULTS.get("ADAPTIVE_BACKOFF_RATIO")),
+                latency_spike=env_vars.get("ADAPTIVE_LATENCY_SPIKE", DEFAULTS.get("ADAPTIVE_LATENCY_SPIKE")),
+            )
+
+        # MinIO n'utilise pas ces sessions, mais partage le même mécanisme
+        for upstream in list(upstream_headers) + [UPSTREAM_MINIO]:
+            self.breakers[upstream] = CircuitBreaker(
+                upstream, failure_threshold, reset_timeout)
+
+    def backoff(self, attempt: int, res=None):
+        """Delay before the next attempt (Retry-After if the upstream sent one)."""
+        retry_after = res.headers.get('Retry-After') if res is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.retry_backoff_max)
+        return random.uniform(0, min(self.retry_backoff * 2 ** attempt, self.retry_backoff_max))
+
+    def collect(self):
+        """Gauges of the circuit breakers and concurrency limiters."""
+        gauges = []
+        for upstream, breaker in self.breakers.items():
+            gauges.append(("worker_upstream_circuit_open",
+                           {'upstream': upstream}, int(breaker.is_open())))
+        for upstream, limiter in self.limiters.items():
+            stats = limiter.stats()
+            gauges.append(("worker_upstream_concurrency_limit",
+                           {'upstream': upstream}, stats.get('limit')))
+            gauges.append(("worker_upstream_inflight_requests",
+                           {'upstream': upstream}, stats.get('inflight')))
+        return gauges
+
+    def send(self, upstream: str, method: str, url: str, **kwargs):
+        """Send one request, within the rate and concurrency limits."""
+        self.buckets[upstream].acquire()
+        limiter = self.limiters[upstream]
+        limiter.acquire()
+        started = perf_counter()
+        overloaded = True
+        status = "error"
+        try:
+            with self.tracer.span(upstream, method=method, path=urlparse(url).path) as span:
+                res = self.sessions[upstream].request(method, url, **kwargs)
+                span['status'] = res.status_code
+            overloaded = res.status_code in RETRY_STATUSES
+            status = str(res.status_code)
+            return res
+        finally:
+            duration = perf_counter() - started
+            limiter.release(duration, overloaded=overloaded)
+            self.metrics.observe("worker_upstream_request_duration_seconds",
+                                 duration, upstream=upstream)
+            self.metrics.inc("worker_upstream_requests_total",
+                             upstream=upstream, status=status)
+            if overloaded:
+                self.metrics.inc("worker_upstream_errors_total", upstream=upstream,
+                                 kind="connection" if status == "error" else status)
+
+    def request(self, upstream: str, method: str, url: str, idempotent: bool = None, **kwargs):
+        """Make a request through the session of the given upstream.
+
+        Calls are only retried when idempotent (by default: GET, HEAD,
+        OPTIONS, PUT, DELETE), except when the connection could not even be
+        established.
+        """
+        kwargs.setdefault('timeout', self.timeouts[upstream])
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        breaker = self.breakers[upstream]
+
+        attempt = 0
+        while True:
+            try:
+                breaker.check()
+            except CircuitOpenError:
+                self.metrics.inc("worker_upstream_errors_total",
+                                 upstream=upstream, kind="circuit_open")
+                raise
+            try:
+                res = self.send(upstream, method, url, **kwargs)
+            except (rq.exceptions.ConnectionError, rq.exceptions.Timeout) as e:
+                breaker.record_failure()
+                retryable = idempotent or isinstance(e, rq.exceptions.ConnectTimeout)
+                if not retryable or attempt >= self.retry_count:
+                    raise
+                sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                # Toute autre erreur compte aussi : un appel d'essai ne doit
+                # jamais laisser le circuit à moitié ouvert
+                breaker.record_failure()
+                raise
+
+            if res.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return res
+            breaker.record_failure()
+            if not idempotent or attempt >= self.retry_count:
+                return res
+            sleep(self.backoff(attempt, res))
+            attempt += 1
+
+    def close(self):
+        """Close all the sessions."""
+        for session in self.sessions.values():
+            session.close()
@@ -0,0 +1,43 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+
+class BackgroundServer:
+    """Serveur HTTP embarqué, servi par un thread en arrière-plan.
+
+    Les sous-classes donnent le gestionnaire des requêtes (handler_class)
+    et le nom du thread, et placent sur le serveur ce dont le gestionnaire
+    a besoin (attach).
+    """
+
+    handler_class = None
+    thread_name = "http"
+
+    def __init__(self, env_vars: dict, host: str, port: int):
+        self.env_vars = env_vars
+        self.logger = env_vars.get('logger')
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def attach(self, server: ThreadingHTTPServer):
+        """Give the request handlers what they need, through the server."""
+
+    def start(self):
+        """Start listening in a background thread."""
+        self.server = ThreadingHTTPServer((self.host, self.port), self.handler_class)
+        self.server.daemon_threads = True
+        self.attach(self.server)
+        # Port réellement utilisé (utile avec le port 0)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name=self.thread_name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop listening."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
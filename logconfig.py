@@ -0,0 +1,193 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from time import monotonic
+
+from constants import *
+from tracing import current_trace
+
+
+# Attributs standard d'un LogRecord (les autres viennent de extra=...)
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+# Nombre de groupes de lignes suivis avant d'oublier les plus anciens
+SAMPLING_MAX_GROUPS = 10000
+
+
+def to_level(name: str, default: int = logging.INFO):
+    level = logging.getLevelName(str(name).strip().upper())
+    return level if isinstance(level, int) else default
+
+
+def parse_levels(levels: str):
+    """Parse "module=LEVEL,module=LEVEL" into {module: level}."""
+    parsed = {}
+    for item in levels.split(','):
+        if '=' in item:
+            module, level = item.split('=', 1)
+            parsed[module.strip()] = to_level(level)
+    return parsed
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON compacte par enregistrement."""
+
+    def format(self, record: logging.LogRecord):
+        data = {
+            'ts': datetime.utcfromtimestamp(record.created).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            'level': record.levelname,
+            'module': record.module,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, separators=(',', ':'), default=str)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Niveau minimum par module (nom du fichier source), sinon niveau global."""
+
+    def __init__(self, level: int, levels: dict):
+        super().__init__()
+        self.level = level
+        self.levels = levels
+
+    def filter(self, record: logging.LogRecord):
+        return record.levelno >= self.levels.get(record.module, self.level)
+
+
+class SamplingFilter(logging.Filter):
+    """Limite les lignes répétitives (sous WARNING).
+
+    Les lignes sont regroupées par module et par message avant mise en forme
+    (le modèle, pas ses arguments) : au-delà de burst lignes d'un même
+    groupe par intervalle, seule une ligne sur every est gardée (aucune si
+    every vaut 0). La ligne gardée suivante porte le nombre de lignes
+    supprimées (champ suppressed).
+    """
+
+    def __init__(self, burst: int, interval: float, every: int):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.every = every
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord):
+        if record.levelno >= logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.module, str(record.msg))
+        now = monotonic()
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None or now - group[0] >= self.interval:
+                if group is None and len(self.groups) >= SAMPLING_MAX_GROUPS:
+                    self.groups = {k: g for k, g in self.groups.items()
+                                   if now - g[0] < self.interval}
+                # [début de l'intervalle, lignes vues, lignes supprimées]
+                group = self.groups[key] = [now, 0, group[2] if group else 0]
+            group[1] += 1
+            excess = group[1] - self.burst
+            if excess > 0 and (self.every <= 0 or excess % self.every):
+                group[2] += 1
+                return False
+            if group[2]:
+                record.suppressed = group[2]
+                group[2] = 0
+            return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Met les enregistrements en file sans jamais attendre.
+
+    Le message est calculé dans le thread appelant, la mise en forme et
+    l'écriture se font dans le thread d'écriture. Si la file est pleine
+    (disque ou console bloqués), l'enregistrement est abandonné et compté.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        # Le thread d'écriture n'a pas le contexte de l'appelant
+        trace = current_trace.get()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(env_vars: dict):
+    """Configure the application logger, once.
+
+    Records go through a bounded queue to a background thread writing them
+    to the daily file of LOG_DIRECTORY and to the console.
+    """
+    logger = logging.getLogger(APP_NAME)
+    if logger.handlers:
+        return logger
+
+    def get(key):
+        return env_vars.get(key, DEFAULTS.get(key))
+
+    level = to_level(get("LOG_LEVEL"))
+    levels = parse_levels(get("LOG_LEVELS"))
+    logger.setLevel(min([level] + list(levels.values())))
+    logger.propagate = False
+
+    if get("LOG_FORMAT") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    os.makedirs(LOG_DIRECTORY, exist_ok=True)
+    # Création d'un gestionnaire de fichiers rotatif basé sur la date
+    handlers = [TimedRotatingFileHandler(
+        os.path.join(LOG_DIRECTORY, datetime.now().strftime("%Y-%m-%d.log")),
+        when="midnight", interval=1, backupCount=3)]
+    if get("LOG_CONSOLE"):
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=get("LOG_QUEUE_SIZE")))
+    queue_handler.addFilter(ModuleLevelFilter(level, levels))
+    queue_handler.addFilter(SamplingFilter(
+        get("LOG_SAMPLE_BURST"), get("LOG_SAMPLE_INTERVAL"), get("LOG_SAMPLE_EVERY")))
+    queue_handler.listener = QueueListener(queue_handler.queue, *handlers)
+    queue_handler.listener.start()
+    # Écrire les enregistrements en file à l'arrêt
+    atexit.register(queue_handler.listener.stop)
+    logger.addHandler(queue_handler)
+    return logger
+
+
+def dropped_records(logger: logging.Logger):
+    """Records dropped because the log queue was full."""
+    return sum(handler.dropped for handler in logger.handlers
+               if isinstance(handler, NonBlockingQueueHandler))
@@ -0,0 +1,225 @@
+import json
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler
+from time import time
+from urllib.parse import urlparse
+
+from constants import *
+from httpserver import BackgroundServer
+
+
+# Bornes des histogrammes de durée, en secondes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Métriques du worker : type et description
+DESCRIPTIONS = {
+    "worker_orders_checked_total": ("counter", "Pending orders whose transaction was checked."),
+    "worker_orders_settled_total": ("counter", "Orders settled, by new status."),
+    "worker_orders_abandoned_total": ("counter", "Orders marked as abandoned."),
+    "worker_orders_delivered_total": ("counter", "Orders whose product was delivered."),
+    "worker_subscribers_registered_total": ("counter", "Customers registered before delivery, by result (created, existing, failed)."),
+    "worker_orders_backlog": ("gauge", "Orders listed during the last cycle of each task."),
+    "worker_log_records_dropped_total": ("counter", "Log records dropped because the log queue was full."),
+    "worker_transaction_logs_buffered": ("gauge", "Transaction logs waiting to be written."),
+    "worker_upstream_request_duration_seconds": ("histogram", "Duration of the requests to each upstream."),
+    "worker_upstream_requests_total": ("counter", "Requests to each upstream, by status code."),
+    "worker_upstream_errors_total": ("counter", "Failed requests to each upstream (connection, 429, 5xx, circuit open)."),
+    "worker_upstream_circuit_open": ("gauge", "Whether the circuit of each upstream is open."),
+    "worker_upstream_concurrency_limit": ("gauge", "Adaptive concurrency limit of each upstream."),
+    "worker_upstream_inflight_requests": ("gauge", "Requests in flight to each upstream."),
+    "worker_task_duration_seconds": ("histogram", "Duration of the cycles of each task."),
+    "worker_task_runs_total": ("counter", "Cycles of each task, by result."),
+    "worker_task_seconds_since_last_success": ("gauge", "Time since the last successful cycle of each task."),
+    "worker_delivery_queue_depth": ("gauge", "Items waiting in front of each delivery stage."),
+    "worker_delivery_processed_total": ("counter", "Items processed by each delivery stage."),
+    "worker_delivery_dropped_total": ("counter", "Items a delivery stage stopped (not passed to the next stage)."),
+    "worker_delivery_failed_total": ("counter", "Items that failed in each delivery stage."),
+}
+
+
+def format_labels(labels: tuple):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + "}"
+
+
+def labels_key(sample: tuple):
+    """Sort key of a (labels, value) sample: label values compared as text."""
+    return tuple((key, str(value)) for key, value in sample[0])
+
+
+class Metrics:
+    """Registre de métriques en mémoire, exposé au format texte Prometheus.
+
+    Compteurs, jauges et histogrammes sont identifiés par leur nom et leurs
+    étiquettes. Les jauges calculées (taille des files, état des
+    disjoncteurs, ...) sont des fonctions appelées seulement à l'export.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.descriptions = dict(DESCRIPTIONS)
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, description: str):
+        self.descriptions[name] = (kind, description)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increment a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """Add an observation to a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(DURATION_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect_left(DURATION_BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def collect(self, func):
+        """Register a function returning [(name, labels, value), ...] gauges."""
+        self.collectors.append(func)
+
+    def register_task(self, name: str, max_age: float):
+        """Declare a scheduled task, unhealthy if it has not succeeded for max_age seconds."""
+        with self.lock:
+            self.tasks[name] = {'max_age': max_age, 'started_at': time(), 'last_success': None}
+
+    def task_done(self, name: str, duration: float, success: bool):
+        """Record a cycle of a scheduled task."""
+        self.observe("worker_task_duration_seconds", duration, task=name)
+        self.inc("worker_task_runs_total", task=name, result="success" if success else "failure")
+        if success:
+            with self.lock:
+                self.tasks.setdefault(name, {'max_age': None, 'started_at': time()})[
+                    'last_success'] = time()
+
+    def health(self):
+        """Health of the scheduled tasks, and whether they are all healthy."""
+        now = time()
+        tasks = {}
+        healthy = True
+        with self.lock:
+            for name, task in self.tasks.items():
+                since = task.get('last_success') or task.get('started_at')
+                age = now - since
+                ok = task.get('max_age') is None or age <= task.get('max_age')
+                healthy = healthy and ok
+                tasks[name] = {
+                    'healthy': ok,
+                    'seconds_since_last_success': round(age, 3) if task.get('last_success') else None,
+                }
+        return healthy, tasks
+
+    def render(self):
+        """Export all the metrics in the Prometheus text format."""
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            for (name, labels), value in self.gauges.items():
+                samples.setdefault(name, []).append((labels, value))
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+            tasks = {name: dict(task) for name, task in self.tasks.items()}
+
+        now = time()
+        for name, task in tasks.items():
+            if task.get('last_success') is not None:
+                samples.setdefault("worker_task_seconds_since_last_success", []).append(
+                    ((('task', name),), now - task.get('last_success')))
+        for func in self.collectors:
+            for name, labels, value in func():
+                samples.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+
+        lines = []
+        for name in sorted(samples):
+            kind, description = self.descriptions.get(name, ("untyped", name))
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in sorted(samples[name], key=labels_key):
+                lines.append("{}{} {}".format(name, format_labels(labels), value))
+
+        by_name = {}
+        for (name, labels), histogram in histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            kind, description = self.descriptions.get(name, ("histogram", name))
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} histogram".format(name))
+            for labels, (buckets, total, count) in sorted(by_name[name], key=labels_key):
+                cumulative = 0
+                for bound, n in zip(DURATION_BUCKETS + ("+Inf",), buckets):
+                    cumulative += n
+                    lines.append("{}_bucket{} {}".format(
+                        name, format_labels(labels + (('le', bound),)), cumulative))
+                lines.append("{}_sum{} {}".format(name, format_labels(labels), total))
+                lines.append("{}_count{} {}".format(name, format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Routes /metrics et /health."""
+
+    server_version = APP_NAME
+
+    def reply(self, status_code: int, body: str, content_type: str):
+        data = body.encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            return self.reply(200, metrics.render(), 'text/plain; version=0.0.4; charset=utf-8')
+        if path == '/health':
+            healthy, tasks = metrics.health()
+            return self.reply(
+                200 if healthy else 503,
+                json.dumps({'status': 'ok' if healthy else 'unhealthy', 'tasks': tasks}),
+                'application/json')
+        self.reply(404, 'Not found', 'text/plain; charset=utf-8')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(BackgroundServer):
+    """Serveur HTTP embarqué exposant les métriques et l'état de santé."""
+
+    handler_class = MetricsHandler
+    thread_name = "metrics"
+
+    def __init__(self, env_vars: dict, host: str = None, port: int = None):
+        super().__init__(
+            env_vars,
+            host if host is not None else env_vars.get("METRICS_HOST"),
+            port if port is not None else env_vars.get("METRICS_PORT"))
+
+    def attach(self, server):
+        server.metrics = self.env_vars.get("metrics")
+
+    def start(self):
+        super().start()
+        self.logger.info("Serving metrics on {}:{}/metrics".format(self.host, self.port))
@@ -1,18 +1,23 @@
+import logging
 import os
 import uuid
 from datetime import timedelta
-from minio import Minio
-from minio.error import S3Error
+import threading
+from typing import Optional
 
-from utilities import get_env_vars
-
-MINIO_DEFAULT_DURATION = 7  # Nombre de jours pour la durée par défaut des liens signés
+from cache import TTLCache
+from circuitbreaker import CircuitBreaker
+from constants import *
+from tracing import Tracer
 
 
 class MinioService:
-    def __init__(self):
-        env_vars = get_env_vars()
+    def __init__(self, env_vars: Optional[dict] = None):
+        if env_vars is None:
+            from utilities import get_env_vars
+            env_vars = get_env_vars()
 
+        self.logger = env_vars.get("logger") or logging.getLogger(APP_NAME)
         self.minio_proxy = env_vars.get("MINIO_PROXY")
         self.minio_host = env_vars.get("MINIO_HOST")
         # Valeur par défaut
@@ -21,14 +26,64 @@ class MinioService:
         self.minio_access = env_vars.get("MINIO_ACCESS_KEY")
         self.minio_secret = env_vars.get("MINIO_SECRET_KEY")
         self.minio_bucket = env_vars.get("MINIO_BUCKET_NAME")
-
-        self.minio_client = Minio(
-            f"{self.minio_host}:{self.minio_port}",
-            access_key=self.minio_access,
-            secret_key=self.minio_secret,
-            secure=self.minio_secure
+        # Région fixée : la signature des liens se fait sans appel réseau
+        self.minio_region = env_vars.get(
+            "MINIO_REGION", DEFAULTS.get("MINIO_REGION"))
+
+        # Client créé (et minio importé) à la première utilisation
+        self._minio_client = None
+        self.client_lock = threading.Lock()
+
+        # Disjoncteur partagé avec le client HTTP s'il existe
+        http = env_vars.get("http")
+        self.breaker = http.breakers[UPSTREAM_MINIO] if http is not None else CircuitBreaker(
+            UPSTREAM_MINIO,
+            env_vars.get("CIRCUIT_FAILURE_THRESHOLD", DEFAULTS.get("CIRCUIT_FAILURE_THRESHOLD")),
+            env_vars.get("CIRCUIT_RESET_TIMEOUT", DEFAULTS.get("CIRCUIT_RESET_TIMEOUT")))
+
+        self.tracer = env_vars.get("tracer") or Tracer(env_vars)
+
+        # Liens signés réutilisés jusqu'à une marge de sécurité avant expiration
+        self.url_duration = timedelta(days=MINIO_DEFAULT_DURATION)
+        url_margin = env_vars.get(
+            "MINIO_URL_SAFETY_MARGIN", DEFAULTS.get("MINIO_URL_SAFETY_MARGIN"))
+        self.urls = TTLCache(
+            ttl=max(self.url_duration.total_seconds() - url_margin, 1),
+            maxsize=env_vars.get("MINIO_URL_CACHE_SIZE", DEFAULTS.get("MINIO_URL_CACHE_SIZE"))
         )
 
+    @property
+    def minio_client(self):
+        """MinIO client, created on first use."""
+        with self.client_lock:
+            if self._minio_client is None:
+                from minio import Minio
+                self._minio_client = Minio(
+                    f"{self.minio_host}:{self.minio_port}",
+                    access_key=self.minio_access,
+                    secret_key=self.minio_secret,
+                    secure=self.minio_secure,
+                    region=self.minio_region
+                )
+            return self._minio_client
+
+    def call(self, func, *args, **kwargs):
+        """Call the MinIO client through the circuit breaker."""
+        from minio.error import S3Error
+        self.breaker.check()
+        try:
+            with self.tracer.span(UPSTREAM_MINIO, operation=func.__name__):
+                result = func(*args, **kwargs)
+        except S3Error:
+            # MinIO a répondu : le service est disponible
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
     def generate_uuid(self):
         return str(uuid.uuid4())
 
@@ -42,7 +97,8 @@ class MinioService:
         }
 
         # Upload du fichier
-        self.minio_client.put_object(
+        self.call(
+            self.minio_client.put_object,
             self.minio_bucket,
             object_name,
             file.stream,
@@ -61,30 +117,38 @@ class MinioService:
         }
 
     def get_file_url(self, object_name):
-        file_url = self.minio_client.presigned_get_object(
-            self.minio_bucket,
-            object_name,
-            expires=timedelta(days=MINIO_DEFAULT_DURATION)
-        )
+        file_url = self.urls.get(object_name)
+        if file_url is not None:
+            return file_url
+
+        with self.tracer.span("minio.presign"):
+            file_url = self.minio_client.presigned_get_object(
+                self.minio_bucket,
+                object_name,
+                expires=self.url_duration
+            )
         # Remplacer l'hôte et le port de MinIO par le proxy
         file_url = file_url.replace(
             f"http://{self.minio_host}:{self.minio_port}",
             f"https://{self.minio_proxy}"
         )
+        self.urls.set(object_name, file_url)
         return file_url
 
     def get_file(self, object_name):
+        from minio.error import S3Error
         try:
-            return self.minio_client.get_object(self.minio_bucket, object_name)
+            return self.call(self.minio_client.get_object, self.minio_bucket, object_name)
         except S3Error as err:
-            print(f"Erreur lors de la récupération du fichier : {err}")
+            self.logger.error(LOG_CONST.format("Error while getting file: ", str(err)))
             return None
 
     def delete_file(self, object_name):
+        from minio.error import S3Error
         try:
-            self.minio_client.remove_object(self.minio_bucket, object_name)
+            self.call(self.minio_client.remove_object, self.minio_bucket, object_name)
         except S3Error as err:
-            print(f"Erreur lors de la suppression du fichier : {err}")
+            self.logger.error(LOG_CONST.format("Error while deleting file: ", str(err)))
 
 # Exemple d'utilisation
 # minio_service = MinioService()
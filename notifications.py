@@ -0,0 +1,102 @@
+import json
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlparse
+
+from constants import *
+from functions import settle_transaction
+from httpserver import BackgroundServer
+
+
+class NotificationHandler(BaseHTTPRequestHandler):
+    """Point d'entrée des notifications de paiement CinetPay."""
+
+    server_version = APP_NAME
+
+    def reply(self, status_code: int, message: str):
+        body = message.encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_data(self):
+        """Read the notification, sent as a form or as JSON."""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        if 'application/json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(body or '{}')
+        return dict(parse_qsl(body))
+
+    def do_GET(self):
+        # CinetPay vérifie la disponibilité de l'URL de notification
+        self.reply(200, 'OK')
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        if urlparse(self.path).path != receiver.path:
+            return self.reply(404, 'Not found')
+
+        try:
+            data = self.read_data()
+        except Exception:
+            return self.reply(400, 'Invalid notification')
+
+        transaction_code = data.get('cpm_trans_id')
+        if not transaction_code or str(data.get('cpm_site_id')) != str(receiver.site_id):
+            return self.reply(400, 'Invalid notification')
+
+        # Le statut est toujours vérifié auprès de CinetPay avant mise à jour
+        if receiver.handle(transaction_code):
+            return self.reply(200, 'OK')
+        return self.reply(500, 'Error')
+
+    def log_message(self, format, *args):
+        self.server.receiver.logger.debug(
+            "Notification %s - %s", self.address_string(), format % args)
+
+
+class NotificationReceiver(BackgroundServer):
+    """Serveur HTTP embarqué recevant les notifications CinetPay.
+
+    Chaque notification déclenche la vérification de la transaction avec
+    cinetpay_check_transaction, puis les mêmes mises à jour de commande et
+    de journal de transaction que la vérification périodique.
+    """
+
+    handler_class = NotificationHandler
+    thread_name = "cinetpay-notify"
+
+    def __init__(self, env_vars: dict, host: str = None, port: int = None):
+        super().__init__(
+            env_vars,
+            host if host is not None else env_vars.get("CINETPAY_NOTIFY_HOST"),
+            port if port is not None else env_vars.get("CINETPAY_NOTIFY_PORT"))
+        self.path = env_vars.get("CINETPAY_NOTIFY_PATH")
+        self.site_id = env_vars.get("CINETPAY_SITE_ID")
+
+    def handle(self, transaction_code: str):
+        """Settle the order of a notified transaction."""
+        self.logger.info("Payment notification received for %s", transaction_code)
+        try:
+            # Chaque notification est tracée comme un cycle
+            return self.env_vars.get('tracer').run(
+                "notify",
+                lambda env_vars: settle_transaction(
+                    env_vars=env_vars,
+                    transaction_code=transaction_code
+                ),
+                self.env_vars
+            )
+        except Exception as e:
+            self.logger.error(LOG_CONST.format(
+                "Error while handling payment notification: ", str(e)))
+            return False
+
+    def attach(self, server):
+        server.receiver = self
+
+    def start(self):
+        super().start()
+        self.logger.info("Listening for CinetPay notifications on {}:{}{}".format(
+            self.host, self.port, self.path))
@@ -0,0 +1,154 @@
+import contextvars
+import queue
+import threading
+from time import perf_counter
+
+
+class Stage:
+    """Étape d'un pipeline : une fonction exécutée par un ou plusieurs threads.
+
+    La fonction reçoit (env_vars, item) et retourne l'élément à passer à
+    l'étape suivante, ou None pour l'arrêter là.
+    """
+
+    def __init__(self, name: str, func, workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(int(workers), 1)
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, duration: float, dropped: bool = False, failed: bool = False):
+        with self.lock:
+            self.processed += 1
+            self.busy_time += duration
+            if dropped:
+                self.dropped += 1
+            if failed:
+                self.failed += 1
+
+
+class Pipeline:
+    """Pipeline d'étapes reliées par des files bornées.
+
+    Chaque étape a sa propre concurrence. Les files étant bornées, une
+    étape lente bloque les précédentes (contre-pression) jusqu'à l'entrée
+    du pipeline : submit() attend qu'il y ait de la place.
+
+    Chaque élément circule avec une copie du contexte de celui qui l'a
+    soumis : les étapes sont tracées dans le cycle qui l'a soumis.
+
+    Un élément soumis avec une clé n'est pas accepté une seconde fois tant
+    qu'il n'est pas sorti du pipeline (dernière étape, arrêt ou erreur).
+    """
+
+    def __init__(self, env_vars: dict, stages: list, queue_size: int):
+        self.env_vars = env_vars
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.threads = []
+        self.cycle_started_at = None
+        self.cycle_processed = [0] * len(stages)
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the stage workers (once)."""
+        with self.lock:
+            if self.threads:
+                return
+            for index, stage in enumerate(self.stages):
+                for n in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self.work, args=(index,),
+                        name="{}-{}".format(stage.name, n), daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+
+    def work(self, index: int):
+        logger = self.env_vars.get('logger')
+        stage = self.stages[index]
+        q_in = self.queues[index]
+        q_out = self.queues[index + 1] if index + 1 < len(self.queues) else None
+
+        while True:
+            context, key, item = q_in.get()
+            started = perf_counter()
+            passed = False
+            try:
+                result = context.run(self.run_stage, stage, item)
+                stage.record(perf_counter() - started, dropped=result is None)
+                if result is not None and q_out is not None:
+                    q_out.put((context, key, result))
+                    passed = True
+            except Exception as e:
+                stage.record(perf_counter() - started, failed=True)
+                logger.error("Error in stage {}: {}".format(stage.name, e))
+            finally:
+                if not passed and key is not None:
+                    with self.lock:
+                        self.in_flight.discard(key)
+                q_in.task_done()
+
+    def run_stage(self, stage: Stage, item):
+        with self.env_vars.get('tracer').span("stage." + stage.name):
+            return stage.func(self.env_vars, item)
+
+    def submit(self, item, key=None):
+        """Submit an item, waiting if the pipeline is full.
+
+        Returns False, without submitting it, if an item with the same key
+        is still in the pipeline.
+        """
+        self.start()
+        if key is not None:
+            with self.lock:
+                if key in self.in_flight:
+                    return False
+                self.in_flight.add(key)
+        self.queues[0].put((contextvars.copy_context(), key, item))
+        return True
+
+    def join(self):
+        """Wait until all the submitted items went through the pipeline."""
+        for q in self.queues:
+            q.join()
+
+    def begin_cycle(self):
+        """Start measuring the throughput of a new cycle."""
+        with self.lock:
+            self.cycle_started_at = perf_counter()
+            self.cycle_processed = [stage.processed for stage in self.stages]
+
+    def stats(self):
+        """Throughput, capacity and queue depth of each stage.
+
+        throughput is the rate of the current cycle (since begin_cycle), so
+        the idle time between cycles does not dilute it. capacity is the
+        rate the stage sustains with all its workers busy, from the time
+        spent in the stage: a stage whose capacity is close to the
+        throughput of the pipeline is the one to give more workers.
+        """
+        with self.lock:
+            cycle_started_at = self.cycle_started_at
+            cycle_processed = list(self.cycle_processed)
+        elapsed = perf_counter() - cycle_started_at if cycle_started_at else 0.0
+        stats = []
+        for stage, q, processed_before in zip(self.stages, self.queues, cycle_processed):
+            processed = stage.processed - processed_before
+            stats.append({
+                'stage': stage.name,
+                'workers': stage.workers,
+                'queue_depth': q.qsize(),
+                'processed': stage.processed,
+                'dropped': stage.dropped,
+                'failed': stage.failed,
+                'cycle_processed': processed,
+                'throughput': processed / elapsed if elapsed else 0.0,
+                'capacity': stage.workers * stage.processed / stage.busy_time if stage.busy_time else 0.0,
+                'avg_duration': stage.busy_time / stage.processed if stage.processed else 0.0,
+            })
+        return stats
@@ -0,0 +1,72 @@
+import calendar
+import threading
+from datetime import datetime
+from time import time
+from typing import Optional
+
+
+class PollingSchedule:
+    """Calendrier de vérification des transactions en attente.
+
+    Chaque commande est revérifiée selon son âge : souvent pendant les
+    premières minutes, puis de plus en plus rarement. Les paliers sont
+    donnés sous la forme "âge:délai|âge:délai|...|délai" (en secondes) ;
+    le dernier délai s'applique aux commandes plus anciennes que tous les
+    paliers.
+    """
+
+    def __init__(self, steps: str):
+        self.steps, self.default_delay = self.parse_steps(steps)
+        self.last_checked = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_steps(steps: str):
+        parsed = []
+        default_delay = None
+        for step in steps.split('|'):
+            if ':' in step:
+                max_age, delay = step.split(':')
+                parsed.append((float(max_age), float(delay)))
+            else:
+                default_delay = float(step)
+        parsed.sort()
+        if default_delay is None:
+            default_delay = parsed[-1][1]
+        return parsed, default_delay
+
+    @staticmethod
+    def order_age(order: dict, now: float):
+        """Age of an order, in seconds."""
+        date_created = datetime.strptime(
+            order.get('date_created'), "%Y-%m-%dT%H:%M:%S.%fZ")
+        return now - calendar.timegm(date_created.timetuple())
+
+    def delay(self, age: float):
+        """Delay between two checks of an order of the given age."""
+        for max_age, delay in self.steps:
+            if age < max_age:
+                return delay
+        return self.default_delay
+
+    def is_due(self, order: dict, now: Optional[float] = None):
+        """Whether the order must be checked now."""
+        now = now or time()
+        last_checked = self.last_checked.get(order.get('id'))
+        if last_checked is None:
+            return True
+        return now - last_checked >= self.delay(self.order_age(order, now))
+
+    def mark_checked(self, orders: list, now: Optional[float] = None):
+        """Record that the orders have just been checked."""
+        now = now or time()
+        with self.lock:
+            for order in orders:
+                self.last_checked[order.get('id')] = now
+
+    def retain(self, order_ids: set):
+        """Forget the orders that are no longer pending."""
+        with self.lock:
+            for order_id in list(self.last_checked):
+                if order_id not in order_ids:
+                    del self.last_checked[order_id]
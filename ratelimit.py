@@ -0,0 +1,111 @@
+import logging
+import threading
+from time import monotonic, sleep
+
+from constants import *
+
+
+class TokenBucket:
+    """Limiteur de débit (seau à jetons) : rate requêtes par seconde en
+    moyenne, avec des rafales jusqu'à burst requêtes. Un débit nul ou négatif
+    désactive la limite.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(float(burst), 1.0)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Limite adaptative du nombre de requêtes en vol (AIMD).
+
+    La limite augmente d'environ une requête par aller-retour tant que les
+    réponses sont saines, et est multipliée par backoff_ratio sur une réponse
+    429/5xx, une erreur de connexion ou un pic de latence (latence supérieure
+    à latency_spike fois la latence de référence). Une seule réduction est
+    faite par aller-retour, les requêtes déjà en vol n'en provoquent pas
+    d'autres.
+
+    Les pics ne sont détectés qu'après quelques mesures, et seulement au-delà
+    d'un écart absolu (latency_floor secondes) : sur un service très rapide,
+    quelques millisecondes de variation ne sont pas une surcharge.
+    """
+
+    WARMUP_SAMPLES = 20
+
+    def __init__(self, name: str, max_limit: int, min_limit: int = 1, initial: int = None,
+                 backoff_ratio: float = 0.5, latency_spike: float = 2.0,
+                 latency_floor: float = 0.05):
+        self.name = name
+        self.max_limit = max(float(max_limit), 1.0)
+        self.min_limit = min(max(float(min_limit), 1.0), self.max_limit)
+        self.limit = min(max(float(initial or self.max_limit), self.min_limit), self.max_limit)
+        self.backoff_ratio = backoff_ratio
+        self.latency_spike = latency_spike
+        self.latency_floor = latency_floor
+        self.samples = 0
+        self.inflight = 0
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        self.logger = logging.getLogger(APP_NAME)
+
+    def acquire(self):
+        """Wait until a request may be sent."""
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self, latency: float, overloaded: bool = False):
+        """Record the outcome of a request sent after acquire()."""
+        with self.condition:
+            self.inflight -= 1
+            spike = self.samples >= self.WARMUP_SAMPLES \
+                and latency > self.baseline * self.latency_spike \
+                and latency - self.baseline > self.latency_floor
+
+            if overloaded or spike:
+                now = monotonic()
+                if now - self.last_decrease >= (self.baseline or latency):
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self.last_decrease = now
+                    self.logger.debug("Concurrency of {} reduced to {:.1f} ({}).".format(
+                        self.name, self.limit, "overloaded" if overloaded else "latency spike"))
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            # La référence suit lentement les pics, pour s'adapter à un service
+            # durablement plus lent
+            if not overloaded:
+                self.samples += 1
+                alpha = 0.02 if spike else 0.1
+                self.baseline = latency if self.baseline is None else \
+                    (1 - alpha) * self.baseline + alpha * latency
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'inflight': self.inflight,
+                'baseline_latency': self.baseline,
+            }
@@ -0,0 +1,128 @@
+import asyncio
+import random
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+@dataclass
+class ScheduledTask:
+    """Tâche périodique : intervalle, gigue et durée maximale en secondes."""
+    name: str
+    func: Callable
+    interval: float
+    jitter: float = 0.0
+    max_runtime: Optional[float] = None
+
+
+class Scheduler:
+    """Ordonnanceur asyncio des tâches du worker.
+
+    Chaque tâche tourne à son propre rythme, dans son propre thread, en
+    parallèle des autres. Une tâche ne se chevauche jamais elle-même : si
+    son exécution précédente n'est pas terminée (par exemple après avoir
+    dépassé sa durée maximale), le tour suivant est sauté.
+    """
+
+    def __init__(self, env_vars: dict, tasks: list):
+        self.env_vars = env_vars
+        self.tasks = tasks
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(len(tasks), 1), thread_name_prefix="task")
+        self.stopping = None
+
+    def submit(self, task: ScheduledTask):
+        """Start a cycle of a task in the executor."""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self.executor, self.env_vars.get('tracer').run, task.name, task.func, self.env_vars)
+
+    async def wait(self, task: ScheduledTask, running: asyncio.Future, started: float):
+        """Wait for a cycle (at most its max runtime), record and return its success."""
+        logger = self.env_vars.get('logger')
+        loop = asyncio.get_running_loop()
+        # Un tour réussit s'il se termine à temps sans retourner False
+        success = False
+        try:
+            result = await asyncio.wait_for(asyncio.shield(running), timeout=task.max_runtime)
+            success = result is not False
+        except asyncio.TimeoutError:
+            logger.warning("Task {} exceeded its max runtime ({}s).".format(
+                task.name, task.max_runtime))
+        except Exception as e:
+            logger.error("Error in task {}: {}".format(task.name, e))
+        self.env_vars.get('metrics').task_done(task.name, loop.time() - started, success)
+        return success
+
+    async def run_task(self, task: ScheduledTask):
+        """Run a task periodically until the scheduler stops."""
+        logger = self.env_vars.get('logger')
+        loop = asyncio.get_running_loop()
+        running = None
+        # La tâche est en mauvaise santé après deux tours manqués
+        self.env_vars.get('metrics').register_task(
+            task.name, 2 * (task.interval + task.jitter) + (task.max_runtime or task.interval))
+
+        while not self.stopping.is_set():
+            started = loop.time()
+            if running is None or running.done():
+                running = self.submit(task)
+                await self.wait(task, running, started)
+            else:
+                logger.warning(
+                    "Task {} is still running, skipping this run.".format(task.name))
+
+            elapsed = loop.time() - started
+            delay = max(task.interval - elapsed, 0) + \
+                random.uniform(0, task.jitter)
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def once(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        successes = await asyncio.gather(
+            *(self.wait(task, self.submit(task), started) for task in self.tasks))
+        return dict(zip((task.name for task in self.tasks), successes))
+
+    async def main(self):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        # SIGUSR1 : profiler les prochains cycles
+        try:
+            loop.add_signal_handler(
+                signal.SIGUSR1, self.env_vars.get('tracer').request_profile)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+
+        await asyncio.gather(*(self.run_task(task) for task in self.tasks))
+
+    def stop(self):
+        """Stop the scheduler after the running tasks."""
+        self.stopping.set()
+
+    def run_once(self):
+        """Run one cycle of each task, in parallel, and return {name: success}.
+
+        A task exceeding its max runtime counts as failed, but is still
+        waited for before returning.
+        """
+        try:
+            return asyncio.run(self.once())
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def run(self):
+        """Run the scheduler until it is stopped."""
+        try:
+            asyncio.run(self.main())
+        finally:
+            self.executor.shutdown(wait=True)
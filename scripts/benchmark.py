@@ -0,0 +1,328 @@
+"""Banc d'essai du worker contre les faux services amont (scripts/fakes.py).
+
+Exemple :
+    python scripts/benchmark.py --pending 1000 --deliver 200 --abandoned 200 \
+        --latency 0.01 --error-rate 0.01 --cycles 5 --output bench.json
+    python scripts/benchmark.py ... --compare bench.json
+    python scripts/benchmark.py --dataset data/1m --cycles 1 \
+        --task treat_abandoned_orders --output abandoned-1m.json
+
+Les faux Directus, CinetPay, Listmonk et MinIO sont démarrés dans le même
+processus, sur des ports libres, et le worker est configuré pour les
+utiliser. Chaque cycle ajoute un nouveau lot de commandes (en attente,
+payées mais non livrées, abandonnées) puis exécute treat_pending_orders,
+treat_abandoned_orders et treat_not_delivered_orders, comme le
+planificateur.
+
+Le rapport JSON donne le débit (commandes traitées par seconde), le nombre
+d'appels aux services amont par commande, les durées p50 et p99 des cycles,
+le temps et la mémoire d'un démarrage à froid du worker (worker.py --check,
+dans un processus neuf) et le pic de mémoire résidente (faux services compris ; setup_rss_mb est la
+mémoire occupée avant le premier cycle, jeu de données chargé). Avec --compare, les
+résultats sont comparés à ceux d'un rapport précédent.
+
+Un jeu de données de scripts/dataset.py peut être chargé avant le premier
+cycle (--dataset) ; aucun lot n'est alors ajouté aux cycles, sauf si
+--pending, --deliver ou --abandoned sont donnés. --task limite le banc à
+certaines tâches, pour mesurer chaque traitement séparément.
+
+Les réglages du worker peuvent être modifiés avec --set CLE=VALEUR, par
+exemple --set STATE_STORE_ENABLED=True.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dataset import load_dataset  # noqa: E402
+from fakes import seed_orders, start_upstreams  # noqa: E402
+
+
+TASKS = ("treat_pending_orders", "treat_abandoned_orders", "treat_not_delivered_orders")
+
+# Résultats comparés avec --compare, et sens de l'amélioration
+COMPARED = {
+    'orders_per_second': 1,
+    'calls_per_order': -1,
+    'cycle_p50_seconds': -1,
+    'cycle_p99_seconds': -1,
+    'startup_p50_seconds': -1,
+    'startup_rss_mb': -1,
+    'peak_rss_mb': -1,
+}
+
+
+def percentile(values: list, q: float):
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(-(-q * len(values) // 100)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def peak_rss_mb():
+    """Peak resident memory of the process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux donne des Ko, macOS des octets
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def current_rss_mb():
+    """Current resident memory of the process, in MB (Linux only)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return None
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure(upstreams: dict, overrides: dict, console: bool = False):
+    """Point the worker settings at the fake upstreams."""
+    def url(name):
+        return "http://{}:{}".format(*upstreams[name][1].server_address[:2])
+
+    minio_host, minio_port = upstreams['minio'][1].server_address[:2]
+    os.environ.update({
+        "ENV": "noprod",
+        "URL_OF_DIRECTUS_INPROD": url('directus'),
+        "URL_OF_DIRECTUS_NOPROD": url('directus'),
+        "ROUTE_OF_DIRECTUS_FOR_DGEASS_PRODUCT": "/items/dgeass_product",
+        "ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER": "/items/dgeass_order",
+        "ROUTE_OF_DIRECTUS_FOR_DGEASS_TRANSACTION_LOG": "/items/dgeass_transaction_log",
+        "CINETPAY_API_KEY": "benchmark",
+        "CINETPAY_SITE_ID": "000000",
+        "CINETPAY_CHECK_URL": url('cinetpay') + "/v2/payment/check",
+        "LISTMONK_API_URL": url('listmonk') + "/api",
+        "LISTMONK_API_USERNAME": "benchmark",
+        "LISTMONK_API_PASSWORD": "benchmark",
+        "MINIO_PROXY": "http://{}:{}".format(minio_host, minio_port),
+        "MINIO_SECURE": "False",
+        "MINIO_HOST": minio_host,
+        "MINIO_PORT": str(minio_port),
+        "MINIO_ACCESS_KEY": "benchmark",
+        "MINIO_SECRET_KEY": "benchmark",
+        "MINIO_BUCKET_NAME": "digital-geass",
+        "DASHBOARD_URL": "http://dashboard.local",
+        "ADMIN_EMAILS": "admin@example.com",
+        # Les journaux restent écrits dans le fichier, pas sur la console
+        "LOG_CONSOLE": str(console),
+    })
+    os.environ.update(overrides)
+
+
+def measure_startup(runs: int):
+    """Cold start of the worker (python worker.py --check), in fresh processes.
+
+    Returns the durations, in seconds, and the peak resident memory of
+    these processes, in MB.
+    """
+    durations = []
+    for _ in range(runs):
+        started = perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'worker.py'), '--check'],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(round(perf_counter() - started, 4))
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return durations, round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1) if runs else None
+
+
+def counter_total(metrics, name: str):
+    """Sum of a counter over all its labels."""
+    with metrics.lock:
+        return sum(value for (key, labels), value in metrics.counters.items() if key == name)
+
+
+def run(args):
+    overrides = dict(item.split('=', 1) for item in args.set)
+    upstreams = start_upstreams(
+        latency=args.latency, error_rate=args.error_rate,
+        accept_ratio=args.accept_ratio, refuse_ratio=args.refuse_ratio, seed=args.seed)
+    configure(upstreams, overrides, console=args.verbose)
+
+    # Le worker écrit ses journaux et fichiers dans le dossier courant
+    workdir = args.workdir or tempfile.mkdtemp(prefix='dgeass-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    startup, startup_rss_mb = measure_startup(args.startup_runs)
+
+    import functions
+    from utilities import get_env_vars
+
+    env_vars = get_env_vars()
+    metrics = env_vars.get('metrics')
+    directus = upstreams['directus'][0].directus
+    output = sys.stderr if args.verbose else io.StringIO()
+
+    dataset = None
+    if args.dataset:
+        loading = perf_counter()
+        dataset = load_dataset(args.dataset, directus, upstreams['cinetpay'][0])
+        print("Dataset loaded in {:.1f}s".format(perf_counter() - loading), file=sys.stderr)
+
+    # Mémoire occupée avant les cycles (faux services et jeu de données compris)
+    setup_rss_mb = current_rss_mb()
+    cycles = []
+    for n in range(args.cycles):
+        seed_orders(directus, pending=args.pending, deliver=args.deliver,
+                    abandoned=args.abandoned, first_id=directus.next_ids.get('dgeass_order', 1))
+        durations = {}
+        started = perf_counter()
+        with contextlib.redirect_stdout(output):
+            for name in args.task:
+                task_started = perf_counter()
+                getattr(functions, name)(env_vars)
+                durations[name] = round(perf_counter() - task_started, 4)
+        cycles.append({'duration_seconds': round(perf_counter() - started, 4), 'tasks': durations})
+        print("Cycle {}/{}: {:.3f}s".format(n + 1, args.cycles, cycles[-1]['duration_seconds']),
+              file=sys.stderr)
+
+    env_vars.get('transaction_logs').flush()
+    total = sum(cycle['duration_seconds'] for cycle in cycles)
+    processed = {
+        'checked': counter_total(metrics, "worker_orders_checked_total"),
+        'settled': counter_total(metrics, "worker_orders_settled_total"),
+        'abandoned': counter_total(metrics, "worker_orders_abandoned_total"),
+        'delivered': counter_total(metrics, "worker_orders_delivered_total"),
+    }
+    # Une commande vérifiée puis réglée ne compte qu'une fois
+    orders = processed['checked'] + processed['abandoned'] + processed['delivered']
+    calls = {name: dict(app.calls) for name, (app, server) in upstreams.items()}
+    calls_total = {name: sum(counts.values()) for name, counts in calls.items()}
+
+    for app, server in upstreams.values():
+        server.shutdown()
+        server.server_close()
+
+    return {
+        'label': args.label,
+        'revision': git_revision(),
+        'date': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'python': platform.python_version(),
+        'parameters': {
+            'pending': args.pending, 'deliver': args.deliver, 'abandoned': args.abandoned,
+            'cycles': args.cycles, 'latency': args.latency, 'error_rate': args.error_rate,
+            'accept_ratio': args.accept_ratio, 'refuse_ratio': args.refuse_ratio,
+            'seed': args.seed, 'settings': overrides, 'tasks': args.task,
+            'startup_runs': args.startup_runs,
+            'dataset': dataset,
+        },
+        'results': {
+            'orders': orders,
+            'processed': processed,
+            'orders_per_second': round(orders / total, 2) if total else None,
+            'upstream_calls': calls_total,
+            'calls_per_order': round(sum(calls_total.values()) / orders, 3) if orders else None,
+            'calls_per_order_by_upstream': {
+                name: round(count / orders, 3) if orders else None
+                for name, count in calls_total.items()},
+            'cycle_p50_seconds': percentile([c['duration_seconds'] for c in cycles], 50),
+            'cycle_p99_seconds': percentile([c['duration_seconds'] for c in cycles], 99),
+            'task_p50_seconds': {
+                name: percentile([c['tasks'][name] for c in cycles], 50) for name in args.task},
+            'task_p99_seconds': {
+                name: percentile([c['tasks'][name] for c in cycles], 99) for name in args.task},
+            'startup_p50_seconds': percentile(startup, 50),
+            'startup_rss_mb': startup_rss_mb,
+            'peak_rss_mb': peak_rss_mb(),
+            'setup_rss_mb': setup_rss_mb,
+        },
+        'upstream_calls_by_route': calls,
+        'cycles': cycles,
+    }
+
+
+def compare(report: dict, previous: dict):
+    """Print the change of the main results since a previous report."""
+    print("Compared with {} ({}):".format(
+        previous.get('label') or previous.get('revision'), previous.get('date')), file=sys.stderr)
+    if previous.get('parameters') != report.get('parameters'):
+        print("  Warning: the parameters of the two runs differ.", file=sys.stderr)
+    for key, direction in COMPARED.items():
+        before = previous.get('results', {}).get(key)
+        after = report.get('results', {}).get(key)
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        verdict = "better" if change * direction > 0 else "worse" if change else "same"
+        print("  {:<20} {:>10} -> {:>10} ({:+.1f}%, {})".format(
+            key, before, after, change, verdict), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pending', type=int, default=None,
+                        help="pending orders added at each cycle (500, 0 with a dataset)")
+    parser.add_argument('--deliver', type=int, default=None,
+                        help="paid but undelivered orders added at each cycle (100, 0 with a dataset)")
+    parser.add_argument('--abandoned', type=int, default=None,
+                        help="abandoned orders added at each cycle (100, 0 with a dataset)")
+    parser.add_argument('--dataset', default=None, help="dataset made by scripts/dataset.py")
+    parser.add_argument('--task', action='append', choices=TASKS, default=None,
+                        help="task to run, may be repeated (all by default)")
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help="latency of every fake upstream, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="share of the calls answered with a 503")
+    parser.add_argument('--accept-ratio', type=float, default=0.6)
+    parser.add_argument('--refuse-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help="cold starts of the worker to measure (0 to skip)")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="worker setting, may be repeated")
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--workdir', default=None,
+                        help="working directory of the worker (a temporary one by default)")
+    parser.add_argument('--output', default=None, help="JSON report (stdout by default)")
+    parser.add_argument('--compare', default=None, help="previous JSON report")
+    parser.add_argument('--verbose', action='store_true', help="show the worker output")
+    args = parser.parse_args()
+    args.task = args.task or list(TASKS)
+    for key, default in (('pending', 500), ('deliver', 100), ('abandoned', 100)):
+        if getattr(args, key) is None:
+            setattr(args, key, 0 if args.dataset else default)
+    if args.dataset:
+        args.dataset = os.path.abspath(args.dataset)
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    report = run(args)
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+    if args.compare:
+        compare(report, previous)
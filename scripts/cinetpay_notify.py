@@ -0,0 +1,46 @@
+"""Faux notificateur CinetPay : envoie une notification de paiement au worker.
+
+Exemple :
+    python scripts/cinetpay_notify.py --url http://localhost:8080/cinetpay/notify \
+        --site-id 123456 --transaction-id ORDER-CODE
+"""
+import argparse
+from datetime import datetime
+
+import requests as rq
+
+
+def send_notification(url: str, site_id: str, transaction_id: str, amount: int = 100):
+    """Send a notification shaped like CinetPay's (form-encoded POST)."""
+    payload = {
+        'cpm_site_id': site_id,
+        'cpm_trans_id': transaction_id,
+        'cpm_trans_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'cpm_amount': amount,
+        'cpm_currency': 'XOF',
+        'signature': '',
+        'payment_method': 'OM',
+        'cel_phone_num': '0700000000',
+        'cpm_phone_prefixe': '225',
+        'cpm_language': 'fr',
+        'cpm_version': 'V4',
+        'cpm_payment_config': 'SINGLE',
+        'cpm_page_action': 'PAYMENT',
+        'cpm_custom': '',
+        'cpm_designation': '',
+        'cpm_error_message': 'SUCCES',
+    }
+    return rq.post(url, data=payload, timeout=30)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080/cinetpay/notify')
+    parser.add_argument('--site-id', required=True)
+    parser.add_argument('--transaction-id', required=True)
+    parser.add_argument('--amount', type=int, default=100)
+    args = parser.parse_args()
+
+    res = send_notification(args.url, args.site_id,
+                            args.transaction_id, args.amount)
+    print(res.status_code, res.text)
@@ -0,0 +1,239 @@
+"""Jeu de données synthétique pour les essais de montée en charge.
+
+Exemple :
+    python scripts/dataset.py --pending 100000 --stale 100000 --deliver 100000 \
+        --accept-ratio 0.6 --refuse-ratio 0.1 --output data/100k
+
+Produit, au format JSONL (une ligne par enregistrement), des produits, des
+tunnels et des commandes Directus de la même forme que celles lues par
+functions.py, ainsi que le résultat de la vérification CinetPay de chaque
+commande en attente :
+
+- pending : commandes en attente récentes (créées dans les --window
+  dernières heures) ;
+- stale : commandes en attente plus anciennes que DAYS_TO_ABANDON_ORDER,
+  à marquer abandonnées ;
+- deliver : commandes payées dont le produit n'est pas encore livré ;
+- history : commandes réglées et livrées, que le worker doit ignorer.
+
+Les identifiants suivent l'ordre de création, comme dans Directus. Les
+commandes sont écrites au fil de l'eau : un million de commandes ne sont
+jamais toutes en mémoire pendant la génération. Le dossier produit se
+charge dans les faux services avec load_dataset, ou avec l'option
+--dataset de scripts/fakes.py et scripts/benchmark.py.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from constants import *  # noqa: E402
+
+MANIFEST_FILE = "manifest.json"
+OUTCOMES_FILE = "cinetpay.jsonl"
+LOAD_BATCH_SIZE = 10000
+
+FIRSTNAMES = (
+    "Aya", "Adjoua", "Akissi", "Amani", "Awa", "Bintou", "Fatou", "Mariam",
+    "Aminata", "Grace", "Koffi", "Kouassi", "Yao", "Konan", "Moussa",
+    "Ibrahim", "Seydou", "Jean", "Marc", "Serge", "Didier", "Franck",
+)
+LASTNAMES = (
+    "KOUAME", "KOUADIO", "KONE", "TRAORE", "COULIBALY", "OUATTARA", "DIALLO",
+    "BAMBA", "YAO", "N'GUESSAN", "TOURE", "CISSE", "SANOGO", "DIABATE",
+    "KOFFI", "AKA", "GNAGNE", "SORO", "FOFANA", "DOUMBIA",
+)
+DOMAINS = ("gmail.com", "yahoo.fr", "outlook.com", "hotmail.com", "orange.ci")
+PRODUCT_WORDS = (
+    "ASTUCES", "MARKETING", "VENTE", "BUSINESS", "DIGITAL", "FORMATION",
+    "GUIDE", "RESEAUX", "SOCIAUX", "E-COMMERCE", "FACEBOOK", "TIKTOK",
+)
+PRICES = (2000, 3000, 5000, 7500, 10000, 15000, 25000)
+
+
+def iso_date(moment: datetime):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def generate_catalog(rng: random.Random, products: int, tunnels: int):
+    """Products, and tunnels selling them."""
+    product_items = [{
+        'id': n,
+        'code': 'PRD{:05d}'.format(n),
+        'name': "{} {}".format(rng.choice((50, 100, 101, 200)),
+                               " ".join(rng.sample(PRODUCT_WORDS, 2))),
+        'minio_object_name': "{}.pdf".format(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'date_updated': None,
+    } for n in range(1, products + 1)]
+    tunnel_items = [{
+        'id': n,
+        'code': 'TUN{:05d}'.format(n),
+        'price': rng.choice(PRICES),
+        'product': (n - 1) % products + 1,
+    } for n in range(1, tunnels + 1)]
+    return product_items, tunnel_items
+
+
+def generate_orders(rng: random.Random, pending: int, stale: int, deliver: int, history: int,
+                    tunnels: int, now: datetime, window: float):
+    """Yield (order, state) in creation order.
+
+    Stale orders come first, spread over the days before the abandon delay;
+    the other states are mixed over the last window hours.
+    """
+    stale_start = now - timedelta(days=DAYS_TO_ABANDON_ORDER + 30)
+    stale_span = timedelta(days=29).total_seconds()
+    recent_start = now - timedelta(hours=window)
+    recent_span = timedelta(hours=window).total_seconds()
+
+    recent = ['pending'] * pending + ['deliver'] * deliver + ['history'] * history
+    rng.shuffle(recent)
+    states = ['stale'] * stale + recent
+
+    offsets = sorted(rng.random() for _ in range(stale)) + \
+        sorted(rng.random() for _ in range(len(recent)))
+    for n, (state, offset) in enumerate(zip(states, offsets), start=1):
+        if state == 'stale':
+            date_created = stale_start + timedelta(seconds=offset * stale_span)
+        else:
+            date_created = recent_start + timedelta(seconds=offset * recent_span)
+        firstname = rng.choice(FIRSTNAMES)
+        lastname = rng.choice(LASTNAMES)
+        paid = state in ('deliver', 'history')
+        yield {
+            'id': n,
+            'code': '{}{:07d}'.format(date_created.strftime("%y%m%d"), n),
+            'email': "{}.{}{}@{}".format(
+                firstname.lower(), lastname.lower().replace("'", ""), n, rng.choice(DOMAINS)),
+            'firstname': firstname,
+            'lastname': lastname,
+            'status': ORDER_STATUS_COMPLETED if paid else ORDER_STATUS_STARTED,
+            'transaction_status': TRANSACTION_STATUS_ACCEPTED if paid else TRANSACTION_STATUS_PENDING,
+            'product_is_delivered': state == 'history',
+            'tunnel': rng.randint(1, tunnels),
+            'date_created': iso_date(date_created),
+            'date_updated': None,
+        }, state
+
+
+def outcome(rng: random.Random, accept_ratio: float, refuse_ratio: float):
+    """CinetPay status of a pending transaction."""
+    draw = rng.random()
+    if draw < accept_ratio:
+        return 'ACCEPTED'
+    if draw < accept_ratio + refuse_ratio:
+        return 'REFUSED'
+    return 'PENDING'
+
+
+def write_jsonl(path: str, items):
+    with open(path, 'w') as f:
+        for item in items:
+            f.write(json.dumps(item, separators=(',', ':')) + '\n')
+
+
+def generate(output: str, pending: int = 0, stale: int = 0, deliver: int = 0, history: int = 0,
+             products: int = 20, tunnels: int = 50, accept_ratio: float = 0.6,
+             refuse_ratio: float = 0.1, stale_accept_ratio: float = 0.0,
+             window: float = 24.0, seed: int = 0):
+    """Write a dataset to the output directory, return its manifest.
+
+    Stale orders are almost never paid; their own accept ratio is
+    stale_accept_ratio (their refuse ratio stays refuse_ratio).
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    os.makedirs(output, exist_ok=True)
+
+    product_items, tunnel_items = generate_catalog(rng, products, tunnels)
+    write_jsonl(os.path.join(output, 'dgeass_product.jsonl'), product_items)
+    write_jsonl(os.path.join(output, 'dgeass_tunnel.jsonl'), tunnel_items)
+
+    outcomes = {'ACCEPTED': 0, 'REFUSED': 0, 'PENDING': 0}
+    with open(os.path.join(output, 'dgeass_order.jsonl'), 'w') as orders_file, \
+            open(os.path.join(output, OUTCOMES_FILE), 'w') as outcomes_file:
+        for order, state in generate_orders(
+                rng, pending, stale, deliver, history, tunnels, now, window):
+            orders_file.write(json.dumps(order, separators=(',', ':')) + '\n')
+            if state in ('pending', 'stale'):
+                status = outcome(rng, stale_accept_ratio if state == 'stale' else accept_ratio,
+                                 refuse_ratio)
+                outcomes[status] += 1
+                outcomes_file.write(json.dumps(
+                    {'transaction_id': order.get('code'), 'status': status},
+                    separators=(',', ':')) + '\n')
+
+    manifest = {
+        'generated_at': iso_date(now),
+        'seed': seed,
+        'orders': {'pending': pending, 'stale': stale, 'deliver': deliver, 'history': history},
+        'products': products,
+        'tunnels': tunnels,
+        'ratios': {'accept': accept_ratio, 'refuse': refuse_ratio, 'stale_accept': stale_accept_ratio},
+        'outcomes': outcomes,
+        'window_hours': window,
+    }
+    with open(os.path.join(output, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_jsonl(path: str, batch_size: int = LOAD_BATCH_SIZE):
+    """Yield the records of a JSONL file, by batches."""
+    batch = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def load_dataset(path: str, directus, cinetpay=None):
+    """Load a dataset into a FakeDirectus (and the outcomes into a CinetPayApp).
+
+    Returns the manifest of the dataset.
+    """
+    for collection in ('dgeass_product', 'dgeass_tunnel', 'dgeass_order'):
+        for batch in read_jsonl(os.path.join(path, collection + '.jsonl')):
+            directus.load(collection, batch)
+    if cinetpay is not None:
+        for batch in read_jsonl(os.path.join(path, OUTCOMES_FILE)):
+            cinetpay.outcomes.update(
+                (record.get('transaction_id'), record.get('status')) for record in batch)
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pending', type=int, default=10000)
+    parser.add_argument('--stale', type=int, default=10000)
+    parser.add_argument('--deliver', type=int, default=10000)
+    parser.add_argument('--history', type=int, default=0)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--tunnels', type=int, default=50)
+    parser.add_argument('--accept-ratio', type=float, default=0.6)
+    parser.add_argument('--refuse-ratio', type=float, default=0.1)
+    parser.add_argument('--stale-accept-ratio', type=float, default=0.0)
+    parser.add_argument('--window', type=float, default=24.0,
+                        help="hours over which the recent orders are created")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True, help="output directory")
+    args = parser.parse_args()
+
+    manifest = generate(
+        args.output, pending=args.pending, stale=args.stale, deliver=args.deliver,
+        history=args.history, products=args.products, tunnels=args.tunnels,
+        accept_ratio=args.accept_ratio, refuse_ratio=args.refuse_ratio,
+        stale_accept_ratio=args.stale_accept_ratio, window=args.window, seed=args.seed)
+    print(json.dumps(manifest, indent=2))
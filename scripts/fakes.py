@@ -0,0 +1,664 @@
+"""Faux services amont pour les tests locaux du worker.
+
+Exemple :
+    python scripts/fakes.py --pending 100 --deliver 20 --latency 0.02 --error-rate 0.01
+    python scripts/fakes.py --dataset data/100k
+
+Chaque faux service a sa latence et son taux d'erreurs (réponses 503), et
+compte les appels reçus par route.
+
+- FakeDirectus implémente le sous-ensemble de l'API Directus utilisé par
+  le worker : listing filtré, trié et paginé (filter, sort, limit, fields),
+  lecture d'un élément, PATCH unitaire et multi-éléments (keys ou query,
+  sans atomicité entre lecture et écriture, comme Directus), POST
+  unitaire et multi-éléments (refusé en entier si une clé existe déjà),
+  DELETE multi-éléments.
+- CinetPayApp répond aux vérifications de transaction, avec une part de
+  transactions acceptées et refusées.
+- ListmonkApp gère les abonnés (liste paginée, recherche par email,
+  création, import CSV) et les emails transactionnels.
+- MinioApp répond aux quelques requêtes S3 du client MinIO (région du
+  bucket, lecture, écriture et suppression d'objets).
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import re
+import threading
+import zlib
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl, urlparse
+
+
+def compare(value, operator, operand):
+    """Evaluate one Directus filter operator."""
+    if operator == '_null':
+        return (value is None) == (str(operand).lower() in ('true', '1'))
+    if operator == '_nnull':
+        return (value is not None) == (str(operand).lower() in ('true', '1'))
+    if operator in ('_in', '_nin'):
+        if isinstance(operand, str):
+            operand = operand.split(',')
+        found = str(value) in [str(item) for item in operand]
+        return found if operator == '_in' else not found
+    if isinstance(value, bool) or isinstance(operand, bool):
+        value, operand = str(value).lower(), str(operand).lower()
+    elif isinstance(value, (int, float)):
+        try:
+            operand = type(value)(operand)
+        except (TypeError, ValueError):
+            value, operand = str(value), str(operand)
+    else:
+        value, operand = (None if value is None else str(value)), str(operand)
+
+    if operator == '_eq':
+        return value == operand
+    if operator == '_neq':
+        return value != operand
+    if value is None:
+        return False
+    if operator == '_lt':
+        return value < operand
+    if operator == '_lte':
+        return value <= operand
+    if operator == '_gt':
+        return value > operand
+    if operator == '_gte':
+        return value >= operand
+    raise ValueError("Unsupported filter operator: {}".format(operator))
+
+
+def matches(item: dict, flt: dict):
+    """Whether an item matches a Directus filter object."""
+    for key, condition in flt.items():
+        if key == '_and':
+            if not all(matches(item, sub) for sub in condition):
+                return False
+        elif key == '_or':
+            if not any(matches(item, sub) for sub in condition):
+                return False
+        else:
+            for operator, operand in condition.items():
+                if not compare(item.get(key), operator, operand):
+                    return False
+    return True
+
+
+def parse_query_filter(params: list):
+    """Build a filter object from filter[...][_op]=value parameters.
+
+    Nested parameters such as filter[_or][0][field][_op] are supported.
+    """
+    flt = {}
+    for key, value in params:
+        if not key.startswith('filter['):
+            continue
+        path = re.findall(r'\[([^\]]+)\]', key)
+        node = flt
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = value
+    return to_lists(flt)
+
+
+def to_lists(node):
+    """Turn the {"0": ..., "1": ...} nodes of a parsed filter into lists."""
+    if not isinstance(node, dict):
+        return node
+    if node and all(key.isdigit() for key in node):
+        return [to_lists(node[key]) for key in sorted(node, key=int)]
+    return {key: to_lists(value) for key, value in node.items()}
+
+
+def selected_keys(flt: dict):
+    """Keys selected by an id _in condition of a filter, or None."""
+    condition = flt.get('id') or {}
+    if '_in' in condition:
+        keys = condition.get('_in')
+        return keys.split(',') if isinstance(keys, str) else keys
+    for sub in flt.get('_and') or []:
+        keys = selected_keys(sub)
+        if keys is not None:
+            return keys
+    return None
+
+
+class FakeDirectus:
+    """Faux Directus en mémoire."""
+
+    def __init__(self, race_delay: float = 0.0):
+        self.collections = {}
+        self.ids = {}
+        self.next_ids = {}
+        # Délai entre la lecture et l'écriture d'une mise à jour par requête
+        self.race_delay = race_delay
+        self.relations = {
+            'dgeass_order': {'tunnel': 'dgeass_tunnel'},
+            'dgeass_tunnel': {'product': 'dgeass_product'},
+        }
+        self.lock = threading.Lock()
+
+    def load(self, collection: str, items: list):
+        with self.lock:
+            table = self.items(collection)
+            for item in items:
+                table[item['id']] = item
+            self.index(collection, [item['id'] for item in items])
+
+    def index(self, collection: str, keys: list):
+        """Add the integer keys to the sorted keys of a collection (lock held)."""
+        ids = self.ids.setdefault(collection, [])
+        new = sorted(set(key for key in keys if isinstance(key, int)))
+        if new and ids and new[0] <= ids[-1]:
+            ids[:] = sorted(set(ids).union(new))
+        else:
+            ids.extend(new)
+        if ids:
+            self.next_ids[collection] = max(self.next_ids.get(collection, 1), ids[-1] + 1)
+
+    def items(self, collection: str):
+        return self.collections.setdefault(collection, {})
+
+    def expand(self, collection: str, item: dict, fields: list, prefix: str = ''):
+        """Replace the relations listed in fields (tunnel.*, tunnel.product.*)."""
+        result = dict(item)
+        for field, related in self.relations.get(collection, {}).items():
+            path = prefix + field
+            if path + '.*' in fields and result.get(field) is not None:
+                related_item = self.items(related).get(result[field])
+                if related_item is not None:
+                    result[field] = self.expand(
+                        related, related_item, fields, path + '.')
+        return result
+
+    def list(self, collection: str, params: list):
+        options = dict(params)
+        flt = parse_query_filter(params)
+        limit = int(options.get('limit', 100))
+        fields = options.get('fields', '*').split(',')
+        sort = options.get('sort')
+        with self.lock:
+            # Parcours par id réservé aux collections de clés entières
+            if sort in (None, 'id') and limit >= 0 and self.ids.get(collection):
+                items = self.scan(collection, flt, limit)
+                return [self.expand(collection, item, fields) for item in items]
+            items = [item for item in self.items(collection).values()
+                     if matches(item, flt)]
+            if sort:
+                items.sort(key=lambda item: item.get(sort.lstrip('-')),
+                           reverse=sort.startswith('-'))
+            if limit >= 0:
+                items = items[:limit]
+            return [self.expand(collection, item, fields) for item in items]
+
+    def scan(self, collection: str, flt: dict, limit: int):
+        """First items matching a filter, in id order (lock held).
+
+        The listings of the worker are sorted by id and paginated on id, so
+        a page starts where the previous one ended: a full pass over a large
+        collection stays linear.
+        """
+        table = self.items(collection)
+        ids = self.ids.get(collection, [])
+        start = 0
+        bound = (flt.get('id') or {}).get('_gt')
+        if bound is not None:
+            start = bisect_right(ids, int(bound))
+        items = []
+        for position in range(start, len(ids)):
+            if len(items) >= limit:
+                break
+            item = table[ids[position]]
+            if matches(item, flt):
+                items.append(item)
+        return items
+
+    def update(self, collection: str, body: dict):
+        """Update items by keys or by query.
+
+        Like Directus, an update by query reads the matching keys first and
+        updates them in a second step: it is not a compare-and-set, and two
+        concurrent updates may both select the same items (race_delay
+        widens the gap between the two steps).
+        """
+        with self.lock:
+            table = self.items(collection)
+            if 'keys' in body:
+                keys = [self.key(table, k) for k in body['keys']]
+                keys = [key for key in keys if key is not None]
+            else:
+                query = body.get('query') or {}
+                flt = query.get('filter') or {}
+                candidates = selected_keys(flt)
+                if candidates is not None:
+                    candidates = dict.fromkeys(self.key(table, k) for k in candidates)
+                    candidates.pop(None, None)
+                keys = [key for key in (table if candidates is None else candidates)
+                        if matches(table[key], flt)]
+                limit = query.get('limit', 100)
+                if limit is not None and limit >= 0:
+                    keys = keys[:limit]
+        if self.race_delay and 'keys' not in body:
+            sleep(self.race_delay)
+        with self.lock:
+            now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+            for key in keys:
+                table[key].update(body.get('data') or {})
+                table[key]['date_updated'] = now
+            return [dict(table[key]) for key in keys]
+
+    @staticmethod
+    def key(table: dict, key):
+        """Find a key given as an int or a string."""
+        if key in table:
+            return key
+        if isinstance(key, str) and key.isdigit() and int(key) in table:
+            return int(key)
+        return None
+
+    def create(self, collection: str, items: list):
+        """Create items, all or none: returns None if a key already exists."""
+        with self.lock:
+            table = self.items(collection)
+            keys = [item['id'] for item in items if 'id' in item]
+            if len(set(keys)) < len(keys) or any(key in table for key in keys):
+                return None
+            for item in items:
+                if 'id' not in item:
+                    item['id'] = self.next_ids.get(collection, 1)
+                if isinstance(item['id'], int):
+                    self.next_ids[collection] = max(self.next_ids.get(collection, 1), item['id'] + 1)
+                table[item['id']] = item
+            self.index(collection, [item['id'] for item in items])
+            return items
+
+    def delete(self, collection: str, keys: list):
+        with self.lock:
+            table = self.items(collection)
+            keys = [key for key in (self.key(table, k) for k in keys) if key is not None]
+            for key in keys:
+                del table[key]
+            ids = self.ids.get(collection)
+            if ids:
+                deleted = set(keys)
+                ids[:] = [key for key in ids if key not in deleted]
+            return keys
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Gestionnaire HTTP commun aux faux services."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def reply(self, status_code: int, data, content_type: str = 'application/json'):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def read_json(self):
+        body = self.read_body()
+        return json.loads(body) if body else None
+
+    def route(self, method: str):
+        return self.server.app.handle(self, method)
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PATCH(self):
+        self.route('PATCH')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeApp:
+    """Base des faux services : latence, erreurs et comptage des appels."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def endpoint(self, method: str, path: str):
+        """Name of the route, used to count the calls."""
+        return '{} {}'.format(method, re.sub(r'/\d+$', '/:id', path))
+
+    def handle(self, handler: FakeHandler, method: str):
+        url = urlparse(handler.path)
+        with self.lock:
+            self.calls[self.endpoint(method, url.path)] += 1
+            failing = self.error_rate > 0 and self.random.random() < self.error_rate
+        if self.latency:
+            sleep(self.latency)
+        if failing:
+            handler.read_body()
+            return handler.reply(503, {'errors': [{'message': 'Service unavailable'}]})
+        return self.route(handler, method, url)
+
+    def route(self, handler: FakeHandler, method: str, url):
+        raise NotImplementedError
+
+
+class DirectusApp(FakeApp):
+    """Routes HTTP du faux Directus."""
+
+    def __init__(self, directus: FakeDirectus, **kwargs):
+        super().__init__(**kwargs)
+        self.directus = directus
+
+    def route(self, handler: FakeHandler, method: str, url):
+        match = re.match(r'^/items/(\w+)(?:/([^/]+))?$', url.path)
+        if not match:
+            return handler.reply(404, {'errors': [{'message': 'Route not found'}]})
+
+        collection, key = match.groups()
+        if method == 'GET' and key is None:
+            return handler.reply(200, {'data': self.directus.list(collection, parse_qsl(url.query))})
+        if method == 'GET':
+            item = self.directus.items(collection).get(int(key) if key.isdigit() else key)
+            if item is None:
+                return handler.reply(404, {'errors': [{'message': 'Not found'}]})
+            return handler.reply(200, {'data': item})
+        if method == 'PATCH' and key is None:
+            return handler.reply(200, {'data': self.directus.update(collection, handler.read_json())})
+        if method == 'PATCH':
+            key = int(key) if key.isdigit() else key
+            data = self.directus.update(collection, {'keys': [key], 'data': handler.read_json()})
+            return handler.reply(200, {'data': data[0] if data else None})
+        if method == 'POST':
+            body = handler.read_json()
+            items = self.directus.create(collection, body if isinstance(body, list) else [body])
+            if items is None:
+                return handler.reply(400, {'errors': [{
+                    'message': 'Value for field "id" in collection "{}" has to be unique.'.format(collection),
+                    'extensions': {'code': 'RECORD_NOT_UNIQUE'}}]})
+            return handler.reply(200, {'data': items if isinstance(body, list) else items[0]})
+        if method == 'DELETE':
+            body = handler.read_json() if key is None else [key]
+            keys = body.get('keys') if isinstance(body, dict) else body
+            self.directus.delete(collection, keys or [])
+            return handler.reply(204, b'')
+        handler.reply(405, {'errors': [{'message': 'Method not allowed'}]})
+
+
+class CinetPayApp(FakeApp):
+    """Faux CinetPay : vérification des transactions.
+
+    Le statut d'une transaction est fixé par outcomes, sinon tiré de façon
+    stable à partir de son code : accept_ratio de transactions acceptées,
+    refuse_ratio de refusées, les autres restent en attente.
+    """
+
+    def __init__(self, accept_ratio: float = 0.0, refuse_ratio: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.accept_ratio = accept_ratio
+        self.refuse_ratio = refuse_ratio
+        self.outcomes = {}
+
+    def outcome(self, transaction_id: str):
+        if transaction_id in self.outcomes:
+            return self.outcomes[transaction_id]
+        draw = zlib.crc32(str(transaction_id).encode()) % 10000 / 10000
+        if draw < self.accept_ratio:
+            return 'ACCEPTED'
+        if draw < self.accept_ratio + self.refuse_ratio:
+            return 'REFUSED'
+        return 'PENDING'
+
+    def route(self, handler: FakeHandler, method: str, url):
+        if method != 'POST':
+            return handler.reply(405, {'message': 'Method not allowed'})
+        body = handler.read_json() or {}
+        status = self.outcome(body.get('transaction_id'))
+        handler.reply(200, {
+            'code': '00' if status == 'ACCEPTED' else '662',
+            'message': 'SUCCES' if status == 'ACCEPTED' else status,
+            'data': {'status': status, 'currency': 'XOF'},
+        })
+
+
+class ListmonkApp(FakeApp):
+    """Faux Listmonk : abonnés et emails transactionnels.
+
+    La recherche ne comprend que les requêtes subscribers.email IN (...), et
+    un import CSV est traité tout de suite (son état est aussitôt finished).
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.subscribers = {}
+        self.sent = []
+        self.import_status = {'status': 'none', 'total': 0, 'imported': 0}
+
+    def add_subscriber(self, subscriber: dict):
+        """Add a subscriber, return False if the email already exists."""
+        email = (subscriber.get('email') or '').lower()
+        with self.lock:
+            if email in self.subscribers:
+                return False
+            subscriber['id'] = len(self.subscribers) + 1
+            self.subscribers[email] = subscriber
+            return True
+
+    def import_csv(self, handler: FakeHandler):
+        """Subscribe the rows of a multipart CSV upload."""
+        content_type = 'Content-Type: {}\r\n\r\n'.format(handler.headers.get('Content-Type'))
+        message = BytesParser(policy=HTTP).parsebytes(content_type.encode() + handler.read_body())
+        parts = {part.get_param('name', header='content-disposition'): part.get_content()
+                 for part in message.iter_parts()}
+        params = json.loads(parts.get('params') or '{}')
+        content = parts.get('file') or ''
+        if isinstance(content, bytes):
+            content = content.decode()
+        rows = list(csv.DictReader(io.StringIO(content), delimiter=params.get('delim') or ','))
+        imported = sum(self.add_subscriber({
+            'email': row.get('email'),
+            'name': row.get('name'),
+            'status': 'enabled',
+            'lists': params.get('lists') or [],
+        }) for row in rows)
+        self.import_status = {'status': 'finished', 'total': len(rows), 'imported': imported}
+        return self.import_status
+
+    def route(self, handler: FakeHandler, method: str, url):
+        path = url.path[len('/api'):] if url.path.startswith('/api') else url.path
+        if method == 'GET' and path == '/subscribers':
+            options = dict(parse_qsl(url.query))
+            page = int(options.get('page', 1))
+            per_page = int(options.get('per_page', 20))
+            with self.lock:
+                emails = sorted(self.subscribers)
+            if options.get('query'):
+                wanted = {email.replace("''", "'").lower()
+                          for email in re.findall(r"'((?:[^']|'')*)'", options.get('query'))}
+                emails = [email for email in emails if email in wanted]
+            results = [self.subscribers[email] for email in emails[(page - 1) * per_page:page * per_page]]
+            return handler.reply(200, {'data': {
+                'results': results, 'total': len(emails), 'per_page': per_page, 'page': page}})
+        if method == 'POST' and path == '/subscribers':
+            body = handler.read_json() or {}
+            if not self.add_subscriber(body):
+                return handler.reply(409, {'message': 'E-mail already exists.'})
+            return handler.reply(200, {'data': body})
+        if path == '/import/subscribers':
+            if method == 'POST':
+                return handler.reply(200, {'data': self.import_csv(handler)})
+            if method == 'GET':
+                return handler.reply(200, {'data': self.import_status})
+        if method == 'POST' and path == '/tx':
+            body = handler.read_json() or {}
+            with self.lock:
+                self.sent.append(body)
+            return handler.reply(200, {'data': True})
+        handler.reply(404, {'message': 'Route not found'})
+
+
+class MinioApp(FakeApp):
+    """Faux MinIO : région du bucket, lecture, écriture et suppression d'objets."""
+
+    def __init__(self, region: str = 'us-east-1', **kwargs):
+        super().__init__(**kwargs)
+        self.region = region
+        self.objects = {}
+
+    def endpoint(self, method: str, path: str):
+        return '{} {}'.format(method, re.sub(r'^(/[^/]+)/.+$', r'\1/:object', path))
+
+    def route(self, handler: FakeHandler, method: str, url):
+        parts = url.path.lstrip('/').split('/', 1)
+        if method == 'GET' and len(parts) == 1:
+            body = ('<?xml version="1.0" encoding="UTF-8"?><LocationConstraint '
+                    'xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{}</LocationConstraint>').format(self.region)
+            return handler.reply(200, body.encode(), 'application/xml')
+        if len(parts) != 2:
+            return handler.reply(404, b'', 'application/xml')
+        if method == 'PUT':
+            self.objects[url.path] = handler.read_body()
+            return handler.reply(200, b'', 'application/xml')
+        if method == 'DELETE':
+            self.objects.pop(url.path, None)
+            return handler.reply(204, b'', 'application/xml')
+        if method == 'GET' and url.path in self.objects:
+            return handler.reply(200, self.objects[url.path], 'application/octet-stream')
+        body = ('<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code>'
+                '<Message>The specified key does not exist.</Message></Error>')
+        handler.reply(404, body.encode(), 'application/xml')
+
+
+def serve(app, host: str = '127.0.0.1', port: int = 0):
+    """Serve an app in a background thread, return the server."""
+    server = ThreadingHTTPServer((host, port), FakeHandler)
+    server.daemon_threads = True
+    server.app = app
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def iso_date(moment: datetime):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def seed_catalog(directus: FakeDirectus):
+    """Load one product and its tunnel."""
+    directus.load('dgeass_product', [{
+        'id': 1, 'code': 'P1', 'name': '101 ASTUCES MARKETING',
+        'minio_object_name': 'ed121b4d-eba1-4e9e-a8c5-8a2df5ca6549.pdf',
+        'date_updated': None,
+    }])
+    directus.load('dgeass_tunnel', [{'id': 1, 'code': 'T1', 'price': 5000, 'product': 1}])
+
+
+def seed_orders(directus: FakeDirectus, pending: int = 0, deliver: int = 0, abandoned: int = 0,
+                date_created: str = None, first_id: int = 1):
+    """Load pending, paid-but-undelivered and abandoned orders (and a catalog if none).
+
+    Pending and paid orders are created at date_created (by default, one
+    hour ago); abandoned ones are pending orders older than the abandon
+    delay. Order ids start at first_id, to add a new backlog to the
+    orders already loaded. Every order is stamped with the load time as
+    date_updated, so that the incremental sync of the state store sees
+    each new backlog.
+    """
+    now = datetime.utcnow()
+    date_created = date_created or iso_date(now - timedelta(hours=1))
+    date_abandoned = iso_date(now - timedelta(days=30))
+    if 1 not in directus.items('dgeass_tunnel'):
+        seed_catalog(directus)
+    orders = []
+    for i in range(1, pending + deliver + abandoned + 1):
+        n = first_id + i - 1
+        paid = pending < i <= pending + deliver
+        orders.append({
+            'id': n, 'code': 'ORDER{:08d}'.format(n),
+            'email': 'customer{}@example.com'.format(n),
+            'firstname': 'Firstname', 'lastname': 'LASTNAME',
+            'status': 'completed' if paid else 'started',
+            'transaction_status': 2 if paid else 1,
+            'product_is_delivered': False, 'tunnel': 1,
+            'date_created': date_abandoned if i > pending + deliver else date_created,
+            'date_updated': iso_date(now),
+        })
+    directus.load('dgeass_order', orders)
+
+
+def start_upstreams(host: str = '127.0.0.1', ports: dict = None, latency: float = 0.0,
+                    error_rate: float = 0.0, accept_ratio: float = 0.0, refuse_ratio: float = 0.0,
+                    seed: int = None):
+    """Start the four fake upstreams, return {name: (app, server)}."""
+    ports = ports or {}
+    options = {'latency': latency, 'error_rate': error_rate, 'seed': seed}
+    apps = {
+        'directus': DirectusApp(FakeDirectus(), **options),
+        'cinetpay': CinetPayApp(accept_ratio=accept_ratio, refuse_ratio=refuse_ratio, **options),
+        'listmonk': ListmonkApp(**options),
+        'minio': MinioApp(**options),
+    }
+    return {name: (app, serve(app, host, ports.get(name, 0))) for name, app in apps.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--directus-port', type=int, default=8055)
+    parser.add_argument('--cinetpay-port', type=int, default=8056)
+    parser.add_argument('--listmonk-port', type=int, default=8057)
+    parser.add_argument('--minio-port', type=int, default=8058)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--accept-ratio', type=float, default=0.0)
+    parser.add_argument('--refuse-ratio', type=float, default=0.0)
+    parser.add_argument('--pending', type=int, default=0)
+    parser.add_argument('--deliver', type=int, default=0)
+    parser.add_argument('--abandoned', type=int, default=0)
+    parser.add_argument('--dataset', default=None, help="dataset made by scripts/dataset.py")
+    args = parser.parse_args()
+
+    upstreams = start_upstreams(
+        args.host,
+        ports={'directus': args.directus_port, 'cinetpay': args.cinetpay_port,
+               'listmonk': args.listmonk_port, 'minio': args.minio_port},
+        latency=args.latency, error_rate=args.error_rate,
+        accept_ratio=args.accept_ratio, refuse_ratio=args.refuse_ratio)
+    directus = upstreams['directus'][0].directus
+    if args.dataset:
+        from dataset import load_dataset
+        print(json.dumps(load_dataset(args.dataset, directus, upstreams['cinetpay'][0]).get('orders')))
+    seed_orders(directus, pending=args.pending, deliver=args.deliver,
+                abandoned=args.abandoned, first_id=directus.next_ids.get('dgeass_order', 1))
+    for name, (app, server) in upstreams.items():
+        print("Fake {} on http://{}:{}".format(name, *server.server_address[:2]))
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        for name, (app, server) in upstreams.items():
+            print(name, dict(app.calls))
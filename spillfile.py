@@ -0,0 +1,54 @@
+import json
+import os
+
+from constants import *
+
+
+# Clé de la ligne d'état d'un fichier de sauvegarde
+STATE_KEY = "_spill_state"
+
+
+class SpillFile:
+    """Sauvegarde locale (JSONL) des éléments pas encore envoyés.
+
+    Un tampon y écrit ses éléments quand leur envoi échoue, et les recharge
+    au démarrage suivant. Un petit état (par exemple le début d'une
+    période) peut être sauvegardé avec eux, sur une première ligne à part.
+    """
+
+    def __init__(self, name: str):
+        self.path = os.path.join(DATA_DIRECTORY, name)
+        self.state = {}
+
+    def load(self):
+        """Load the spilled records (their state goes to self.state)."""
+        self.state = {}
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, dict) and STATE_KEY in record:
+                    self.state = record.get(STATE_KEY)
+                else:
+                    records.append(record)
+        return records
+
+    def save(self, records: list, state: dict = None):
+        """Replace the spilled records (and their state)."""
+        if not os.path.exists(DATA_DIRECTORY):
+            os.makedirs(DATA_DIRECTORY)
+        with open(self.path + '.tmp', 'w') as f:
+            if state:
+                f.write(json.dumps({STATE_KEY: state}) + '\n')
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+
+    def remove(self):
+        """Delete the spill file, once its records are sent."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
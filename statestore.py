@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from time import time
+
+from constants import *
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id PRIMARY KEY,
+    status TEXT,
+    transaction_status INTEGER,
+    product_is_delivered INTEGER,
+    date_created TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_status ON orders (status, transaction_status);
+CREATE INDEX IF NOT EXISTS orders_delivery ON orders (transaction_status, product_is_delivered);
+CREATE TABLE IF NOT EXISTS cursors (
+    name TEXT PRIMARY KEY,
+    high_water TEXT,
+    reconciled_at REAL
+);
+"""
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class OrderStore:
+    """Index local (SQLite) des commandes que le worker peut avoir à traiter.
+
+    Au lieu de relister à chaque cycle les commandes depuis Directus, l'index
+    ne récupère que les commandes créées ou modifiées depuis la dernière
+    synchronisation (curseur sur date_updated / date_created). Une
+    réconciliation complète remplace périodiquement son contenu, pour
+    rattraper ce qu'une synchronisation incrémentale aurait manqué.
+
+    Seules les commandes actives sont gardées : en attente de paiement, ou
+    payées et pas encore livrées.
+    """
+
+    def __init__(self, env_vars: dict, list_active, list_changed, path: str = None):
+        self.env_vars = env_vars
+        self.list_active = list_active
+        self.list_changed = list_changed
+        self.overlap = env_vars.get("STATE_SYNC_OVERLAP")
+        self.reconcile_interval = env_vars.get("STATE_RECONCILE_INTERVAL")
+        self.path = path or os.path.join(DATA_DIRECTORY, STATE_STORE_FILE)
+        self.lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    @staticmethod
+    def is_active(order: dict):
+        """Whether the worker may still have to process the order."""
+        return order.get('status') == ORDER_STATUS_STARTED or (
+            order.get('transaction_status') == TRANSACTION_STATUS_ACCEPTED
+            and not order.get('product_is_delivered'))
+
+    @staticmethod
+    def last_change(order: dict):
+        return order.get('date_updated') or order.get('date_created') or ''
+
+    def get_cursor(self, name: str = 'orders'):
+        row = self.conn.execute(
+            "SELECT high_water, reconciled_at FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row if row is not None else (None, None)
+
+    def set_cursor(self, high_water: str, reconciled_at: float, name: str = 'orders'):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cursors (name, high_water, reconciled_at) VALUES (?, ?, ?)",
+            (name, high_water, reconciled_at))
+
+    def upsert(self, orders: list):
+        """Store the active orders, forget the others."""
+        for order in orders:
+            if self.is_active(order):
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO orders (id, status, transaction_status, "
+                    "product_is_delivered, date_created, data) VALUES (?, ?, ?, ?, ?, ?)",
+                    (order.get('id'), order.get('status'), order.get('transaction_status'),
+                     int(bool(order.get('product_is_delivered'))), order.get('date_created'),
+                     json.dumps(order)))
+            else:
+                self.conn.execute(
+                    "DELETE FROM orders WHERE id = ?", (order.get('id'),))
+
+    def fetch(self, pages):
+        """Read all the pages of a listing, or None if one of them failed."""
+        orders = []
+        for r_dts_orders in pages:
+            if not r_dts_orders.get('success'):
+                return None
+            orders.extend(r_dts_orders.get('data'))
+        return orders
+
+    def reconcile(self):
+        """Replace the index with the active orders listed from Directus."""
+        logger = self.env_vars.get('logger')
+        # Tout ce qui change après ce point sera repris par la synchronisation
+        started = (datetime.utcnow() - timedelta(seconds=self.overlap)).strftime(DATE_FORMAT)
+        orders = self.fetch(self.list_active(env_vars=self.env_vars))
+        if orders is None:
+            return False
+
+        with self.conn:
+            self.conn.execute("DELETE FROM orders")
+            self.upsert(orders)
+            self.set_cursor(max([started] + [self.last_change(order) for order in orders]), time())
+        logger.info("Order index reconciled: {} active orders.".format(len(orders)))
+        return True
+
+    def sync_changes(self, high_water: str, reconciled_at: float):
+        """Fetch the orders created or updated since the high-water mark."""
+        logger = self.env_vars.get('logger')
+        since = (datetime.strptime(high_water[:19], DATE_FORMAT)
+                 - timedelta(seconds=self.overlap)).strftime(DATE_FORMAT)
+        orders = self.fetch(self.list_changed(env_vars=self.env_vars, since=since))
+        if orders is None:
+            return False
+
+        with self.conn:
+            self.upsert(orders)
+            self.set_cursor(max([high_water] + [self.last_change(order) for order in orders]),
+                            reconciled_at)
+        logger.info("Order index synced: {} changed orders.".format(len(orders)))
+        return True
+
+    def sync(self):
+        """Bring the index up to date; return False if Directus could not be read."""
+        with self.lock:
+            high_water, reconciled_at = self.get_cursor()
+            if high_water is None or time() - reconciled_at >= self.reconcile_interval:
+                return self.reconcile()
+            return self.sync_changes(high_water, reconciled_at)
+
+    def apply(self, keys: list, data: dict):
+        """Apply to the index an update made by the worker itself."""
+        with self.lock, self.conn:
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT data FROM orders WHERE id = ?", (key,)).fetchone()
+                if row is not None:
+                    order = json.loads(row[0])
+                    order.update(data)
+                    self.upsert([order])
+
+    def pages(self, where: str, params: tuple, message: str, page_size: int = None):
+        """Sync the index, then list the matching orders page by page.
+
+        Yields results shaped like the Directus listings.
+        """
+        if not self.sync():
+            yield {
+                'success': False,
+                'message': "Order index could not be synced."
+            }
+            return
+
+        page_size = page_size or self.env_vars.get("DIRECTUS_PAGE_SIZE", NLIMIT)
+        last_id = None
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, data FROM orders WHERE {} {} ORDER BY id LIMIT ?".format(
+                        where, "" if last_id is None else "AND id > ?"),
+                    params + (() if last_id is None else (last_id,)) + (page_size,)
+                ).fetchall()
+            yield {
+                'success': True,
+                'message': message,
+                'data': [json.loads(row[1]) for row in rows]
+            }
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def list_pending(self, page_size: int = None):
+        """List the pending orders, page by page."""
+        return self.pages(
+            "status = ? AND transaction_status = ?",
+            (ORDER_STATUS_STARTED, TRANSACTION_STATUS_PENDING),
+            "Orders listed from the local index.", page_size)
+
+    def list_abandoned(self, page_size: int = None):
+        """List the abandoned orders, page by page."""
+        filter_date = (datetime.now() - timedelta(days=DAYS_TO_ABANDON_ORDER)
+                       ).strftime(DATE_FORMAT)
+        return self.pages(
+            "status = ? AND date_created < ?",
+            (ORDER_STATUS_STARTED, filter_date),
+            "Abandoned orders listed from the local index.", page_size)
+
+    def list_not_delivered(self, page_size: int = None):
+        """List the orders with product not delivered, page by page."""
+        return self.pages(
+            "transaction_status = ? AND product_is_delivered = 0",
+            (TRANSACTION_STATUS_ACCEPTED,),
+            "Orders with product not delivered listed from the local index.", page_size)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+from time import time
+
+from constants import *
+
+
+class SubscriberCache:
+    """Cache des abonnés Listmonk déjà connus.
+
+    Évite d'appeler la création d'abonné pour une adresse qui existe déjà.
+    Le cache est sauvegardé sur disque et peut être préchargé depuis l'API
+    de recherche des abonnés de Listmonk lorsqu'il est absent ou trop ancien. Une adresse dont l'envoi échoue
+    est oubliée, pour que l'abonné soit recréé s'il a été supprimé.
+    """
+
+    def __init__(self, env_vars: dict, loader):
+        self.env_vars = env_vars
+        self.loader = loader
+        self.cache_file = os.path.join(DATA_DIRECTORY, SUBSCRIBER_CACHE_FILE)
+        self.lock = threading.Lock()
+        self.emails = set()
+        self.dirty = False
+
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, 'r') as f:
+                self.emails = set(json.load(f))
+
+    @staticmethod
+    def normalize(email: str):
+        return (email or "").strip().lower()
+
+    def __contains__(self, email: str):
+        return self.normalize(email) in self.emails
+
+    def __len__(self):
+        return len(self.emails)
+
+    def add(self, email: str):
+        """Mark an email as a known subscriber."""
+        email = self.normalize(email)
+        with self.lock:
+            if email not in self.emails:
+                self.emails.add(email)
+                self.dirty = True
+
+    def discard(self, email: str):
+        """Forget an email (deleted in Listmonk, or failing to receive emails)."""
+        email = self.normalize(email)
+        with self.lock:
+            if email in self.emails:
+                self.emails.discard(email)
+                self.dirty = True
+
+    def is_stale(self):
+        """Whether the cache file is missing or older than its maximum age."""
+        if not os.path.exists(self.cache_file):
+            return True
+        max_age = self.env_vars.get("SUBSCRIBER_CACHE_MAX_AGE")
+        return time() - os.path.getmtime(self.cache_file) > max_age
+
+    def warm(self):
+        """Load all the existing subscribers from Listmonk."""
+        logger = self.env_vars.get('logger')
+        for r_lmk_subscribers in self.loader(env_vars=self.env_vars):
+            if not r_lmk_subscribers.get('success'):
+                return False
+            for subscriber in r_lmk_subscribers.get('data'):
+                self.add(subscriber.get('email'))
+        logger.info("{} known subscriber(s) loaded.".format(len(self)))
+        # Sauvegarder même sans changement : la date du fichier est celle
+        # du dernier préchargement
+        with self.lock:
+            self.dirty = True
+        self.save()
+        return True
+
+    def save(self):
+        """Save the known subscribers to disk, if they changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+            emails = sorted(self.emails)
+            self.dirty = False
+        if not os.path.exists(DATA_DIRECTORY):
+            os.makedirs(DATA_DIRECTORY)
+        with open(self.cache_file + '.tmp', 'w') as f:
+            json.dump(emails, f)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import sys
+
+import pytest
+import requests as rq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+from constants import *  # noqa: E402
+from fakes import DirectusApp, FakeDirectus, serve  # noqa: E402
+from httpclient import HttpClient  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from tracing import Tracer  # noqa: E402
+
+
+def make_response(status_code: int = 200, data=None):
+    """A requests response, with a JSON body if data is given."""
+    res = rq.Response()
+    res.status_code = status_code
+    if data is not None:
+        res._content = json.dumps(data).encode()
+    return res
+
+
+@pytest.fixture
+def response():
+    return make_response
+
+
+@pytest.fixture
+def settings():
+    """Settings added to env_vars; override this fixture in a module to change them."""
+    return {}
+
+
+@pytest.fixture
+def directus_latency():
+    """Latency of the fake Directus, in seconds."""
+    return 0.0
+
+
+@pytest.fixture
+def directus(directus_latency):
+    """In-memory fake Directus, served on a free port (url attribute)."""
+    directus = FakeDirectus()
+    server = serve(DirectusApp(directus, latency=directus_latency))
+    directus.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    yield directus
+    server.shutdown()
+
+
+@pytest.fixture
+def env_vars(request, settings, tmp_path, monkeypatch):
+    """Settings and services of the worker, in a temporary working directory.
+
+    Directus is the fake one when the test also uses the directus fixture.
+    """
+    monkeypatch.chdir(tmp_path)
+    env_vars = {
+        'ENV': 'noprod',
+        'URL_OF_DIRECTUS_NOPROD': 'http://directus.test',
+        'ROUTE_OF_DIRECTUS_FOR_DGEASS_PRODUCT': '/items/dgeass_product',
+        'ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER': '/items/dgeass_order',
+        'ROUTE_OF_DIRECTUS_FOR_DGEASS_TRANSACTION_LOG': '/items/dgeass_transaction_log',
+        'ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER_CLAIM': '/items/dgeass_order_claim',
+        'LISTMONK_API_URL': 'http://listmonk.test/api',
+        'DIRECTUS_BATCH_SIZE': 500,
+        'WORKER_SHARD_COUNT': 1,
+        'RETRY_COUNT': 0,
+        'logger': logging.getLogger(APP_NAME),
+        'metrics': Metrics(),
+    }
+    if 'directus' in request.fixturenames:
+        env_vars['URL_OF_DIRECTUS_NOPROD'] = request.getfixturevalue('directus').url
+    env_vars.update(settings)
+    env_vars['tracer'] = Tracer(env_vars)
+    env_vars['http'] = HttpClient(env_vars)
+    yield env_vars
+    env_vars['http'].close()
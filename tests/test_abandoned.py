@@ -0,0 +1,25 @@
+import pytest
+
+from constants import *
+from fakes import seed_orders
+from functions import treat_abandoned_orders_page
+
+
+@pytest.fixture
+def settings():
+    return {'DIRECTUS_BATCH_SIZE': 2}
+
+
+def test_settled_orders_are_not_abandoned(env_vars, directus):
+    seed_orders(directus, abandoned=5)
+    orders = [dict(order) for order in directus.items('dgeass_order').values()]
+    # Réglée par une notification entre la liste et la mise à jour
+    directus.items('dgeass_order')[3]['status'] = ORDER_STATUS_COMPLETED
+
+    treat_abandoned_orders_page(env_vars, orders)
+
+    statuses = {key: order['status'] for key, order in directus.items('dgeass_order').items()}
+    assert statuses == {1: ORDER_STATUS_ABANDONED, 2: ORDER_STATUS_ABANDONED,
+                        3: ORDER_STATUS_COMPLETED, 4: ORDER_STATUS_ABANDONED,
+                        5: ORDER_STATUS_ABANDONED}
+    assert 'worker_orders_abandoned_total 4' in env_vars['metrics'].render()
@@ -0,0 +1,56 @@
+from unittest import mock
+
+import pytest
+
+from admindigest import AdminDigest
+
+
+@pytest.fixture
+def settings():
+    return {'ADMIN_DIGEST_INTERVAL': 3600.0, 'ADMIN_EMAILS': 'admin@example.com'}
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def sender(sent):
+    def send(env_vars, data):
+        sent.append(data)
+        return {'success': True}
+    return send
+
+
+def test_one_shot_runs_share_the_digest_window(env_vars, sender, sent):
+    with mock.patch('admindigest.time', return_value=1000.0):
+        first = AdminDigest(env_vars, sender)
+        first.add({'order_code': 'A'})
+        first.flush()
+        first.close(force=False)
+    assert sent == []
+
+    # Exécution suivante, avant la fin de la période : rien n'est envoyé
+    with mock.patch('admindigest.time', return_value=2000.0):
+        second = AdminDigest(env_vars, sender)
+        assert second.started_at == 1000.0
+        second.add({'order_code': 'B'})
+        second.flush()
+        second.close(force=False)
+    assert sent == []
+
+    # Période écoulée : un seul résumé avec les commandes des deux exécutions
+    with mock.patch('admindigest.time', return_value=4700.0):
+        third = AdminDigest(env_vars, sender)
+        third.flush()
+        third.close(force=False)
+    assert [[order['order_code'] for order in data['data']['orders']] for data in sent] == [['A', 'B']]
+    assert AdminDigest(env_vars, sender).orders == []
+
+
+def test_long_running_worker_sends_on_stop(env_vars, sender, sent):
+    digest = AdminDigest(env_vars, sender)
+    digest.add({'order_code': 'A'})
+    digest.close()
+    assert len(sent) == 1
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from fakes import seed_orders
+from functions import prune_order_claims, settle_transaction
+from utilities import directus_claim_orders
+
+CLAIMS = 'dgeass_order_claim'
+KEYS = list(range(1, 51))
+
+
+@pytest.fixture
+def directus_latency():
+    # La latence élargit la fenêtre entre la lecture des réservations et leur création
+    return 0.02
+
+
+def claim_concurrently(env_vars: dict, owners: list, keys: list):
+    barrier = threading.Barrier(len(owners))
+    claimed = {}
+
+    def claim(owner: str):
+        barrier.wait()
+        claimed[owner] = directus_claim_orders(env_vars, keys, owner, 300.0)
+
+    threads = [threading.Thread(target=claim, args=(owner,)) for owner in owners]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claimed
+
+
+def test_concurrent_claims_are_exclusive(env_vars, directus):
+    claimed = claim_concurrently(env_vars, ['worker-a', 'worker-b', 'worker-c'], KEYS)
+
+    winners = [key for keys in claimed.values() for key in keys]
+    assert sorted(winners) == KEYS
+    assert len(directus.items(CLAIMS)) == len(KEYS)
+
+
+def test_claim_is_kept_without_a_write(env_vars, directus):
+    assert directus_claim_orders(env_vars, KEYS, 'worker-a', 300.0) == KEYS
+    assert directus_claim_orders(env_vars, KEYS, 'worker-a', 300.0) == KEYS
+    assert directus_claim_orders(env_vars, KEYS, 'worker-b', 300.0) == []
+    assert sorted(directus.items(CLAIMS)) == sorted('{}:1'.format(key) for key in KEYS)
+
+
+def test_expired_claim_is_taken_over_once(env_vars, directus):
+    directus_claim_orders(env_vars, KEYS, 'worker-a', 300.0)
+    for claim in directus.items(CLAIMS).values():
+        claim['expires_at'] = '2000-01-01T00:00:00.000Z'
+
+    claimed = claim_concurrently(env_vars, ['worker-b', 'worker-c'], KEYS)
+
+    winners = [key for keys in claimed.values() for key in keys]
+    assert sorted(winners) == KEYS
+    assert all(claim.get('generation') in (1, 2) for claim in directus.items(CLAIMS).values())
+
+
+def test_old_generations_are_pruned(env_vars, directus):
+    for _ in range(3):
+        directus_claim_orders(env_vars, KEYS[:1], 'worker-a', 300.0)
+        for claim in directus.items(CLAIMS).values():
+            claim['expires_at'] = '2000-01-01T00:00:00.000Z'
+    directus_claim_orders(env_vars, KEYS[:1], 'worker-a', 300.0)
+
+    assert sorted(directus.items(CLAIMS)) == ['1:3', '1:4']
+
+
+def test_notification_is_left_to_the_claim_owner(env_vars, directus):
+    seed_orders(directus, pending=1)
+    directus_claim_orders(env_vars, [1], 'worker-b', 300.0)
+    env_vars.update(ORDER_LEASE_ENABLED=True, WORKER_ID='worker-a', ORDER_LEASE_DURATION=300.0)
+
+    assert settle_transaction(env_vars, 'ORDER00000001') is False
+    assert directus.items('dgeass_order')[1]['status'] == 'started'
+    assert [claim['owner'] for claim in directus.items(CLAIMS).values()] == ['worker-b']
+
+
+def test_expired_claims_of_finished_orders_are_pruned(env_vars, directus):
+    seed_orders(directus, pending=1, deliver=3)
+    directus_claim_orders(env_vars, [1, 2, 3, 4], 'worker-a', 300.0)
+    for key in (2, 3, 4):
+        directus.items('dgeass_order')[key]['product_is_delivered'] = True
+    for key in ('1:1', '2:1', '3:1'):
+        directus.items(CLAIMS)[key]['expires_at'] = '2000-01-01T00:00:00.000Z'
+    env_vars.update(ORDER_LEASE_ENABLED=True, ORDER_LEASE_DURATION=300.0, DIRECTUS_BATCH_SIZE=2)
+
+    assert prune_order_claims(env_vars) is True
+    # La commande 1 est encore en attente, la réservation de la 4 court encore
+    assert sorted(directus.items(CLAIMS)) == ['1:1', '4:1']
@@ -0,0 +1,42 @@
+from time import sleep
+from unittest import mock
+
+import pytest
+
+import functions
+from pipeline import Pipeline, Stage
+from subscribers import SubscriberCache
+from utilities import listmonk_list_subscribers
+
+ORDERS = [{'id': key, 'code': 'ORDER-{}'.format(key)} for key in range(1, 11)]
+
+
+@pytest.fixture
+def delivery(env_vars):
+    env_vars['subscribers'] = SubscriberCache(env_vars, listmonk_list_subscribers)
+    delivered = set()
+    sent = []
+
+    def send(env_vars, item):
+        # Envoi lent : les commandes sont encore en file à la fin de la liste
+        sleep(0.01)
+        sent.append(item['order']['id'])
+        delivered.add(item['order']['id'])
+        return item
+
+    def list_not_delivered_orders(env_vars):
+        yield {'success': True, 'data': [order for order in ORDERS if order['id'] not in delivered]}
+        yield {'success': False, 'message': 'Error: page 2'}
+
+    pipeline = Pipeline(env_vars, [Stage("email", send)], queue_size=len(ORDERS))
+    with mock.patch.object(functions, "delivery_pipeline", pipeline), \
+            mock.patch.object(functions, "register_customers"), \
+            mock.patch.object(functions, "list_not_delivered_orders", list_not_delivered_orders):
+        yield sent
+
+
+def test_failed_page_does_not_resubmit_orders(env_vars, delivery):
+    assert functions.treat_not_delivered_orders(env_vars) is False
+    assert functions.treat_not_delivered_orders(env_vars) is False
+
+    assert sorted(delivery) == [order['id'] for order in ORDERS]
@@ -0,0 +1,124 @@
+from unittest import mock
+
+import pytest
+import requests as rq
+
+from circuitbreaker import CircuitBreaker, CircuitOpenError
+from constants import *
+
+URL = "http://directus.test/items/dgeass_order"
+
+
+@pytest.fixture
+def clock():
+    """Monotonic clock of the circuit breakers, moved by hand."""
+    now = [1000.0]
+    with mock.patch("circuitbreaker.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+@pytest.fixture
+def settings():
+    return {
+        "CIRCUIT_FAILURE_THRESHOLD": 2,
+        "CIRCUIT_RESET_TIMEOUT": 30.0,
+    }
+
+
+@pytest.fixture
+def client(env_vars):
+    return env_vars['http']
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("directus", failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_breaker_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker("directus", failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+    clock[0] += 30.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_failed_trial_reopens(clock):
+    breaker = CircuitBreaker("directus", failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+    clock[0] += 30.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock[0] += 30.0
+    assert breaker.allow()
+
+
+def test_request_opens_circuit_on_server_errors(clock, client, response):
+    session = client.sessions[UPSTREAM_DIRECTUS]
+    with mock.patch.object(session, "request", return_value=response(503)) as request:
+        assert client.request(UPSTREAM_DIRECTUS, "GET", URL).status_code == 503
+        assert client.request(UPSTREAM_DIRECTUS, "GET", URL).status_code == 503
+        with pytest.raises(CircuitOpenError):
+            client.request(UPSTREAM_DIRECTUS, "GET", URL)
+    assert request.call_count == 2
+
+
+@pytest.mark.parametrize("error", [
+    rq.exceptions.ChunkedEncodingError,
+    rq.exceptions.ContentDecodingError,
+    rq.exceptions.TooManyRedirects,
+])
+def test_request_failed_trial_does_not_stick_half_open(clock, client, error, response):
+    breaker = client.breakers[UPSTREAM_DIRECTUS]
+    session = client.sessions[UPSTREAM_DIRECTUS]
+    breaker.record_failure()
+    breaker.record_failure()
+    clock[0] += 30.0
+
+    # L'appel d'essai échoue : le circuit se rouvre au lieu de rester à moitié ouvert
+    with mock.patch.object(session, "request", side_effect=error("broken")):
+        with pytest.raises(error):
+            client.request(UPSTREAM_DIRECTUS, "GET", URL)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Un nouvel essai est permis après le délai, et son succès referme le circuit
+    clock[0] += 30.0
+    with mock.patch.object(session, "request", return_value=response(200)):
+        assert client.request(UPSTREAM_DIRECTUS, "GET", URL).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_request_counts_other_errors_as_failures(clock, client):
+    session = client.sessions[UPSTREAM_DIRECTUS]
+    with mock.patch.object(session, "request",
+                           side_effect=rq.exceptions.ChunkedEncodingError("broken")):
+        for _ in range(2):
+            with pytest.raises(rq.exceptions.ChunkedEncodingError):
+                client.request(UPSTREAM_DIRECTUS, "GET", URL)
+    assert client.breakers[UPSTREAM_DIRECTUS].state == CircuitBreaker.OPEN
+
+
+def test_request_metrics_render_after_connection_error(clock, client, response):
+    session = client.sessions[UPSTREAM_DIRECTUS]
+    with mock.patch.object(session, "request", return_value=response(200)):
+        client.request(UPSTREAM_DIRECTUS, "GET", URL)
+    with mock.patch.object(session, "request", side_effect=rq.exceptions.ConnectionError("down")):
+        with pytest.raises(rq.exceptions.ConnectionError):
+            client.request(UPSTREAM_DIRECTUS, "GET", URL)
+
+    text = client.metrics.render()
+    assert 'worker_upstream_requests_total{status="200",upstream="directus"} 1' in text
+    assert 'worker_upstream_requests_total{status="error",upstream="directus"} 1' in text
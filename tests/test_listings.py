@@ -0,0 +1,27 @@
+from unittest import mock
+
+import requests as rq
+
+from constants import *
+from utilities import directus_list_pages
+
+URL = "http://directus.test/items/dgeass_order"
+
+
+def list_pages(env_vars: dict, side_effect: list):
+    session = env_vars['http'].sessions[UPSTREAM_DIRECTUS]
+    with mock.patch.object(session, "request", side_effect=side_effect):
+        return list(directus_list_pages(env_vars, URL, "Orders listed.", "Error: ", page_size=2))
+
+
+def test_pages_until_a_short_page(env_vars, response):
+    pages = list_pages(env_vars, [response(data={'data': [{'id': 1}, {'id': 2}]}),
+                                  response(data={'data': [{'id': 3}]})])
+    assert [page.get('success') for page in pages] == [True, True]
+    assert [item.get('id') for page in pages for item in page.get('data')] == [1, 2, 3]
+
+
+def test_error_in_the_middle_of_a_listing_is_reported(env_vars, response):
+    pages = list_pages(env_vars, [response(data={'data': [{'id': 1}, {'id': 2}]}),
+                                  rq.exceptions.ChunkedEncodingError("broken")])
+    assert [page.get('success') for page in pages] == [True, False]
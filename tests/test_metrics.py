@@ -0,0 +1,14 @@
+from metrics import Metrics
+
+
+def test_render_mixed_label_types():
+    metrics = Metrics()
+    metrics.inc("worker_upstream_requests_total", upstream="directus", status=200)
+    metrics.inc("worker_upstream_requests_total", upstream="directus", status="error")
+    metrics.observe("worker_upstream_request_duration_seconds", 0.1, upstream="directus", attempt=1)
+    metrics.observe("worker_upstream_request_duration_seconds", 0.2, upstream="directus", attempt="last")
+
+    text = metrics.render()
+    assert 'worker_upstream_requests_total{status="200",upstream="directus"} 1' in text
+    assert 'worker_upstream_requests_total{status="error",upstream="directus"} 1' in text
+    assert 'attempt="last"' in text
@@ -0,0 +1,60 @@
+import pytest
+
+from cache import TTLCache
+from cinetpay_notify import send_notification
+from fakes import CinetPayApp, seed_orders, serve
+from notifications import NotificationReceiver
+from polling import PollingSchedule
+from transactionlogs import TransactionLogBuffer
+from utilities import directus_create_transaction_logs
+
+SITE_ID = '123456'
+CODE = 'ORDER00000001'
+
+
+@pytest.fixture
+def cinetpay():
+    cinetpay = CinetPayApp()
+    server = serve(cinetpay)
+    cinetpay.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    yield cinetpay
+    server.shutdown()
+
+
+@pytest.fixture
+def notify_url(env_vars, directus, cinetpay):
+    env_vars.update({
+        'CINETPAY_CHECK_URL': cinetpay.url + '/v2/payment/check',
+        'CINETPAY_API_KEY': 'key',
+        'CINETPAY_SITE_ID': SITE_ID,
+        'CINETPAY_NOTIFY_PATH': '/cinetpay/notify',
+        'polling': PollingSchedule("60"),
+        'settled': TTLCache(ttl=3600, maxsize=100),
+    })
+    env_vars['transaction_logs'] = TransactionLogBuffer(env_vars, writer=directus_create_transaction_logs)
+    receiver = NotificationReceiver(env_vars, host='127.0.0.1', port=0)
+    receiver.start()
+    yield 'http://127.0.0.1:{}/cinetpay/notify'.format(receiver.port)
+    receiver.stop()
+
+
+def test_notification_settles_the_order_once(directus, cinetpay, notify_url):
+    seed_orders(directus, pending=1)
+    cinetpay.outcomes[CODE] = 'ACCEPTED'
+
+    assert send_notification(notify_url, SITE_ID, CODE).status_code == 200
+    order = directus.items('dgeass_order')[1]
+    assert (order['status'], order['transaction_status']) == ('completed', 2)
+
+    # CinetPay renvoie la notification : la commande n'est plus en attente
+    assert send_notification(notify_url, SITE_ID, CODE).status_code == 200
+    logs = list(directus.items('dgeass_transaction_log').values())
+    assert [(log['order'], log['status']) for log in logs] == [('1', 2)]
+
+
+def test_notification_for_another_site_is_rejected(directus, cinetpay, notify_url):
+    seed_orders(directus, pending=1)
+    cinetpay.outcomes[CODE] = 'ACCEPTED'
+
+    assert send_notification(notify_url, '654321', CODE).status_code == 400
+    assert directus.items('dgeass_order')[1]['status'] == 'started'
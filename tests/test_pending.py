@@ -0,0 +1,19 @@
+from unittest import mock
+
+import functions
+from polling import PollingSchedule
+
+ORDERS = [{'id': key, 'code': 'ORDER-{}'.format(key), 'date_created': '2026-01-01T00:00:00.000Z'}
+          for key in (1, 2)]
+
+
+def test_failed_check_is_due_again(env_vars):
+    env_vars['polling'] = PollingSchedule("600")
+    rchecks = [{'success': True, 'data': {'data': {'status': 'PENDING'}}},
+               {'success': False, 'message': 'timeout'}]
+    with mock.patch.object(functions, "check_transactions", return_value=rchecks), \
+            mock.patch.object(functions, "settle_orders"):
+        functions.treat_pending_orders_page(env_vars, ORDERS)
+
+    assert not env_vars['polling'].is_due(ORDERS[0])
+    assert env_vars['polling'].is_due(ORDERS[1])
@@ -0,0 +1,73 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    with mock.patch("pipeline.perf_counter", clock):
+        yield clock
+
+
+def test_stats_measure_each_cycle(env_vars, clock):
+    def slow(env_vars, item):
+        clock.advance(0.01)
+        return item
+
+    def odd_only(env_vars, item):
+        return item if item % 2 else None
+
+    pipeline = Pipeline(env_vars, [Stage("slow", slow), Stage("odd", odd_only)], queue_size=4)
+    pipeline.begin_cycle()
+    for item in range(10):
+        pipeline.submit(item)
+    pipeline.join()
+    first = {stats['stage']: stats for stats in pipeline.stats()}
+    assert first['slow']['cycle_processed'] == 10
+    assert first['odd']['dropped'] == 5
+    # 10 ms par élément : 100 éléments par seconde
+    assert first['slow']['capacity'] == pytest.approx(100)
+    assert first['slow']['throughput'] == pytest.approx(100)
+
+    # Le temps d'inactivité entre deux cycles ne compte pas
+    clock.advance(300)
+    pipeline.begin_cycle()
+    for item in range(10):
+        pipeline.submit(item)
+    pipeline.join()
+    second = {stats['stage']: stats for stats in pipeline.stats()}
+    assert second['slow']['cycle_processed'] == 10
+    assert second['slow']['processed'] == 20
+    assert second['slow']['throughput'] == pytest.approx(100)
+
+
+def test_item_in_flight_is_not_submitted_twice(env_vars):
+    release = threading.Event()
+
+    def wait(env_vars, item):
+        release.wait(5)
+        return item
+
+    pipeline = Pipeline(env_vars, [Stage("wait", wait)], queue_size=4)
+    assert pipeline.submit('a', key=1) is True
+    assert pipeline.submit('a', key=1) is False
+    release.set()
+    pipeline.join()
+    assert pipeline.submit('a', key=1) is True
+    pipeline.join()
+    assert pipeline.stats()[0]['processed'] == 2
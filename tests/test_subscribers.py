@@ -0,0 +1,45 @@
+import os
+from time import time
+from unittest import mock
+
+import requests as rq
+
+from constants import *
+from subscribers import SubscriberCache
+from utilities import listmonk_list_subscribers
+
+
+def test_discard_forgets_an_email(env_vars):
+    cache = SubscriberCache(env_vars, listmonk_list_subscribers)
+    cache.add('Customer@Example.com')
+    cache.save()
+
+    cache.discard('customer@example.com ')
+    assert 'customer@example.com' not in cache
+    cache.save()
+    assert 'customer@example.com' not in SubscriberCache(env_vars, listmonk_list_subscribers)
+
+
+def test_warm_fails_when_the_listing_breaks(env_vars, response):
+    cache = SubscriberCache(env_vars, lambda env_vars: listmonk_list_subscribers(env_vars, page_size=1))
+    first_page = response(data={'data': {'results': [{'email': 'a@example.com'}]}})
+    session = env_vars['http'].sessions[UPSTREAM_LISTMONK]
+    with mock.patch.object(session, "request",
+                           side_effect=[first_page, rq.exceptions.ChunkedEncodingError("broken")]):
+        assert cache.warm() is False
+    assert 'a@example.com' in cache
+
+
+def test_warm_only_a_missing_or_old_cache(env_vars, response):
+    env_vars['SUBSCRIBER_CACHE_MAX_AGE'] = 3600.0
+    cache = SubscriberCache(env_vars, listmonk_list_subscribers)
+    assert cache.is_stale()
+
+    session = env_vars['http'].sessions[UPSTREAM_LISTMONK]
+    with mock.patch.object(session, "request", return_value=response(data={'data': {'results': []}})):
+        assert cache.warm() is True
+    assert not cache.is_stale()
+
+    old = time() - 7200
+    os.utime(cache.cache_file, (old, old))
+    assert cache.is_stale()
@@ -0,0 +1,168 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, time
+
+from constants import *
+
+
+# Trace du cycle en cours, propagée aux threads par copie du contexte
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def bind(func):
+    """Bind a function to a copy of the current context (trace included).
+
+    To be used when handing work to another thread; each call to bind makes
+    its own copy, so the bound functions can run concurrently.
+    """
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return bound
+
+
+class Trace:
+    """Spans d'un cycle d'une tâche."""
+
+    def __init__(self, task: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.task = task
+        self.started_at = time()
+        self.origin = perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, started: float, duration: float, attrs: dict, error: str = None):
+        span = {
+            'name': name,
+            'start_ms': round((started - self.origin) * 1000, 3),
+            'duration_ms': round(duration * 1000, 3),
+            'thread': threading.current_thread().name,
+        }
+        span.update(attrs)
+        if error is not None:
+            span['error'] = error
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self, duration: float, success: bool):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.get('start_ms'))
+        return {
+            'trace_id': self.trace_id,
+            'task': self.task,
+            'started_at': datetime.utcfromtimestamp(self.started_at).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            'duration_ms': round(duration * 1000, 3),
+            'success': success,
+            'spans': spans,
+        }
+
+
+class Tracer:
+    """Traces par cycle et profilage à la demande.
+
+    Chaque cycle d'une tâche peut être tracé : les appels aux services amont
+    et les phases des traitements sont chronométrés (spans), puis le cycle
+    est écrit sur une ligne JSON dans logs/traces/<date>.jsonl.
+
+    Les PROFILE_CYCLES premiers cycles, puis les PROFILE_SIGNAL_CYCLES cycles
+    suivant chaque signal SIGUSR1, sont profilés avec cProfile. Les
+    statistiques (format pstats, lisible par snakeviz, flameprof ou
+    gprof2dot) sont écrites dans logs/profiles/. cProfile ne suit que le
+    thread du cycle, et un seul cycle est profilé à la fois.
+    """
+
+    def __init__(self, env_vars: dict):
+        self.enabled = env_vars.get("TRACE_ENABLED", DEFAULTS.get("TRACE_ENABLED"))
+        self.profile_remaining = env_vars.get("PROFILE_CYCLES", DEFAULTS.get("PROFILE_CYCLES"))
+        self.profile_signal_cycles = env_vars.get(
+            "PROFILE_SIGNAL_CYCLES", DEFAULTS.get("PROFILE_SIGNAL_CYCLES"))
+        self.trace_directory = os.path.join(LOG_DIRECTORY, TRACE_DIRECTORY)
+        self.profile_directory = os.path.join(LOG_DIRECTORY, PROFILE_DIRECTORY)
+        self.lock = threading.Lock()
+        self.profile_lock = threading.Lock()
+        self.logger = logging.getLogger(APP_NAME)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time a block; the yielded dict can receive more attributes."""
+        trace = current_trace.get()
+        if trace is None:
+            yield attrs
+            return
+        started = perf_counter()
+        error = None
+        try:
+            yield attrs
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            trace.add(name, started, perf_counter() - started, attrs, error)
+
+    def run(self, name: str, func, env_vars: dict):
+        """Run one cycle of a task, traced and profiled if requested."""
+        profiler = self.start_profile()
+        trace = Trace(name) if self.enabled else None
+        token = current_trace.set(trace)
+        started = perf_counter()
+        success = False
+        try:
+            result = func(env_vars)
+            success = result is not False
+            return result
+        finally:
+            current_trace.reset(token)
+            duration = perf_counter() - started
+            if profiler is not None:
+                self.stop_profile(profiler, name)
+            if trace is not None:
+                self.write(trace.to_dict(duration, success))
+
+    def write(self, data: dict):
+        """Append a cycle to the trace file of the day."""
+        try:
+            os.makedirs(self.trace_directory, exist_ok=True)
+            path = os.path.join(self.trace_directory, datetime.now().strftime("%Y-%m-%d.jsonl"))
+            line = json.dumps(data, separators=(',', ':'), default=str)
+            with self.lock, open(path, 'a') as f:
+                f.write(line + '\n')
+        except Exception as e:
+            self.logger.error(LOG_CONST.format("Error while writing trace: ", str(e)))
+
+    def request_profile(self, cycles: int = None):
+        """Profile the next cycles (SIGUSR1)."""
+        cycles = cycles or self.profile_signal_cycles
+        with self.lock:
+            self.profile_remaining += cycles
+        self.logger.info("Profiling the next {} cycle(s).".format(cycles))
+
+    def start_profile(self):
+        with self.lock:
+            if self.profile_remaining <= 0 or not self.profile_lock.acquire(blocking=False):
+                return None
+            self.profile_remaining -= 1
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop_profile(self, profiler: cProfile.Profile, name: str):
+        profiler.disable()
+        try:
+            os.makedirs(self.profile_directory, exist_ok=True)
+            path = os.path.join(self.profile_directory, "{}-{}.prof".format(
+                name, datetime.now().strftime("%Y%m%d-%H%M%S-%f")))
+            profiler.dump_stats(path)
+            self.logger.info("Profile of a {} cycle written to {}".format(name, path))
+        except Exception as e:
+            self.logger.error(LOG_CONST.format("Error while writing profile: ", str(e)))
+        finally:
+            self.profile_lock.release()
@@ -0,0 +1,68 @@
+import threading
+from time import time
+
+from constants import *
+from spillfile import SpillFile
+
+
+class TransactionLogBuffer:
+    """Tampon d'écriture différée des journaux de transaction.
+
+    Les journaux sont accumulés puis envoyés à Directus en une seule requête
+    (POST multi-éléments) lorsque le tampon atteint sa taille maximale, son
+    âge maximal, ou à la fin de chaque cycle. Les journaux non envoyés sont
+    sauvegardés dans un fichier local et rechargés au démarrage suivant.
+    """
+
+    def __init__(self, env_vars: dict, writer):
+        self.env_vars = env_vars
+        self.writer = writer
+        self.max_size = env_vars.get(
+            "TRANSACTION_LOG_BUFFER_SIZE", DEFAULTS.get("TRANSACTION_LOG_BUFFER_SIZE"))
+        self.max_age = env_vars.get(
+            "TRANSACTION_LOG_BUFFER_AGE", DEFAULTS.get("TRANSACTION_LOG_BUFFER_AGE"))
+        self.spill_file = SpillFile(TRANSACTION_LOG_SPILL_FILE)
+
+        self.lock = threading.Lock()
+        self.records = self.spill_file.load()
+        self.first_added_at = time() if self.records else None
+
+    def add(self, record: dict):
+        """Add a record, and flush if the size or age threshold is reached."""
+        with self.lock:
+            self.records.append(record)
+            if self.first_added_at is None:
+                self.first_added_at = time()
+            must_flush = len(self.records) >= self.max_size or \
+                time() - self.first_added_at >= self.max_age
+        if must_flush:
+            self.flush()
+
+    def flush(self):
+        """Send all the buffered records in one request."""
+        with self.lock:
+            records = self.records
+            self.records = []
+            self.first_added_at = None
+        if not records:
+            return True
+
+        result = self.writer(env_vars=self.env_vars, data=records)
+        if result and result.get('success'):
+            self.spill_file.remove()
+            return True
+
+        # Remettre les journaux dans le tampon et les sauvegarder localement
+        with self.lock:
+            self.records = records + self.records
+            if self.first_added_at is None:
+                self.first_added_at = time()
+            self.spill_file.save(self.records)
+        return False
+
+    def close(self):
+        """Flush the buffer, spilling the records to disk if it fails."""
+        if not self.flush():
+            logger = self.env_vars.get('logger')
+            logger.error("{} transaction log(s) spilled to {}".format(
+                len(self.records), self.spill_file.path))
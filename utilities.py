@@ -1,51 +1,43 @@
 
-import base64
+import csv
+import io
 import json
 import multiprocessing
 import os
 import shutil
+import socket
+from functools import lru_cache
+from types import MappingProxyType
 from typing import Optional
 from constants import *
-from decouple import config
-import requests as rq
+from decouple import UndefinedValueError, config
 from datetime import datetime, timedelta
+from urllib.parse import quote
 import logging
-from logging.handlers import TimedRotatingFileHandler
 
+from admindigest import AdminDigest
+from cache import TTLCache
+from httpclient import HttpClient
+from logconfig import dropped_records, setup_logging
+from metrics import Metrics
+from minioservice import MinioService
+from polling import PollingSchedule
+from statestore import OrderStore
+from subscribers import SubscriberCache
+from tracing import Tracer
+from transactionlogs import TransactionLogBuffer
 
-def get_logger():
-    """Get the logger."""
-    try:
-        # Configuration du logger
-        logger = logging.getLogger(APP_NAME)
-        logger.setLevel(logging.DEBUG)
-
-        # Formatter pour le log
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-        if not os.path.exists(LOG_DIRECTORY):
-            os.makedirs(LOG_DIRECTORY)
-
-        # Création d'un gestionnaire de fichiers rotatif basé sur la date
-        log_filename = datetime.now().strftime("./logs/%Y-%m-%d.log")
-        file_handler = TimedRotatingFileHandler(
-            log_filename, when="midnight", interval=1, backupCount=3)
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
+_default_http_client = None
 
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.DEBUG)
-        console_handler.setFormatter(formatter)
 
-        # Ajout du gestionnaire de fichiers au logger
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-
-        return logger
+def get_logger(env_vars: Optional[dict] = None):
+    """Get the logger (the handlers are only added once)."""
+    try:
+        return setup_logging(env_vars or DEFAULTS)
     except Exception as e:
-        print("Error while getting logger: ", e)
-        return None
+        logger = logging.getLogger(APP_NAME)
+        logger.error(LOG_CONST.format("Error while getting logger: ", str(e)))
+        return logger
 
 
 def load_json(file_path: str):
@@ -73,11 +65,76 @@ def get_env_var(var_name: str):
     return config(var_name)
 
 
+@lru_cache(maxsize=None)
+def load_settings():
+    """Load and validate the settings, once."""
+    missing = []
+    settings = {}
+    for key in KEYS:
+        try:
+            settings[key] = get_env_var(key)
+        except UndefinedValueError:
+            missing.append(key)
+    if missing:
+        raise ValueError(
+            "Missing environment variables: {}".format(', '.join(missing)))
+
+    for key, default in DEFAULTS.items():
+        settings[key] = config(key, default=default, cast=type(default))
+    settings["WORKER_ID"] = settings["WORKER_ID"] or "{}-{}".format(
+        socket.gethostname(), os.getpid())
+    if not 0 <= settings["WORKER_SHARD_INDEX"] < settings["WORKER_SHARD_COUNT"]:
+        raise ValueError("WORKER_SHARD_INDEX must be between 0 and WORKER_SHARD_COUNT - 1")
+    settings["MINIO_PORT"] = int(settings["MINIO_PORT"])
+
+    return MappingProxyType(settings)
+
+
+@lru_cache(maxsize=None)
 def get_env_vars():
-    """Get all environment variables."""
-    evars = {key: get_env_var(key) for key in KEYS}
-    evars['logger'] = get_logger()
-    return evars
+    """Get all environment variables, with the shared services.
+
+    The settings are loaded and the services (logger, HTTP client, ...)
+    built only once; every call returns the same read-only mapping.
+    """
+    evars = dict(load_settings())
+    env_vars = MappingProxyType(evars)
+    evars['logger'] = get_logger(env_vars)
+    evars['metrics'] = Metrics()
+    evars['metrics'].collect(lambda: [
+        ("worker_log_records_dropped_total", {}, dropped_records(env_vars.get('logger')))])
+    evars['tracer'] = Tracer(env_vars)
+    evars['http'] = HttpClient(env_vars)
+    evars['transaction_logs'] = TransactionLogBuffer(
+        env_vars, writer=directus_create_transaction_logs)
+    evars['metrics'].collect(lambda: [
+        ("worker_transaction_logs_buffered", {}, len(env_vars.get('transaction_logs').records))])
+    evars['admin_digest'] = AdminDigest(
+        env_vars, sender=listmonk_send_email
+    ) if env_vars.get("ADMIN_DIGEST_INTERVAL") > 0 else None
+    evars['products'] = TTLCache(
+        ttl=env_vars.get("PRODUCT_CACHE_TTL"), maxsize=env_vars.get("PRODUCT_CACHE_SIZE"))
+    evars['minio'] = MinioService(env_vars)
+    evars['subscribers'] = SubscriberCache(
+        env_vars, loader=listmonk_list_subscribers)
+    evars['polling'] = PollingSchedule(env_vars.get("PENDING_POLL_STEPS"))
+    evars['settled'] = TTLCache(ttl=3600, maxsize=NLIMIT * 10)
+    evars['orders'] = OrderStore(
+        env_vars,
+        list_active=directus_list_active_orders,
+        list_changed=directus_list_orders_changed_since
+    ) if env_vars.get("STATE_STORE_ENABLED") else None
+    return env_vars
+
+
+def get_http_client(env_vars: Optional[dict] = None):
+    """Get the shared HTTP client."""
+    global _default_http_client
+    if env_vars is not None and env_vars.get('http') is not None:
+        return env_vars.get('http')
+    if _default_http_client is None:
+        _default_http_client = HttpClient(env_vars or DEFAULTS)
+    return _default_http_client
 
 
 def show_errors(res):
@@ -111,21 +168,23 @@ def get_url_of_directus_to_use(env_vars: dict):
     return env_vars.get("URL_OF_DIRECTUS_INPROD") if env_vars.get("ENV") == "inprod" else env_vars.get("URL_OF_DIRECTUS_NOPROD")
 
 
-def make_get_request(base_url: str, endpoint: str, headers: dict):
+def make_get_request(base_url: str, endpoint: str, headers: dict, env_vars: Optional[dict] = None):
     """Make a GET request."""
     try:
         urlcomplete = base_url + endpoint
-        res = rq.request("GET", urlcomplete, headers=headers)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DEFAULT, "GET", urlcomplete, headers=headers)
         return res
     except Exception as e:
         return None
 
 
-def make_post_request(base_url: str, endpoint: str, headers: dict, payload: dict):
+def make_post_request(base_url: str, endpoint: str, headers: dict, payload: dict, env_vars: Optional[dict] = None):
     """Make a POST request."""
     try:
         urlcomplete = base_url + endpoint
-        res = rq.request("POST", urlcomplete, headers=headers, data=payload)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DEFAULT, "POST", urlcomplete, headers=headers, data=payload)
         return res
     except Exception as e:
         return None
@@ -139,19 +198,10 @@ def listmonk_create_subscriber(env_vars: dict, data: dict):
     try:
         urlcomplete = env_vars.get("LISTMONK_API_URL") + '/subscribers'
 
-        basic_token = base64.b64encode(
-            f"{env_vars.get('LISTMONK_API_USERNAME')}:{env_vars.get('LISTMONK_API_PASSWORD')}"
-            .encode()
-        ).decode('utf-8')
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'Basic {basic_token}'
-        }
         payload = json.dumps(data)
 
-        res = rq.request("POST", urlcomplete, headers=headers, data=payload)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_LISTMONK, "POST", urlcomplete, data=payload, idempotent=True)
         if res.status_code not in [200, 201]:
             error = show_errors(res)
             return {
@@ -175,6 +225,190 @@ def listmonk_create_subscriber(env_vars: dict, data: dict):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
+
+
+def listmonk_list_subscribers(env_vars: dict, page_size: Optional[int] = None):
+    """List subscribers, page by page."""
+    logger = env_vars.get('logger')
+    base_error = "Error while listing subscribers: "
+    error = ""
+    page_size = page_size or env_vars.get("LISTMONK_PAGE_SIZE", NLIMIT)
+    page = 1
+    try:
+        while True:
+            urlcomplete = env_vars.get("LISTMONK_API_URL") + \
+                '/subscribers?page={}&per_page={}'.format(page, page_size)
+
+            res = get_http_client(env_vars).request(
+                UPSTREAM_LISTMONK, "GET", urlcomplete)
+            if res.status_code not in [200, 201]:
+                error = show_errors(res)
+                yield {
+                    'success': False,
+                    'status_code': res.status_code,
+                    'message': error
+                }
+                return
+
+            results = res.json().get('data').get('results') or []
+            yield {
+                'success': True,
+                'message': 'Subscribers listed with success.',
+                'data': results
+            }
+
+            if len(results) < page_size:
+                return
+            page += 1
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        yield {
+            'success': False,
+            'message': error
+        }
+
+
+def listmonk_search_subscribers(env_vars: dict, emails: list):
+    """Find which of the given emails are already subscribers."""
+    logger = env_vars.get('logger')
+    base_error = "Error while searching subscribers: "
+    error = ""
+    try:
+        # Expression SQL de Listmonk : les apostrophes sont doublées
+        query = "subscribers.email IN ({})".format(', '.join(
+            "'{}'".format(email.replace("'", "''")) for email in emails))
+        urlcomplete = env_vars.get("LISTMONK_API_URL") + \
+            '/subscribers?per_page={}&query={}'.format(len(emails), quote(query))
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_LISTMONK, "GET", urlcomplete)
+        if res.status_code not in [200, 201]:
+            error = show_errors(res)
+            return {
+                'success': False,
+                'status_code': res.status_code,
+                'message': error
+            }
+        else:
+            results = res.json().get('data').get('results') or []
+            return {
+                'success': True,
+                'message': 'Subscribers searched with success.',
+                'data': [subscriber.get('email') for subscriber in results]
+            }
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        return {
+            'success': False,
+            'message': error
+        }
+
+
+def listmonk_import_subscribers(env_vars: dict, subscribers: list, lists: list):
+    """Start an import of subscribers (CSV upload, processed by Listmonk in the background)."""
+    logger = env_vars.get('logger')
+    base_error = "Error while importing subscribers: "
+    error = ""
+    try:
+        urlcomplete = env_vars.get("LISTMONK_API_URL") + '/import/subscribers'
+
+        csv_file = io.StringIO()
+        writer = csv.writer(csv_file)
+        writer.writerow(['email', 'name', 'attributes'])
+        for subscriber in subscribers:
+            writer.writerow([subscriber.get('email'), subscriber.get('name'), '{}'])
+        params = json.dumps({
+            'mode': 'subscribe',
+            'delim': ',',
+            'lists': lists,
+            'overwrite': False
+        })
+
+        # Content-Type retiré de la session : requests génère celui du multipart
+        res = get_http_client(env_vars).request(
+            UPSTREAM_LISTMONK, "POST", urlcomplete,
+            data={'params': params},
+            files={'file': ('subscribers.csv', csv_file.getvalue().encode(), 'text/csv')},
+            headers={'Content-Type': None})
+        if res.status_code not in [200, 201]:
+            error = show_errors(res)
+            return {
+                'success': False,
+                'status_code': res.status_code,
+                'message': error
+            }
+        else:
+            logger.info("Subscriber import started with success.")
+            return {
+                'success': True,
+                'message': 'Subscriber import started with success.',
+                'data': res.json().get('data')
+            }
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        return {
+            'success': False,
+            'message': error
+        }
+
+
+def listmonk_get_import_status(env_vars: dict):
+    """Get the status of the last subscriber import."""
+    logger = env_vars.get('logger')
+    base_error = "Error while getting import status: "
+    error = ""
+    try:
+        urlcomplete = env_vars.get("LISTMONK_API_URL") + '/import/subscribers'
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_LISTMONK, "GET", urlcomplete)
+        if res.status_code not in [200, 201]:
+            error = show_errors(res)
+            return {
+                'success': False,
+                'status_code': res.status_code,
+                'message': error
+            }
+        else:
+            return {
+                'success': True,
+                'message': 'Import status retrieved with success.',
+                'data': res.json().get('data')
+            }
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        return {
+            'success': False,
+            'message': error
+        }
 
 
 def listmonk_send_email(env_vars: dict, data: dict):
@@ -185,19 +419,10 @@ def listmonk_send_email(env_vars: dict, data: dict):
     try:
         urlcomplete = env_vars.get("LISTMONK_API_URL") + '/tx'
 
-        basic_token = base64.b64encode(
-            f"{env_vars.get('LISTMONK_API_USERNAME')}:{env_vars.get('LISTMONK_API_PASSWORD')}"
-            .encode()
-        ).decode('utf-8')
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'Basic {basic_token}'
-        }
         payload = json.dumps(data)
 
-        res = rq.request("POST", urlcomplete, headers=headers, data=payload)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_LISTMONK, "POST", urlcomplete, data=payload)
         if res.status_code not in [200, 201]:
             error = show_errors(res)
             return {
@@ -220,6 +445,10 @@ def listmonk_send_email(env_vars: dict, data: dict):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
 
 
 def cinetpay_check_transaction(env_vars: dict, transaction_code: str):
@@ -229,17 +458,15 @@ def cinetpay_check_transaction(env_vars: dict, transaction_code: str):
     error = ""
     try:
         urlcomplete = env_vars.get("CINETPAY_CHECK_URL")
-        headers = {
-            'Content-Type': 'application/json'
-        }
         payload = json.dumps({
             'apikey': env_vars.get("CINETPAY_API_KEY"),
             'site_id': env_vars.get("CINETPAY_SITE_ID"),
             'transaction_id': transaction_code
         })
 
-        res = rq.request("POST", urlcomplete, headers=headers,
-                         data=payload, verify=True)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_CINETPAY, "POST", urlcomplete, data=payload, verify=True,
+            idempotent=True)
         if res.status_code not in [200, 201]:
             error = show_errors(res)
             return {
@@ -260,6 +487,10 @@ def cinetpay_check_transaction(env_vars: dict, transaction_code: str):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
 
 
 def directus_retrieve_product(env_vars: dict, product_id: str):
@@ -270,12 +501,9 @@ def directus_retrieve_product(env_vars: dict, product_id: str):
     try:
         urlcomplete = get_url_of_directus_to_use(
             env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_PRODUCT") + '/' + product_id
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
 
-        res = rq.request("GET", urlcomplete, headers=headers)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "GET", urlcomplete)
         if res.status_code not in [200, 201]:
             error = show_directus_errors(res)
             return {
@@ -297,40 +525,42 @@ def directus_retrieve_product(env_vars: dict, product_id: str):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
 
 
-def directus_list_orders(env_vars: dict, transaction_status: Optional[int] = None):
-    """List orders."""
+def directus_retrieve_pending_order(env_vars: dict, code: str):
+    """Retrieve a pending order by its code."""
     logger = env_vars.get('logger')
-    base_error = "Error while listing orders: "
+    base_error = "Error while retrieving pending order: "
     error = ""
     try:
         urlcomplete = get_url_of_directus_to_use(
             env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
 
-        urlcomplete += '?filter[status][_eq]={}'.format(ORDER_STATUS_STARTED)
+        urlcomplete += '?filter[code][_eq]={}'.format(quote(code))
+        urlcomplete += '&filter[status][_eq]={}'.format(ORDER_STATUS_STARTED)
         urlcomplete += '&filter[transaction_status][_eq]={}'.format(
-            transaction_status)
-
-        print(urlcomplete)
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
+            TRANSACTION_STATUS_PENDING)
+        urlcomplete += '&limit=1'
 
-        res = rq.request("GET", urlcomplete, headers=headers)
-        if res.status_code not in [200, 201, 204]:
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "GET", urlcomplete)
+        if res.status_code not in [200, 201]:
             error = show_directus_errors(res)
             return {
                 'success': False,
                 'message': error
             }
         else:
-            logger.info("Orders listed with success.")
+            data = res.json()['data']
+            logger.info("Pending order retrieved with success.")
             return {
                 'success': True,
-                'message': 'Orders listed with success.',
-                'data': res.json()['data']
+                'message': 'Pending order retrieved with success.',
+                'data': data[0] if data else None
             }
     except Exception as e:
         error = str(e)
@@ -340,45 +570,191 @@ def directus_list_orders(env_vars: dict, transaction_status: Optional[int] = Non
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
 
 
-def directus_list_abandoned_orders(env_vars: dict):
-    """List abandoned orders."""
+def directus_list_pages(env_vars: dict, urlcomplete: str, message: str, base_error: str, page_size: Optional[int] = None):
+    """List items page by page (keyset pagination on id).
+
+    Yields one result per page, so the caller can start working before the
+    whole collection is fetched. Items updated by the caller while iterating
+    (and leaving the filter) do not shift the following pages.
+    """
     logger = env_vars.get('logger')
-    base_error = "Error while listing abandoned orders: "
     error = ""
+    page_size = page_size or env_vars.get("DIRECTUS_PAGE_SIZE", NLIMIT)
+    separator = '&' if '?' in urlcomplete else '?'
+    last_id = None
     try:
-        # Calculer la date actuelle moins un jour avec heures, minutes et secondes
-        filter_date = (datetime.now() - timedelta(days=DAYS_TO_ABANDON_ORDER)
-                       ).strftime("%Y-%m-%dT%H:%M:%S")
-        print('filter_date', filter_date)
+        while True:
+            urlpage = urlcomplete + separator + \
+                'sort=id&limit={}'.format(page_size)
+            if last_id is not None:
+                urlpage += '&filter[id][_gt]={}'.format(last_id)
+
+            res = get_http_client(env_vars).request(
+                UPSTREAM_DIRECTUS, "GET", urlpage)
+            if res.status_code not in [200, 201, 204]:
+                error = show_directus_errors(res)
+                yield {
+                    'success': False,
+                    'message': error
+                }
+                return
+
+            data = res.json()['data']
+            logger.info(message)
+            yield {
+                'success': True,
+                'message': message,
+                'data': data
+            }
 
-        # Construire l'URL avec le filtre complet
-        urlcomplete = (
-            get_url_of_directus_to_use(env_vars)
-            + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
-            + f"?filter[status][_eq]={ORDER_STATUS_STARTED}&filter[date_created][_lt]={filter_date}"
+            if len(data) < page_size:
+                return
+            last_id = data[-1].get('id')
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
         )
-        print('urlcomplete', urlcomplete)
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
+        yield {
+            'success': False,
+            'message': error
         }
 
-        res = rq.request("GET", urlcomplete, headers=headers)
-        if res.status_code not in [200, 201, 204]:
+
+def directus_list_orders(env_vars: dict, transaction_status: Optional[int] = None, page_size: Optional[int] = None):
+    """List orders, page by page."""
+    urlcomplete = get_url_of_directus_to_use(
+        env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+
+    urlcomplete += '?filter[status][_eq]={}'.format(ORDER_STATUS_STARTED)
+    urlcomplete += '&filter[transaction_status][_eq]={}'.format(
+        transaction_status)
+
+    return directus_list_pages(
+        env_vars=env_vars,
+        urlcomplete=urlcomplete,
+        message="Orders listed with success.",
+        base_error="Error while listing orders: ",
+        page_size=page_size
+    )
+
+
+def directus_list_abandoned_orders(env_vars: dict, page_size: Optional[int] = None):
+    """List abandoned orders, page by page."""
+    # Calculer la date actuelle moins un jour avec heures, minutes et secondes
+    filter_date = (datetime.now() - timedelta(days=DAYS_TO_ABANDON_ORDER)
+                   ).strftime("%Y-%m-%dT%H:%M:%S")
+
+    # Construire l'URL avec le filtre complet
+    urlcomplete = (
+        get_url_of_directus_to_use(env_vars)
+        + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+        + f"?filter[status][_eq]={ORDER_STATUS_STARTED}&filter[date_created][_lt]={filter_date}"
+        + "&fields=id"
+    )
+
+    return directus_list_pages(
+        env_vars=env_vars,
+        urlcomplete=urlcomplete,
+        message="Abandoned orders listed with success.",
+        base_error="Error while listing abandoned orders: ",
+        page_size=page_size
+    )
+
+# where product_is_delivered = false
+
+
+def directus_list_orders_with_product_not_delivered(env_vars: dict, page_size: Optional[int] = None):
+    """List orders with product not delivered, page by page."""
+    urlcomplete = (
+        get_url_of_directus_to_use(env_vars)
+        + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+        + "?filter[transaction_status][_eq]=2"
+        + "&filter[product_is_delivered][_eq]=false"
+        + "&fields=*,tunnel.*,tunnel.product.*"
+    )
+
+    return directus_list_pages(
+        env_vars=env_vars,
+        urlcomplete=urlcomplete,
+        message="Orders with product not delivered listed with success.",
+        base_error="Error while listing orders with product not delivered: ",
+        page_size=page_size
+    )
+
+
+def directus_list_active_orders(env_vars: dict, page_size: Optional[int] = None):
+    """List the orders the worker may have to process, page by page."""
+    urlcomplete = (
+        get_url_of_directus_to_use(env_vars)
+        + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+        + f"?filter[_or][0][status][_eq]={ORDER_STATUS_STARTED}"
+        + f"&filter[_or][1][_and][0][transaction_status][_eq]={TRANSACTION_STATUS_ACCEPTED}"
+        + "&filter[_or][1][_and][1][product_is_delivered][_eq]=false"
+        + "&fields=*,tunnel.*,tunnel.product.*"
+    )
+
+    return directus_list_pages(
+        env_vars=env_vars,
+        urlcomplete=urlcomplete,
+        message="Active orders listed with success.",
+        base_error="Error while listing active orders: ",
+        page_size=page_size
+    )
+
+
+def directus_list_orders_changed_since(env_vars: dict, since: str, page_size: Optional[int] = None):
+    """List the orders created or updated since a date, page by page."""
+    urlcomplete = (
+        get_url_of_directus_to_use(env_vars)
+        + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+        + f"?filter[_or][0][date_updated][_gte]={since}"
+        + f"&filter[_or][1][date_created][_gte]={since}"
+        + "&fields=*,tunnel.*,tunnel.product.*"
+    )
+
+    return directus_list_pages(
+        env_vars=env_vars,
+        urlcomplete=urlcomplete,
+        message="Changed orders listed with success.",
+        base_error="Error while listing changed orders: ",
+        page_size=page_size
+    )
+
+
+def directus_update_order(env_vars: dict, order_id: str, data: dict):
+    """Update order."""
+    logger = env_vars.get('logger')
+    base_error = "Error while updating order: "
+    error = ""
+    try:
+        urlcomplete = get_url_of_directus_to_use(
+            env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER") + '/' + order_id
+        payload = json.dumps(data)
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "PATCH", urlcomplete, data=payload, idempotent=True)
+        if res.status_code not in [200, 201]:
             error = show_directus_errors(res)
             return {
                 'success': False,
                 'message': error
             }
         else:
-            logger.info("Abandoned orders listed with success.")
+            logger.info("Order updated with success.")
             return {
                 'success': True,
-                'message': 'Abandoned orders listed with success.',
-                'data': res.json()['data']
+                'message': 'Order updated with success.',
+                'data': res.json()
             }
     except Exception as e:
         error = str(e)
@@ -388,43 +764,159 @@ def directus_list_abandoned_orders(env_vars: dict):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
 
-# where product_is_delivered = false
+
+def directus_update_orders(env_vars: dict, data: dict, keys: Optional[list] = None, query: Optional[dict] = None, chunk_size: Optional[int] = None):
+    """Update several orders at once (multi-item PATCH).
+
+    The orders are selected either by a list of keys, sent in chunks of
+    chunk_size, or by a filter query sent in a single request. The result
+    reports, for each chunk, the updated keys and whether it succeeded.
+    """
+    logger = env_vars.get('logger')
+    base_error = "Error while updating orders: "
+    error = ""
+    urlcomplete = get_url_of_directus_to_use(
+        env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+    chunk_size = chunk_size or env_vars.get("DIRECTUS_BATCH_SIZE", NLIMIT)
+
+    if keys is not None:
+        bodies = [
+            {'keys': keys[i:i + chunk_size], 'data': data}
+            for i in range(0, len(keys), chunk_size)
+        ]
+    else:
+        bodies = [{'query': query, 'data': data}]
+
+    chunks = []
+    for body in bodies:
+        chunk_keys = body.get('keys', [])
+        try:
+            res = get_http_client(env_vars).request(
+                UPSTREAM_DIRECTUS, "PATCH", urlcomplete, data=json.dumps(body),
+                idempotent=True)
+            if res.status_code not in [200, 201, 204]:
+                error = show_directus_errors(res)
+                logger.error(LOG_CONST.format(base_error, error))
+                chunks.append({
+                    'success': False,
+                    'keys': chunk_keys,
+                    'message': error
+                })
+            else:
+                if keys is None and res.status_code != 204:
+                    chunk_keys = [item.get('id')
+                                  for item in res.json().get('data') or []]
+                chunks.append({
+                    'success': True,
+                    'keys': chunk_keys
+                })
+        except Exception as e:
+            error = str(e)
+            logger.error(
+                LOG_CONST.format(
+                    base_error,
+                    error
+                )
+            )
+            chunks.append({
+                'success': False,
+                'keys': chunk_keys,
+                'message': error
+            })
+
+    nsuccess = len([chunk for chunk in chunks if chunk.get('success')])
+    nfailure = len(chunks) - nsuccess
+    updated = sum(len(chunk.get('keys'))
+                  for chunk in chunks if chunk.get('success'))
+    failed = sum(len(chunk.get('keys'))
+                 for chunk in chunks if not chunk.get('success'))
+    message = 'Orders updated: {} chunk(s) succeeded ({} orders), {} chunk(s) failed ({} orders).'.format(
+        nsuccess, updated, nfailure, failed)
+    logger.info(message)
+    return {
+        'success': nfailure == 0,
+        'message': message,
+        'data': {
+            'succeeded_chunks': nsuccess,
+            'failed_chunks': nfailure,
+            'updated': updated,
+            'failed': failed,
+            'chunks': chunks
+        }
+    }
 
 
-def directus_list_orders_with_product_not_delivered(env_vars: dict):
-    """List orders with product not delivered."""
+def directus_list_order_claims(env_vars: dict, keys: list):
+    """List the claims of some orders."""
     logger = env_vars.get('logger')
-    base_error = "Error while listing orders with product not delivered: "
+    base_error = "Error while listing order claims: "
     error = ""
     try:
-        urlcomplete = (
-            get_url_of_directus_to_use(env_vars)
-            + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
-            + "?filter[transaction_status][_eq]=2"
-            + "&filter[product_is_delivered][_eq]=false"
-            + "&fields=*,tunnel.*"
-        )
+        urlcomplete = get_url_of_directus_to_use(
+            env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER_CLAIM")
+
+        urlcomplete += '?filter[order_id][_in]={}'.format(
+            ','.join(str(key) for key in keys))
+        urlcomplete += '&fields=id,order_id,generation,owner,expires_at&limit=-1'
 
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "GET", urlcomplete)
+        if res.status_code not in [200, 201]:
+            error = show_directus_errors(res)
+            return {
+                'success': False,
+                'message': error
+            }
+        else:
+            return {
+                'success': True,
+                'message': 'Order claims listed with success.',
+                'data': res.json()['data']
+            }
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        return {
+            'success': False,
+            'message': error
         }
 
-        res = rq.request("GET", urlcomplete, headers=headers)
+
+def directus_create_order_claims(env_vars: dict, data: list):
+    """Create several order claims in one request (all or none of them)."""
+    logger = env_vars.get('logger')
+    base_error = "Error while creating order claims: "
+    error = ""
+    try:
+        urlcomplete = get_url_of_directus_to_use(
+            env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER_CLAIM")
+
+        payload = json.dumps(data)
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "POST", urlcomplete, data=payload)
         if res.status_code not in [200, 201, 204]:
             error = show_directus_errors(res)
             return {
                 'success': False,
+                'status_code': res.status_code,
                 'message': error
             }
         else:
-            logger.info(
-                "Orders with product not delivered listed with success.")
             return {
                 'success': True,
-                'message': 'Orders with product not delivered listed with success.',
-                'data': res.json()['data']
+                'message': 'Order claims created with success.',
+                'data': res.json() if res.status_code != 204 else None
             }
     except Exception as e:
         error = str(e)
@@ -434,23 +926,90 @@ def directus_list_orders_with_product_not_delivered(env_vars: dict):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
 
 
-def directus_update_order(env_vars: dict, order_id: str, data: dict):
-    """Update order."""
+def directus_delete_order_claims(env_vars: dict, keys: list):
+    """Delete several order claims in one request."""
     logger = env_vars.get('logger')
-    base_error = "Error while updating order: "
+    base_error = "Error while deleting order claims: "
     error = ""
     try:
         urlcomplete = get_url_of_directus_to_use(
-            env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER") + '/' + order_id
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
+            env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER_CLAIM")
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "DELETE", urlcomplete, data=json.dumps(keys))
+        if res.status_code not in [200, 204]:
+            error = show_directus_errors(res)
+            logger.error(LOG_CONST.format(base_error, error))
+            return {
+                'success': False,
+                'message': error
+            }
+        else:
+            return {
+                'success': True,
+                'message': 'Order claims deleted with success.'
+            }
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        return {
+            'success': False,
+            'message': error
         }
-        payload = json.dumps(data)
 
-        res = rq.request("PATCH", urlcomplete, headers=headers, data=payload)
+
+def parse_directus_date(value: str):
+    """Parse a Directus date (with or without milliseconds and Z)."""
+    return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+def directus_list_expired_order_claims(env_vars: dict, before: str, page_size: Optional[int] = None):
+    """List the order claims expired before a date, page by page."""
+    urlcomplete = (
+        get_url_of_directus_to_use(env_vars)
+        + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER_CLAIM")
+        + f"?filter[expires_at][_lt]={before}"
+        + "&fields=id,order_id"
+    )
+
+    return directus_list_pages(
+        env_vars=env_vars,
+        urlcomplete=urlcomplete,
+        message="Expired order claims listed with success.",
+        base_error="Error while listing expired order claims: ",
+        page_size=page_size
+    )
+
+
+def directus_list_active_order_keys(env_vars: dict, keys: list):
+    """Keep the keys of the orders the worker may still have to process."""
+    logger = env_vars.get('logger')
+    base_error = "Error while listing active orders: "
+    error = ""
+    try:
+        urlcomplete = (
+            get_url_of_directus_to_use(env_vars)
+            + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_ORDER")
+            + "?filter[id][_in]={}".format(','.join(str(key) for key in keys))
+            + f"&filter[_or][0][status][_eq]={ORDER_STATUS_STARTED}"
+            + f"&filter[_or][1][_and][0][transaction_status][_eq]={TRANSACTION_STATUS_ACCEPTED}"
+            + "&filter[_or][1][_and][1][product_is_delivered][_eq]=false"
+            + "&fields=id&limit=-1"
+        )
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "GET", urlcomplete)
         if res.status_code not in [200, 201]:
             error = show_directus_errors(res)
             return {
@@ -458,11 +1017,10 @@ def directus_update_order(env_vars: dict, order_id: str, data: dict):
                 'message': error
             }
         else:
-            logger.info("Order updated with success.")
             return {
                 'success': True,
-                'message': 'Order updated with success.',
-                'data': res.json()
+                'message': 'Active orders listed with success.',
+                'data': [item.get('id') for item in res.json()['data']]
             }
     except Exception as e:
         error = str(e)
@@ -472,6 +1030,88 @@ def directus_update_order(env_vars: dict, order_id: str, data: dict):
                 error
             )
         )
+        return {
+            'success': False,
+            'message': error
+        }
+
+
+def directus_claim_orders(env_vars: dict, keys: list, owner: str, duration: float):
+    """Claim orders for a worker instance.
+
+    A claim is a row of the claim collection whose key is
+    "<order id>:<generation>". Creating it is atomic: if two instances try
+    to take the same generation of a claim, the second insert fails on the
+    duplicate key, so exactly one of them wins. An order is claimed when it
+    has no claim or its last claim expired (next generation), and renewed
+    when its last claim is ours and past half its duration. Returns the
+    claimed keys.
+    """
+    now = datetime.utcnow()
+    renew_before = now + timedelta(seconds=duration / 2)
+    expires_at = (now + timedelta(seconds=duration)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    chunk_size = env_vars.get("DIRECTUS_BATCH_SIZE", NLIMIT)
+
+    def create(claims: list):
+        """Create claims, return the keys of the orders won."""
+        if not claims:
+            return []
+        if directus_create_order_claims(env_vars=env_vars, data=claims).get('success'):
+            return [claim.get('order_id') for claim in claims]
+        if len(claims) == 1:
+            return []
+        # Un lot est créé en entier ou pas du tout : une seule réservation
+        # prise par une autre instance le fait échouer, on réessaie une à une
+        return [
+            claim.get('order_id')
+            for claim in claims
+            if directus_create_order_claims(env_vars=env_vars, data=[claim]).get('success')
+        ]
+
+    claimed = []
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        r_dts_claims = directus_list_order_claims(env_vars=env_vars, keys=chunk)
+        if not r_dts_claims.get('success'):
+            continue
+
+        claims = {}
+        for claim in r_dts_claims.get('data'):
+            claims.setdefault(str(claim.get('order_id')), []).append(claim)
+        new_claims = []
+        for key in chunk:
+            history = sorted(claims.get(str(key), []), key=lambda claim: claim.get('generation'))
+            last = history[-1] if history else None
+            if last is not None:
+                last_expires_at = parse_directus_date(last.get('expires_at'))
+                if last_expires_at > now and last.get('owner') != owner:
+                    continue
+                if last_expires_at > renew_before:
+                    claimed.append(key)
+                    continue
+            generation = last.get('generation') + 1 if last is not None else 1
+            new_claims.append({
+                'id': '{}:{}'.format(key, generation),
+                'order_id': key,
+                'generation': generation,
+                'owner': owner,
+                'expires_at': expires_at
+            })
+        won = create(new_claims)
+        claimed.extend(won)
+
+        # Ne garder que les deux dernières générations des commandes prises :
+        # une génération supprimée pourrait sinon être recréée par une
+        # instance qui aurait lu les réservations juste avant
+        won = set(str(key) for key in won)
+        stale = [
+            claim.get('id')
+            for key, history in claims.items() if key in won
+            for claim in sorted(history, key=lambda claim: claim.get('generation'))[:-1]
+        ]
+        if stale:
+            directus_delete_order_claims(env_vars=env_vars, keys=stale)
+    return claimed
 
 
 def directus_create_transaction_log(env_vars: dict, data: dict):
@@ -483,13 +1123,10 @@ def directus_create_transaction_log(env_vars: dict, data: dict):
         urlcomplete = get_url_of_directus_to_use(
             env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_TRANSACTION_LOG")
 
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
         payload = json.dumps(data)
 
-        res = rq.request("POST", urlcomplete, headers=headers, data=payload)
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "POST", urlcomplete, data=payload)
         if res.status_code not in [200, 201]:
             error = show_directus_errors(res)
             return {
@@ -511,3 +1148,45 @@ def directus_create_transaction_log(env_vars: dict, data: dict):
                 error
             )
         )
+
+
+def directus_create_transaction_logs(env_vars: dict, data: list):
+    """Create several transaction logs in one request."""
+    logger = env_vars.get('logger')
+    base_error = "Error while creating transaction logs: "
+    error = ""
+    try:
+        urlcomplete = get_url_of_directus_to_use(
+            env_vars) + env_vars.get("ROUTE_OF_DIRECTUS_FOR_DGEASS_TRANSACTION_LOG")
+
+        payload = json.dumps(data)
+
+        res = get_http_client(env_vars).request(
+            UPSTREAM_DIRECTUS, "POST", urlcomplete, data=payload)
+        if res.status_code not in [200, 201, 204]:
+            error = show_directus_errors(res)
+            logger.error(LOG_CONST.format(base_error, error))
+            return {
+                'success': False,
+                'message': error
+            }
+        else:
+            logger.info(
+                "{} transaction log(s) created with success.".format(len(data)))
+            return {
+                'success': True,
+                'message': 'Transaction logs created with success.',
+                'data': res.json() if res.status_code != 204 else None
+            }
+    except Exception as e:
+        error = str(e)
+        logger.error(
+            LOG_CONST.format(
+                base_error,
+                error
+            )
+        )
+        return {
+            'success': False,
+            'message': error
+        }
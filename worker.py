@@ -1,28 +1,141 @@
-from time import sleep, time
-from joblib import Parallel, delayed
-from datetime import datetime
+"""Worker Digital Geass : vérification des paiements, abandon et livraison des commandes.
+
+Exemples :
+    python worker.py                              # tourne en continu
+    python worker.py --once                       # un cycle de chaque tâche
+    python worker.py --once --only pending,deliver
+    python worker.py --check                      # valide la configuration
+
+Codes de sortie : 0 si tout a réussi, 1 si une tâche a échoué (--once), 2
+pour une erreur dans les arguments, 3 pour une erreur de configuration.
+"""
+import argparse
+import atexit
+import sys
 
 from constants import *
-from functions import treat_abandoned_orders, treat_not_delivered_orders, treat_pending_orders
-from utilities import get_env_vars
+from scheduler import ScheduledTask, Scheduler
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_CONFIG = 3
+
+# Tâches du worker et préfixe de leurs réglages
+TASKS = {
+    "pending": "PENDING_ORDERS",
+    "abandoned": "ABANDONED_ORDERS",
+    "deliver": "NOT_DELIVERED_ORDERS",
+}
+
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--once', action='store_true',
+                        help="run one cycle of the tasks, then exit")
+    parser.add_argument('--only', default=None, metavar='TASKS',
+                        help="comma-separated tasks to run ({})".format(', '.join(TASKS)))
+    parser.add_argument('--check', action='store_true',
+                        help="load the settings and build the services, then exit")
+    args = parser.parse_args(argv)
+
+    args.tasks = list(TASKS)
+    if args.only is not None:
+        args.tasks = [name.strip() for name in args.only.split(',') if name.strip()]
+        unknown = [name for name in args.tasks if name not in TASKS]
+        if unknown or not args.tasks:
+            parser.error("unknown task(s) in --only: {}".format(', '.join(unknown) or args.only))
+    args.parser = parser
+    return args
+
+
+def get_pending_interval(env_vars: dict):
+    """Interval of the pending task, shorter when it reads the local order index."""
+    if env_vars.get("STATE_STORE_ENABLED"):
+        return env_vars.get("PENDING_ORDERS_STORE_INTERVAL")
+    return env_vars.get("PENDING_ORDERS_INTERVAL")
+
+
+def build_tasks(env_vars: dict, names: list, pending_interval: float):
+    """Scheduled tasks, in the order of names."""
+    from functions import treat_abandoned_orders, treat_not_delivered_orders, treat_pending_orders
+
+    funcs = {
+        # Treat the pending transactions
+        "pending": treat_pending_orders,
+        # Treat the abandoned orders
+        "abandoned": treat_abandoned_orders,
+        # Treat the orders with product not delivered
+        "deliver": treat_not_delivered_orders,
+    }
+    return [
+        ScheduledTask(
+            name=name,
+            func=funcs[name],
+            interval=pending_interval if name == "pending" else env_vars.get(f"{TASKS[name]}_INTERVAL"),
+            jitter=env_vars.get(f"{TASKS[name]}_JITTER"),
+            max_runtime=env_vars.get(f"{TASKS[name]}_MAX_RUNTIME"),
+        )
+        for name in names
+    ]
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
 
-env_vars = get_env_vars()
-logger = env_vars.get("logger")
+    from utilities import get_env_vars
+    try:
+        env_vars = get_env_vars()
+    except ValueError as e:
+        args.parser.exit(EXIT_CONFIG, "Configuration error: {}\n".format(e))
+    logger = env_vars.get("logger")
+    if args.check:
+        logger.info("Configuration loaded, services built.")
+        return EXIT_OK
 
-sys_waitime = 30
+    # Sauvegarder les journaux de transaction en attente à l'arrêt
+    atexit.register(env_vars.get("transaction_logs").close)
 
-# print(env_vars)
+    # Précharger le cache des abonnés Listmonk (livraisons seulement)
+    if "deliver" in args.tasks:
+        if env_vars.get("SUBSCRIBER_CACHE_WARM") and env_vars.get("subscribers").is_stale():
+            env_vars.get("subscribers").warm()
+        atexit.register(env_vars.get("subscribers").save)
+        # Envoyer le résumé en cours des administrateurs à l'arrêt ; en mode
+        # --once, il n'est envoyé qu'une fois sa période écoulée
+        if env_vars.get("admin_digest") is not None:
+            atexit.register(env_vars.get("admin_digest").close, force=not args.once)
 
+    if args.once:
+        tasks = build_tasks(env_vars, args.tasks, get_pending_interval(env_vars))
+        results = Scheduler(env_vars, tasks).run_once()
+        failed = [name for name, success in results.items() if not success]
+        if failed:
+            logger.error("Task(s) failed: {}".format(', '.join(failed)))
+            return EXIT_FAILURE
+        logger.info("Task(s) done: {}".format(', '.join(results)))
+        return EXIT_OK
 
-while True:
+    # Exposer les métriques et l'état de santé
+    if env_vars.get("METRICS_ENABLED"):
+        from metrics import MetricsServer
+        metrics_server = MetricsServer(env_vars)
+        metrics_server.start()
+        atexit.register(metrics_server.stop)
 
-    # Treat the pending transactions
-    treat_pending_orders(env_vars)
+    # Notifications de paiement CinetPay : la vérification périodique des
+    # commandes en attente ne sert plus que de rattrapage
+    pending_interval = get_pending_interval(env_vars)
+    if env_vars.get("CINETPAY_NOTIFY_ENABLED") and "pending" in args.tasks:
+        from notifications import NotificationReceiver
+        receiver = NotificationReceiver(env_vars)
+        receiver.start()
+        atexit.register(receiver.stop)
+        pending_interval = env_vars.get("PENDING_ORDERS_RECONCILE_INTERVAL")
 
-    # Treat the abandoned orders
-    treat_abandoned_orders(env_vars)
+    # Chaque tâche a son propre intervalle, et les tâches tournent en parallèle
+    Scheduler(env_vars, build_tasks(env_vars, args.tasks, pending_interval)).run()
+    return EXIT_OK
 
-    # Treat the orders with product not delivered
-    treat_not_delivered_orders(env_vars)
 
-    sleep(sys_waitime)
+if __name__ == '__main__':
+    sys.exit(main())